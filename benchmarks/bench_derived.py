@@ -0,0 +1,123 @@
+"""
+Before/after benchmark of the derived DLY_FLOWS database
+(dashboard/derived_hydat.py) against HYDAT as shipped, on the synthetic
+HYDAT fixture (see fixtures.py).
+
+Builds the derived database next to the fixture's Hydat.sqlite3, checks
+that both return the same series, and times the per-station query and
+the batched query of the landing station's neighbours on each, with a
+warm connection, and with a new connection per query on a file dropped
+from the OS page cache (on Linux) to see the reads the layout saves.
+
+    python benchmarks/bench_derived.py [--runs 20] [--stations 10]
+        [--fixture benchmarks/fixture]
+"""
+import argparse
+import os
+import sys
+import time
+
+from fixtures import FIXTURE_DIR, LANDING_STATION, fixture_env, make_fixture
+from suite import DASHBOARD_DIR, summarize, time_runs
+
+
+def time_queries(fn, stations, runs):
+    """
+    :return: seconds of each call of fn(station), warmed up once
+    """
+    for station in stations:
+        fn(station)
+    times = []
+    for _ in range(runs):
+        for station in stations:
+            t0 = time.perf_counter()
+            fn(station)
+            times.append(time.perf_counter() - t0)
+    return times
+
+
+def drop_page_cache(filename):
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def same_results(a, b):
+    return a.keys() == b.keys() and all(
+        (a[k] is None and b[k] is None) or
+        (a[k] is not None and b[k] is not None and a[k].equals(b[k]))
+        for k in a)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--fixture', default=FIXTURE_DIR)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--stations', type=int, default=10)
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.fixture, 'fixture.json')):
+        print('Generating the fixture in {}'.format(args.fixture))
+        make_fixture(args.fixture)
+    os.environ.update(fixture_env(args.fixture))
+    os.environ.update({'WSC_SHARED_DIR': '', 'WSC_PROFILE_RATE': '0'})
+    sys.path.insert(0, DASHBOARD_DIR)
+    import get_station_data as gsd
+    from db_pool import ConnectionPool
+    from derived_hydat import build_derived_hydat
+
+    hydat = os.path.join(args.fixture, 'Hydat.sqlite3')
+    derived = os.path.join(args.fixture, 'Hydat-derived.sqlite3')
+    t0 = time.time()
+    n_stations, n_rows = build_derived_hydat(hydat, derived)
+    print('Built {} ({} station-months of {} stations) in {:.1f}s'.format(
+        derived, n_rows, n_stations, time.time() - t0))
+    print('Size: HYDAT {:.1f} MiB, derived {:.1f} MiB\n'.format(
+        os.path.getsize(hydat) / 2**20, os.path.getsize(derived) / 2**20))
+
+    _, lat, lon = LANDING_STATION
+    stations = list(gsd.STATION_INDEX.query_nearest(
+        lat, lon, args.stations)['Station Number'])
+    results = {}
+    frames = {}
+    for name, db_file in [('HYDAT', hydat), ('derived', derived)]:
+        pool = ConnectionPool(db_file)
+        with pool.connection() as conn:
+            plan = conn.execute('EXPLAIN QUERY PLAN ' + gsd.SELECT_DLY_FLOWS,
+                                (stations[0],)).fetchall()
+            print('{} query plan: {}'.format(
+                name, '; '.join(row[-1] for row in plan)))
+            frames[name] = gsd.select_dly_flows_by_station_IDs(conn, stations)
+            # just the query and fetch, which is what the layout changes
+            results[name, 'station fetch'] = summarize(time_queries(
+                lambda s: conn.execute(gsd.SELECT_DLY_FLOWS, (s,)).fetchall(),
+                stations, args.runs))
+            results[name, 'station'] = summarize(time_queries(
+                lambda s: gsd.select_dly_flows_by_station_ID(conn, s),
+                stations, args.runs))
+            results[name, 'stations[{}]'.format(len(stations))] = summarize(
+                time_runs(lambda: gsd.select_dly_flows_by_station_IDs(
+                    conn, stations), args.runs))
+
+        def cold_query(station):
+            drop_page_cache(pool.db_file)
+            conn = pool._connect()
+            try:
+                gsd.select_dly_flows_by_station_ID(conn, station)
+            finally:
+                conn.close()
+        results[name, 'station, cold'] = summarize(time_queries(
+            cold_query, stations, args.runs))
+
+    print('Same results: {}\n'.format(same_results(frames['HYDAT'],
+                                                   frames['derived'])))
+    print('{:<28} {:>12} {:>14} {:>8}'.format(
+        'median', 'HYDAT [ms]', 'derived [ms]', 'speedup'))
+    for case in [case for name, case in results if name == 'HYDAT']:
+        before = results['HYDAT', case]['median']
+        after = results['derived', case]['median']
+        print('{:<28} {:>12.2f} {:>14.2f} {:>7.2f}x'.format(
+            case, before * 1000, after * 1000, before / after))
@@ -0,0 +1,87 @@
+"""
+Hydrograph payload benchmark: full daily series against the min/max
+level-of-detail view.
+
+Builds a synthetic merged hydrograph (by default ten stations with a
+century of daily record) and reports, for the full series, the LOD
+overview and a one-year zoom, the number of points sent, the approximate
+websocket payload and the time taken to build it on the server.
+
+    python benchmarks/bench_lod.py [--stations 10] [--years 100] [--width 1200]
+
+Browser frame times are not measured here; compare panning in the app
+served with WSC_HYDROGRAPH_LOD=0 and WSC_HYDROGRAPH_LOD=1 instead.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dashboard'))
+
+from downsample import payload_nbytes, view_rows  # noqa: E402
+
+DAY_MS = 86400000
+
+
+def make_hydrograph(n_stations, years, seed=0):
+    rng = np.random.RandomState(seed)
+    n_days = int(years * 365.25)
+    dates_ms = np.arange(n_days, dtype=np.int64) * DAY_MS
+    season = 1 + np.sin(np.arange(n_days) * 2 * np.pi / 365.25)
+    ys = (season[:, np.newaxis] *
+          rng.gamma(2, 10, (n_days, n_stations))).astype(np.float32)
+    flags = (rng.rand(n_days, n_stations) < 0.05).astype(np.uint8)
+    return dates_ms, ys, flags
+
+
+def build(dates_ms, ys, flags, rows):
+    if rows is None:
+        data = {'DATE': dates_ms.astype(np.float64)}
+        for j in range(ys.shape[1]):
+            data['DAILY_UR_{}'.format(j)] = ys[:, j]
+            data['FLAG_{}'.format(j)] = flags[:, j]
+        return data
+    data = {}
+    for j in range(ys.shape[1]):
+        data['DATE_{}'.format(j)] = dates_ms[rows[:, j]].astype(np.float64)
+        data['DAILY_UR_{}'.format(j)] = ys[rows[:, j], j]
+        data['FLAG_{}'.format(j)] = flags[rows[:, j], j]
+    return data
+
+
+def run(n_stations, years, width):
+    dates_ms, ys, flags = make_hydrograph(n_stations, years)
+    year = (dates_ms[len(dates_ms) // 2], dates_ms[len(dates_ms) // 2] + 365 * DAY_MS)
+    cases = [
+        ('full', lambda: None),
+        ('lod', lambda: view_rows(dates_ms, ys, width)),
+        ('lod 1-year zoom', lambda: view_rows(dates_ms, ys, width, *year)),
+    ]
+
+    results = {}
+    for name, rows in cases:
+        t0 = time.perf_counter()
+        data = build(dates_ms, ys, flags, rows())
+        build_time = time.perf_counter() - t0
+        results[name] = {'points': len(data['DAILY_UR_0']),
+                         'bytes': payload_nbytes(data),
+                         'build_s': build_time}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--stations', type=int, default=10)
+    parser.add_argument('--years', type=int, default=100)
+    parser.add_argument('--width', type=int, default=1200)
+    args = parser.parse_args()
+
+    results = run(args.stations, args.years, args.width)
+    for name, stats in results.items():
+        print('{:>16}: {:>7} points, {:>6.2f} MB, built in {:.1f} ms'.format(
+            name, stats['points'], stats['bytes'] / 2**20,
+            stats['build_s'] * 1000))
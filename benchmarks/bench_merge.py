@@ -0,0 +1,74 @@
+"""
+Merge benchmark: outer-join pd.concat against the calendar-aligned
+MergedSeries, for hydrographs of 2, 10 and 50 stations.
+
+Station frames are synthetic but shaped like get_station_data's: a
+DatetimeIndex named DATE, float32 DAILY_UR_* and categorical FLAG_*
+columns, with records of different lengths, start years and gaps.
+
+    python benchmarks/bench_merge.py [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dashboard'))
+
+from merge import MergedSeries  # noqa: E402
+
+FLAG_SYMBOLS = ['A', 'B', 'D', 'E', 'R']
+
+
+def make_frames(n_stations, seed=0):
+    rng = np.random.RandomState(seed)
+    frames = {}
+    for i in range(n_stations):
+        station = 'ST{:05d}'.format(i)
+        start = np.datetime64('1900-01-01') + rng.randint(0, 365 * 80)
+        dates = start + np.arange(rng.randint(365 * 10, 365 * 100))
+        # drop a few seasons, as for stations operated only part of the year
+        dates = dates[rng.rand(len(dates) // 200 + 1).repeat(200)[:len(dates)] > 0.1]
+        flags = pd.Categorical.from_codes(
+            np.where(rng.rand(len(dates)) < 0.9, -1,
+                     rng.randint(0, len(FLAG_SYMBOLS), len(dates))),
+            categories=FLAG_SYMBOLS)
+        frames[station] = pd.DataFrame(
+            {'DAILY_UR_' + station: rng.gamma(2, 10, len(dates)).astype(np.float32),
+             'FLAG_' + station: flags},
+            index=pd.DatetimeIndex(dates.astype('datetime64[ns]'), name='DATE'))
+    return frames
+
+
+def concat(frames):
+    return pd.concat(list(frames.values()), axis=1, join='outer')
+
+
+def time_it(fn, frames, runs):
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        result = fn(frames)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    for n_stations in [2, 10, 50]:
+        frames = make_frames(n_stations)
+        concat_s, merged_df = time_it(concat, frames, args.runs)
+        merge_s, merged = time_it(MergedSeries, frames, args.runs)
+        concat_mb = merged_df.memory_usage(index=True, deep=True).sum() / 2**20
+        print('{:>3} stations: concat {:7.1f} ms {:6.1f} MB | '
+              'MergedSeries {:6.1f} ms {:6.1f} MB | {:.1f}x'.format(
+                  n_stations, concat_s * 1000, concat_mb,
+                  merge_s * 1000, merged.nbytes / 2**20, concat_s / merge_s))
@@ -0,0 +1,72 @@
+"""
+Scaling benchmark for querying and reshaping HYDAT series in processes.
+
+Times a ten-station request (by default the ten stations nearest the
+dashboard's initial location) read straight from Hydat.sqlite3, with
+1..N worker threads and with 1..N query processes handing the arrays
+back through shared memory (WSC_QUERY_PROCESSES).  The flow store is not
+used, since reading it involves no query or reshape.
+
+    python benchmarks/bench_processes.py [--max-workers N] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dashboard'))
+
+import get_station_data as gsd  # noqa: E402
+from stations import IDS_AND_COORDS  # noqa: E402
+
+
+def nearest_stations(station, k):
+    lat, lon = IDS_AND_COORDS[station]
+    return list(gsd.STATION_INDEX.query_nearest(lat, lon, k)['Station Number'])
+
+
+def in_threads(stations, executor):
+    def read(station):
+        with gsd.HYDAT_POOL.connection() as conn:
+            return gsd.select_dly_flows_by_station_ID(conn, station)
+    return dict(zip(stations, executor.map(read, stations)))
+
+
+def median_time(fn, runs):
+    fn()  # warm up the pool and the page cache
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--station', default='08KC001')
+    parser.add_argument('--stations', type=int, default=10)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    stations = nearest_stations(args.station, args.stations)
+    print('{} stations: {}'.format(len(stations), ', '.join(stations)))
+
+    baseline = None
+    for n in range(1, args.max_workers + 1):
+        with ThreadPoolExecutor(n) as threads:
+            thread_s = median_time(lambda: in_threads(stations, threads),
+                                   args.runs)
+        with ProcessPoolExecutor(n) as processes:
+            process_s = median_time(
+                lambda: gsd.select_dly_flows_in_processes(stations, processes),
+                args.runs)
+        baseline = baseline or thread_s
+        print('{:>3} workers: threads {:7.1f} ms ({:.1f}x) | '
+              'processes {:7.1f} ms ({:.1f}x)'.format(
+                  n, thread_s * 1000, baseline / thread_s,
+                  process_s * 1000, baseline / process_s))
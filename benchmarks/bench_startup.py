@@ -0,0 +1,147 @@
+"""
+Startup-time benchmark for the station catalog.
+
+Times `import stations` in fresh interpreters, once loading the binary
+catalog snapshot and once falling back to reading and converting
+WSC_Stations_Master.csv.  numpy, pandas and scipy are imported before
+the clock starts so only the catalog work is measured.
+
+With --procs, also measures what the catalog and the station index cost
+in memory when 1, 2, 4, ... processes load them together, as the bokeh
+processes of a pod do: the RSS and PSS (resident memory with the shared
+pages divided among the processes mapping them, from
+/proc/<pid>/smaps_rollup, so Linux only) of processes that load them,
+less those of processes that only import numpy, pandas and scipy.
+
+    python dashboard/stations.py          # build the snapshot first
+    python benchmarks/bench_startup.py [--runs 10] [--procs 1,2,4,8]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+DASHBOARD_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dashboard')
+
+SNIPPET = '''
+import time
+import numpy, pandas, scipy.spatial
+t0 = time.perf_counter()
+import stations
+print(time.perf_counter() - t0)
+'''
+
+MEMORY_SNIPPET = '''
+import sys
+import numpy, pandas, scipy.spatial
+if sys.argv[1] == 'load':
+    import stations
+    from spatial_index import StationIndex
+    index = StationIndex(stations.STATION_COLUMNS, stations.STATION_XYZ,
+                         stations.STATION_COLUMNS['Elevation'])
+print('ready', flush=True)
+sys.stdin.read()
+'''
+
+
+def time_import(env):
+    out = subprocess.check_output([sys.executable, '-c', SNIPPET],
+                                  cwd=DASHBOARD_DIR, env=env)
+    return float(out.decode().strip().splitlines()[-1])
+
+
+def run(runs):
+    results = {}
+    modes = {
+        'snapshot': dict(os.environ, WSC_SHARED_DIR=''),
+        'csv': dict(os.environ, WSC_SHARED_DIR='', WSC_CATALOG_DIR=os.devnull),
+    }
+    for mode, env in modes.items():
+        times = [time_import(env) for _ in range(runs)]
+        results[mode] = {'median_s': statistics.median(times),
+                         'min_s': min(times)}
+    return results
+
+
+def smaps_rollup_kb(pid):
+    fields = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields
+
+
+def total_memory_kb(n, env, load):
+    """
+    :return: (RSS, PSS) [kB] summed over n processes running
+        MEMORY_SNIPPET side by side
+    """
+    procs = [subprocess.Popen([sys.executable, '-c', MEMORY_SNIPPET,
+                               'load' if load else 'bare'],
+                              cwd=DASHBOARD_DIR, env=env,
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+             for _ in range(n)]
+    try:
+        for proc in procs:
+            proc.stdout.readline()
+        usage = [smaps_rollup_kb(proc.pid) for proc in procs]
+    finally:
+        for proc in procs:
+            proc.stdin.close()
+            proc.wait()
+    return sum(u['Rss'] for u in usage), sum(u['Pss'] for u in usage)
+
+
+def memory(procs):
+    shared_dir = tempfile.mkdtemp(
+        dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    modes = {
+        'shared': dict(os.environ, WSC_SHARED_DIR=shared_dir),
+        'snapshot': dict(os.environ, WSC_SHARED_DIR=''),
+        'csv': dict(os.environ, WSC_SHARED_DIR='', WSC_CATALOG_DIR=os.devnull),
+    }
+    results = {}
+    try:
+        for n in procs:
+            for mode, env in modes.items():
+                rss, pss = total_memory_kb(n, env, True)
+                bare_rss, bare_pss = total_memory_kb(n, env, False)
+                results[n, mode] = {'rss_kb': (rss - bare_rss) / n,
+                                    'pss_kb': (pss - bare_pss) / n}
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--procs', default=None,
+                        help='comma separated process counts, e.g. 1,2,4,8')
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    for mode, stats in results.items():
+        print('{:>10}: median {:.1f} ms, min {:.1f} ms'.format(
+            mode, stats['median_s'] * 1000, stats['min_s'] * 1000))
+    print('speedup: {:.1f}x'.format(
+        results['csv']['median_s'] / results['snapshot']['median_s']))
+
+    if args.procs:
+        procs = [int(n) for n in args.procs.split(',')]
+        results = memory(procs)
+        print('\ncatalog + index memory per process [MiB]')
+        print('{:>6} {:>18} {:>18} {:>18}'.format(
+            'procs', 'shared RSS/PSS', 'snapshot RSS/PSS', 'csv RSS/PSS'))
+        for n in procs:
+            print('{:>6} {}'.format(n, ' '.join(
+                '{:>18}'.format('{:.2f} / {:.2f}'.format(
+                    results[n, mode]['rss_kb'] / 1024,
+                    results[n, mode]['pss_kb'] / 1024))
+                for mode in ['shared', 'snapshot', 'csv'])))
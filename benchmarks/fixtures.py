@@ -0,0 +1,199 @@
+"""
+Synthetic HYDAT fixture, so the benchmarks run offline and on the same
+data everywhere.
+
+Writes a Hydat.sqlite3 holding the DLY_FLOWS table (same schema as the
+official database) and a WSC_Stations_Master.csv for the same stations,
+plus fixture.json recording the parameters.  The first station is
+08KC001 at its real location, the dashboard's landing station, and a
+fifth of the others are scattered within 150 km of it so the station
+searches find a realistic number of stations.
+
+    python benchmarks/fixtures.py [--out benchmarks/fixture]
+        [--stations 200] [--years 60] [--seed 0]
+"""
+import argparse
+import calendar
+import csv
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BENCHMARKS_DIR, 'fixture')
+
+LANDING_STATION = ('08KC001', 54.09642, -122.67986)
+LAST_YEAR = 2016
+
+CSV_COLUMNS = [
+    'Station Number', 'Station Name', 'Province', 'Status', 'Latitude',
+    'Longitude', 'Year From', 'Year To', 'Gross Drainage Area (km2)',
+    'Effective Drainage Area (km2)', 'Regulation', 'Data Type',
+    'Operation Schedule', 'Sediment', 'RHBN', 'Real-Time', 'Datum Name',
+    'Publishing Office', 'Operating Agency', 'Contributed', 'Elevation']
+
+DLY_FLOWS_SCHEMA = (
+    'CREATE TABLE DLY_FLOWS (STATION_NUMBER TEXT, YEAR INTEGER, '
+    'MONTH INTEGER, FULL_MONTH INTEGER, NO_DAYS INTEGER, MONTHLY_MEAN REAL, '
+    'MONTHLY_TOTAL REAL, FIRST_DAY_MIN INTEGER, MIN REAL, '
+    'FIRST_DAY_MAX INTEGER, MAX REAL, {}, '
+    'PRIMARY KEY (STATION_NUMBER, YEAR, MONTH))').format(', '.join(
+        'FLOW{0} REAL, FLOW_SYMBOL{0} TEXT'.format(day)
+        for day in range(1, 32)))
+
+# share of daily values carrying each HYDAT data symbol
+SYMBOL_RATES = [('E', 0.04), ('B', 0.03), ('A', 0.005), ('R', 0.002)]
+
+
+def make_stations(n_stations, years, rng):
+    """
+    :return: list of dicts, one per station, with the CSV columns
+    """
+    _, lat0, lon0 = LANDING_STATION
+    stations = []
+    for i in range(n_stations):
+        if i == 0:
+            number, lat, lon = LANDING_STATION
+        elif rng.rand() < 0.2:
+            # within ~150 km of the landing station
+            lat = lat0 + rng.uniform(-1.3, 1.3)
+            lon = lon0 + rng.uniform(-2.2, 2.2)
+            number = '08K{}{:03d}'.format(chr(65 + rng.randint(26)),
+                                          rng.randint(1, 1000))
+        else:
+            lat, lon = rng.uniform(43, 62), rng.uniform(-135, -60)
+            number = '{:02d}{}{}{:03d}'.format(
+                rng.randint(1, 11), chr(65 + rng.randint(26)),
+                chr(65 + rng.randint(26)), rng.randint(1, 1000))
+        record = rng.randint(max(1, years // 4), years + 1)
+        year_to = LAST_YEAR - (rng.randint(0, 30) if rng.rand() < 0.4 else 0)
+        stations.append({
+            'Station Number': number,
+            'Station Name': 'SYNTHETIC RIVER {} NEAR SITE {}'.format(i, number),
+            'Province': 'BC',
+            'Status': 'Active' if year_to == LAST_YEAR else 'Discontinued',
+            'Latitude': round(lat, 5),
+            'Longitude': round(lon, 5),
+            'Year From': year_to - record + 1,
+            'Year To': year_to,
+            'Gross Drainage Area (km2)': round(float(rng.lognormal(6, 1.8)), 1),
+            'Effective Drainage Area (km2)': '',
+            'Regulation': 'N',
+            'Data Type': 'Flow',
+            'Operation Schedule': 'Continuous',
+            'Sediment': 'N',
+            'RHBN': 'N',
+            'Real-Time': 'N',
+            'Datum Name': 'ASSUMED DATUM',
+            'Publishing Office': 'VANCOUVER',
+            'Operating Agency': 'WATER SURVEY OF CANADA (DOE) (CANADA)',
+            'Contributed': 'N',
+            'Elevation': round(float(rng.uniform(0, 2000)), 3),
+        })
+    # station numbers must be unique; renumber any collision
+    seen = set()
+    for i, station in enumerate(stations):
+        while station['Station Number'] in seen:
+            station['Station Number'] = '99Z{}{:03d}'.format(
+                chr(65 + i // 1000 % 26), i % 1000)
+        seen.add(station['Station Number'])
+    return stations
+
+
+def month_rows(station, rng):
+    """
+    DLY_FLOWS rows of a station: a seasonal daily flow with noise, a few
+    missing years and months, and the odd data symbol.
+    """
+    scale = station['Gross Drainage Area (km2)'] / 100
+    seasonal = rng.uniform(0.5, 3)
+    for year in range(station['Year From'], station['Year To'] + 1):
+        if rng.rand() < 0.03:
+            continue
+        for month in range(1, 13):
+            if rng.rand() < 0.01:
+                continue
+            n_days = calendar.monthrange(year, month)[1]
+            day_of_year = (month - 1) * 30.4 + np.arange(n_days)
+            flows = scale * (1 + seasonal * np.exp(
+                -((day_of_year - 160) / 40) ** 2)) * rng.gamma(4, 0.25, n_days)
+            u = rng.rand(n_days)
+            symbols = [None] * n_days
+            threshold = 0
+            for symbol, rate in SYMBOL_RATES:
+                for day in np.nonzero((u >= threshold) &
+                                      (u < threshold + rate))[0]:
+                    symbols[day] = symbol
+                threshold += rate
+
+            row = [station['Station Number'], year, month, 1, n_days,
+                   float(flows.mean()), float(flows.sum()) * 86400,
+                   int(flows.argmin()) + 1, float(flows.min()),
+                   int(flows.argmax()) + 1, float(flows.max())]
+            for day in range(31):
+                if day < n_days:
+                    row += [round(float(flows[day]), 3), symbols[day]]
+                else:
+                    row += [None, None]
+            yield row
+
+
+def write_hydat(path, stations, rng):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute(DLY_FLOWS_SCHEMA)
+    insert = 'INSERT INTO DLY_FLOWS VALUES ({})'.format(', '.join('?' * 73))
+    with conn:
+        for station in stations:
+            conn.executemany(insert, month_rows(station, rng))
+    conn.close()
+
+
+def write_stations_csv(path, stations):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(stations)
+
+
+def fixture_env(fixture):
+    """
+    The dashboard settings (see dashboard/config.py) pointing at a fixture.
+    There is no flow store in it, so the series come from SQLite: the
+    derived copy of DLY_FLOWS once bench_derived.py has built it.
+    """
+    return {
+        'WSC_HYDAT_DB': os.path.join(fixture, 'Hydat.sqlite3'),
+        'WSC_DERIVED_HYDAT_DB': os.path.join(fixture, 'Hydat-derived.sqlite3'),
+        'WSC_STATIONS_CSV': os.path.join(fixture, 'WSC_Stations_Master.csv'),
+        'WSC_CATALOG_DIR': os.path.join(fixture, 'catalog'),
+        'WSC_FLOW_STORE_DIR': os.path.join(fixture, 'flow_store'),
+    }
+
+
+def make_fixture(out=FIXTURE_DIR, n_stations=200, years=60, seed=0):
+    os.makedirs(out, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    stations = make_stations(n_stations, years, rng)
+    write_stations_csv(os.path.join(out, 'WSC_Stations_Master.csv'), stations)
+    write_hydat(os.path.join(out, 'Hydat.sqlite3'), stations, rng)
+    params = {'stations': n_stations, 'years': years, 'seed': seed}
+    with open(os.path.join(out, 'fixture.json'), 'w') as f:
+        json.dump(params, f)
+    return params
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--out', default=FIXTURE_DIR)
+    parser.add_argument('--stations', type=int, default=200)
+    parser.add_argument('--years', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    make_fixture(args.out, args.stations, args.years, args.seed)
+    print('Wrote {} stations with up to {} years of daily flows to {}'.format(
+        args.stations, args.years, args.out))
@@ -0,0 +1,594 @@
+"""
+Load test of the dashboard server: N simulated users, each with its own
+bokeh.client session, replaying a random interaction script.
+
+Each user opens a session and, until the end of the run, waits a random
+think time and then selects 1 to 10 of the found stations (60% of the
+actions), changes the search distance (20%) or moves the location (20%).
+An action's latency runs from sending the change to the end of the
+update it starts, as the client sees it: the hydrograph title leaving its
+busy state, or the map title going back from 'Updating...'.  A location
+move includes the station search debounce (WSC_DEBOUNCE_MS).
+
+    python benchmarks/loadtest.py [--serve [--num-procs 4]]
+        [--url http://localhost:5006/dashboard] [--users 20]
+        [--duration 120] [--ramp 10] [--think 2] [--procs 1]
+        [--server-pid PID ...] [--save results.json]
+
+--serve starts dashboard/serve.py on the synthetic HYDAT fixture (see
+fixtures.py, generated on first use) and stops it at the end.  Otherwise
+the server at --url is used, which should run on the fixture too:
+
+    WSC_HYDAT_DB=benchmarks/fixture/Hydat.sqlite3 \\
+    WSC_STATIONS_CSV=benchmarks/fixture/WSC_Stations_Master.csv \\
+    WSC_CATALOG_DIR=benchmarks/fixture/catalog \\
+    WSC_FLOW_STORE_DIR=benchmarks/fixture/flow_store \\
+        python dashboard/serve.py --num-procs=4
+
+(or `bokeh serve dashboard/dashboard.py`).  The server still needs the
+map's key file, dashboard/api_key/client_secret_548109306400.json, but
+the simulated users never draw the map: any key will do.  The report
+gives the p50/p95/p99 latency of each action, the websocket bytes
+received per action and per session, and the resident memory of the
+server processes (the serve.py or `bokeh serve` processes and their
+children, or --server-pid and its children), sampled every second.  The
+simulated users take client CPU too: beyond a few dozen, spread them over
+--procs processes.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import bokeh.document.document as document_module
+import bokeh.document.util as document_util
+import numpy as np
+from bokeh.client import ClientSession
+from bokeh.client.util import websocket_url_for_server_url
+from bokeh.models import (Column, Div, GlyphRenderer, Select, Selection,
+                          TextInput)
+from bokeh.plotting.gmap import GMap
+from bokeh.protocol.messages.patch_doc import patch_doc_1
+from bokeh.util.serialization import encode_base64_dict
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+from fixtures import (FIXTURE_DIR, LANDING_STATION, fixture_env,  # noqa: E402
+                      make_fixture)
+
+# Fixes to bokeh.client (0.12.16), which the browser client does not need.
+# It rebuilds the map as a plotting.GMap from its id alone and sets the key
+# and options after, but GMap requires them as arguments.
+GMap.__init__.__defaults__ = (None, None)
+# apply_json_patch drops the setter when it updates the models a patch
+# refers to, so the client would send every one of them back to the server
+# (the hydrograph's whole source when lines are added)
+_patching = threading.local()
+
+
+def initialize_references_json(references_json, references, setter=None):
+    setter = setter or getattr(_patching, 'setter', None)
+    document_util.initialize_references_json(references_json, references,
+                                             setter)
+
+
+def inline_buffers(content, buffers):
+    """
+    Replace the {'__buffer__': id} references of a patch, which the client
+    leaves undecoded, with base64 arrays it can decode.
+    :param content: patch content, or part of it
+    :param buffers: dict of buffer id to payload
+    """
+    if isinstance(content, list):
+        return [inline_buffers(e, buffers) for e in content]
+    if not isinstance(content, dict):
+        return content
+    if '__buffer__' in content:
+        array = np.frombuffer(buffers[content['__buffer__']],
+                              dtype=content['dtype']).reshape(content['shape'])
+        return encode_base64_dict(array)
+    return {k: inline_buffers(v, buffers) for k, v in content.items()}
+
+
+def apply_patch(self, doc, setter=None):
+    # as read from the socket, the buffer headers are still JSON
+    buffers = {json.loads(header)['id']: payload
+               for header, payload in self.buffers}
+    _patching.setter = setter
+    try:
+        doc.apply_json_patch(inline_buffers(self.content, buffers), setter)
+    finally:
+        _patching.setter = None
+
+
+document_module.initialize_references_json = initialize_references_json
+patch_doc_1.apply_to_document = apply_patch
+
+# action: share of the actions
+ACTIONS = [('select', 0.6), ('distance', 0.2), ('move', 0.2)]
+SEARCH_DISTANCES = ['50', '100', '150']
+# moves stay within this many degrees of the landing station, where the
+# fixture's stations are clustered
+MOVE_LAT, MOVE_LNG = 0.8, 1.3
+MAX_SELECTED = 10
+
+# see wscModule.Module.busy and mapModule.Module.busy
+HYDROGRAPH_BUSY = '<p style="color:red;">'
+MAP_BUSY = 'Updating...'
+
+
+class Pending:
+    """
+    An action waiting for the end of the update it started.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.busy_seen = False
+        self.done = threading.Event()
+
+    def busy(self, busy):
+        if busy:
+            self.busy_seen = True
+        elif self.busy_seen:
+            self.done.set()
+
+
+class User:
+    """
+    A simulated user: a client session whose IOLoop runs on a thread of
+    its own, so the server's patches are applied as they come, and is
+    driven from the calling thread through add_callback.
+    """
+
+    def __init__(self, url, rng):
+        self.url = url
+        self.rng = rng
+        self.session = None
+        self.received = 0
+        self.sent = 0
+        self.pending = None
+        self._opened = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='session')
+        self._thread.daemon = True
+
+    def open(self, timeout):
+        self._thread.start()
+        if not self._opened.wait(timeout):
+            raise IOError('Timed out opening a session on {}'.format(self.url))
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        if self.session is not None:
+            self.call(self.session.close)
+        self._thread.join(5)
+
+    def call(self, fn, *args):
+        self.session._connection.io_loop.add_callback(fn, *args)
+
+    def _run(self):
+        try:
+            self.session = ClientSession(
+                websocket_url=websocket_url_for_server_url(self.url))
+            self.session.connect()
+            if not self.session.connected:
+                raise IOError('Could not connect to {}'.format(self.url))
+            self._count_bytes(self.session._connection._socket)
+            self.session.pull()
+            self._find_models(self.session.document)
+        except Exception as e:
+            self._error = e
+            return
+        finally:
+            self._opened.set()
+        self.session.loop_until_closed(suppress_warning=True)
+
+    def _count_bytes(self, socket):
+        # every fragment of every message (header, metadata, content and
+        # buffers) goes through these two
+        read_message = socket.read_message
+        write_message = socket.write_message
+
+        def counting_read(callback=None):
+            future = read_message(callback)
+            future.add_done_callback(self._count_received)
+            return future
+
+        def counting_write(message, binary=False, locked=True):
+            self.sent += message_size(message)
+            return write_message(message, binary, locked)
+
+        socket.read_message = counting_read
+        socket.write_message = counting_write
+
+    def _count_received(self, future):
+        if future.exception() is None:
+            self.received += message_size(future.result())
+
+    def _find_models(self, doc):
+        inputs = {m.title: m for m in doc.select({'type': TextInput})}
+        self.lat_input = inputs['Latitude (dec. degrees)']
+        self.lng_input = inputs['Longitude (dec. degrees)']
+        self.distance_select = [m for m in doc.select({'type': Select})
+                                if m.title.startswith('Set Search Distance')][0]
+        map_plot = doc.select_one({'name': 'map'})
+        self.found_source = [
+            r.data_source for r in map_plot.renderers
+            if isinstance(r, GlyphRenderer)
+            and 'Station Number' in r.data_source.data][0]
+        hydrograph = doc.select_one({'name': 'hydrograph'})
+        # column() puts the title Div in a WidgetBox next to the plot
+        hydrograph_title = [c for c in doc.select({'type': Column})
+                            if hydrograph in c.children][0].select_one(
+                                {'type': Div})
+
+        map_plot.title.on_change('text', self._map_title_changed)
+        hydrograph_title.on_change('text', self._hydrograph_title_changed)
+
+    def _map_title_changed(self, attr, old, new):
+        pending = self.pending
+        if pending is not None and pending.kind in ('distance', 'move'):
+            pending.busy(new == MAP_BUSY)
+
+    def _hydrograph_title_changed(self, attr, old, new):
+        pending = self.pending
+        if pending is not None and pending.kind == 'select':
+            pending.busy(new.startswith(HYDROGRAPH_BUSY))
+
+    # the actions run on the session's IOLoop
+
+    def select(self):
+        n = len(self.found_source.data['Station Number'])
+        k = self.rng.randint(1, min(n, MAX_SELECTED))
+        self.found_source.selected = Selection(
+            indices=sorted(self.rng.sample(range(n), k)))
+
+    def distance(self):
+        self.distance_select.value = self.rng.choice(
+            [d for d in SEARCH_DISTANCES if d != self.distance_select.value])
+
+    def move(self):
+        _, lat, lng = LANDING_STATION
+        self.lat_input.value = '{:.5f}'.format(
+            lat + self.rng.uniform(-MOVE_LAT, MOVE_LAT))
+        self.lng_input.value = '{:.5f}'.format(
+            lng + self.rng.uniform(-MOVE_LNG, MOVE_LNG))
+
+    def act(self, kind, timeout):
+        """
+        Run an action and wait for the end of its update.
+        :return: dict of the action, its latency and bytes received
+        """
+        if kind == 'select' and not len(self.found_source.data['Station Number']):
+            # nothing found around here, go somewhere else
+            kind = 'move'
+        self.pending = Pending(kind)
+        received = self.received
+        t0 = time.perf_counter()
+        self.call(getattr(self, kind))
+        ok = self.pending.done.wait(timeout)
+        return {'action': kind,
+                'seconds': time.perf_counter() - t0,
+                'ok': ok,
+                'bytes': self.received - received}
+
+
+def message_size(message):
+    if message is None:
+        return 0
+    if isinstance(message, str):
+        return len(message.encode('utf-8'))
+    return len(message)
+
+
+def choose_action(rng):
+    x = rng.random()
+    for kind, share in ACTIONS:
+        if x < share:
+            return kind
+        x -= share
+    return ACTIONS[-1][0]
+
+
+def simulate_user(args, user_id, start, records, sessions):
+    rng = random.Random(args.seed * 100003 + user_id)
+    time.sleep(max(0, start + user_id * args.ramp / args.users - time.time()))
+    user = User(args.url, rng)
+    t0 = time.perf_counter()
+    try:
+        user.open(args.timeout)
+    except Exception as e:
+        records.append({'action': 'open', 'seconds': time.perf_counter() - t0,
+                        'ok': False, 'bytes': user.received,
+                        'error': repr(e)})
+        return
+    records.append({'action': 'open', 'seconds': time.perf_counter() - t0,
+                    'ok': True, 'bytes': user.received})
+    try:
+        deadline = start + args.ramp + args.duration
+        while True:
+            think = rng.expovariate(1 / args.think) if args.think > 0 else 0
+            if time.time() + think >= deadline:
+                break
+            time.sleep(think)
+            records.append(user.act(choose_action(rng), args.timeout))
+    finally:
+        sessions.append({'received': user.received, 'sent': user.sent})
+        user.close()
+
+
+def run_users(args, user_ids):
+    """
+    Simulate the users on one thread each.
+    :return: (action records, per session byte counts)
+    """
+    records = []
+    sessions = []
+    threads = [threading.Thread(target=simulate_user,
+                                args=(args, i, args.start, records, sessions))
+               for i in user_ids]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, sessions
+
+
+def process_table():
+    """
+    :return: dict of pid to (parent pid, list of command line arguments)
+    """
+    table = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(name)) as f:
+                # the command name in parentheses may hold spaces
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            with open('/proc/{}/cmdline'.format(name), 'rb') as f:
+                cmdline = f.read().decode(errors='replace').split('\0')
+        except (OSError, IndexError, ValueError):
+            continue
+        table[int(name)] = (ppid, cmdline)
+    return table
+
+
+def is_server(cmdline):
+    # python dashboard/serve.py ..., or bokeh serve ...
+    return (any(arg.endswith('serve.py') for arg in cmdline) or
+            any(arg.endswith('bokeh') and next_arg == 'serve'
+                for arg, next_arg in zip(cmdline, cmdline[1:])))
+
+
+def server_pids(roots=None):
+    """
+    The server processes: roots, or the processes running serve.py or
+    `bokeh serve`, and all their descendants.
+    """
+    table = process_table()
+    if not roots:
+        roots = [pid for pid, (_, cmdline) in table.items()
+                 if is_server(cmdline) and pid != os.getpid()]
+    pids = set(roots)
+    added = True
+    while added:
+        added = False
+        for pid, (ppid, _) in table.items():
+            if ppid in pids and pid not in pids:
+                pids.add(pid)
+                added = True
+    return sorted(pids)
+
+
+def rss_bytes(pid):
+    try:
+        with open('/proc/{}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler:
+    """
+    Samples the summed resident memory of the server processes every
+    `interval` seconds from a background thread.  Pages shared between
+    forked processes are counted once per process.
+    """
+
+    def __init__(self, roots=None, interval=1.0):
+        self.roots = roots
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def sample(self):
+        pids = server_pids(self.roots)
+        self.samples.append((time.time(), sum(rss_bytes(p) for p in pids),
+                             len(pids)))
+
+    def _run(self):
+        while True:
+            self.sample()
+            if self._stop.wait(self.interval):
+                break
+
+    def summary(self):
+        if not self.samples:
+            return None
+        totals = [total for _, total, _ in self.samples]
+        return {'start': totals[0], 'peak': max(totals), 'end': totals[-1],
+                'processes': max(n for _, _, n in self.samples)}
+
+
+def start_server(fixture, port, num_procs, timeout=300):
+    """
+    Start serve.py on the fixture in a new process group and wait until
+    /readyz answers, i.e. every process has computed its landing view.
+    """
+    env = dict(os.environ)
+    env.update(fixture_env(fixture))
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, 'dashboard', 'serve.py'),
+         '--port', str(port), '--num-procs', str(num_procs),
+         '--log-level', 'warning'],
+        cwd=BASE_DIR, env=env, start_new_session=True)
+    ready_url = 'http://localhost:{}/readyz'.format(port)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit('The server exited with status {}'.format(process.returncode))
+        try:
+            # a request reaches one process only; give the others a moment
+            with urllib.request.urlopen(ready_url, timeout=5):
+                time.sleep(num_procs)
+                return process
+        except (urllib.error.URLError, OSError):
+            time.sleep(1)
+    stop_server(process)
+    sys.exit('The server was not ready after {} seconds'.format(timeout))
+
+
+def stop_server(process):
+    # the forked processes are in the same group
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+def summarize(records, sessions, rss):
+    actions = {}
+    for kind in ['open'] + [kind for kind, _ in ACTIONS]:
+        done = [r for r in records if r['action'] == kind]
+        times = [r['seconds'] for r in done if r['ok']]
+        if not done:
+            continue
+        p50, p95, p99 = (np.percentile(times, [50, 95, 99]) if times
+                         else (float('nan'),) * 3)
+        actions[kind] = {'count': len(done),
+                         'failed': len(done) - len(times),
+                         'p50': p50, 'p95': p95, 'p99': p99,
+                         'mean_bytes': float(np.mean([r['bytes'] for r in done]))}
+    received = [s['received'] for s in sessions]
+    return {'actions': actions,
+            'sessions': {'count': len(sessions),
+                         'received_mean': float(np.mean(received)) if received else 0,
+                         'received_total': sum(received),
+                         'sent_total': sum(s['sent'] for s in sessions)},
+            'rss': rss}
+
+
+def print_results(results):
+    print('{:<10} {:>7} {:>7} {:>10} {:>10} {:>10} {:>12}'.format(
+        'action', 'count', 'failed', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]',
+        'recv [KiB]'))
+    for kind, r in results['actions'].items():
+        print('{:<10} {:>7} {:>7} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.1f}'.format(
+            kind, r['count'], r['failed'], r['p50'] * 1000, r['p95'] * 1000,
+            r['p99'] * 1000, r['mean_bytes'] / 2**10))
+    s = results['sessions']
+    print('\n{} sessions received {:.1f} MiB ({:.1f} KiB each), sent {:.1f} KiB'
+          .format(s['count'], s['received_total'] / 2**20,
+                  s['received_mean'] / 2**10, s['sent_total'] / 2**10))
+    rss = results['rss']
+    if rss is not None:
+        print('Server RSS over {} processes: {:.0f} MiB at the start, '
+              '{:.0f} MiB peak, {:.0f} MiB at the end'.format(
+                  rss['processes'], rss['start'] / 2**20, rss['peak'] / 2**20,
+                  rss['end'] / 2**20))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://localhost:5006/dashboard')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=120,
+                        help='seconds of the run after the ramp up')
+    parser.add_argument('--ramp', type=float, default=10,
+                        help='seconds over which the sessions are opened')
+    parser.add_argument('--think', type=float, default=2,
+                        help='mean seconds between the actions of a user')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds after which an action counts as failed')
+    parser.add_argument('--procs', type=int, default=1,
+                        help='client processes to spread the users over')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--server-pid', type=int, action='append')
+    parser.add_argument('--serve', action='store_true',
+                        help='start serve.py on the fixture for the run')
+    parser.add_argument('--num-procs', type=int, default=4,
+                        help='server processes with --serve')
+    parser.add_argument('--port', type=int, default=5006)
+    parser.add_argument('--fixture', default=FIXTURE_DIR)
+    parser.add_argument('--save', help='write the results to this file')
+    args = parser.parse_args()
+
+    server = None
+    roots = args.server_pid
+    if args.serve:
+        if not os.path.exists(os.path.join(args.fixture, 'fixture.json')):
+            print('Generating the fixture in {}'.format(args.fixture))
+            make_fixture(args.fixture)
+        server = start_server(args.fixture, args.port, args.num_procs)
+        roots = [server.pid]
+        args.url = 'http://localhost:{}/dashboard'.format(args.port)
+
+    rss = RssSampler(roots)
+    rss.start()
+    args.start = time.time() + 1
+    try:
+        if args.procs > 1:
+            with multiprocessing.Pool(args.procs) as pool:
+                parts = pool.starmap(run_users, [
+                    (args, range(i, args.users, args.procs))
+                    for i in range(args.procs)])
+        else:
+            parts = [run_users(args, range(args.users))]
+    finally:
+        rss.stop()
+        if server is not None:
+            stop_server(server)
+
+    records = [r for part, _ in parts for r in part]
+    sessions = [s for _, part in parts for s in part]
+    results = summarize(records, sessions, rss.summary())
+    results['meta'] = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'url': args.url, 'users': args.users, 'duration': args.duration,
+        'ramp': args.ramp, 'think': args.think, 'seed': args.seed,
+        'num_procs': args.num_procs if args.serve else None,
+        'cpus': os.cpu_count()}
+    print_results(results)
+    errors = set(r['error'] for r in records if 'error' in r)
+    for error in errors:
+        print('Session failed to open: {}'.format(error))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
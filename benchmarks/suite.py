@@ -0,0 +1,204 @@
+"""
+Benchmark suite for the query, search, merge and plot paths, run on the
+synthetic HYDAT fixture (see fixtures.py, generated on first use).
+
+Times select_dly_flows_by_station_ID, get_stations_by_distance, the
+hydrograph module's get_all_data and make_plot_and_table.  The flow
+store, the shared memory tier and the query processes are turned off, so
+the SQLite path is what gets measured.
+
+    python benchmarks/suite.py run [--runs 20]
+        [--save benchmarks/baselines/NAME.json]
+    python benchmarks/suite.py compare BASELINE.json [CURRENT.json]
+        [--threshold 0.1]
+
+compare runs the suite (unless given a second result file) and flags
+the cases whose median got slower than the baseline's by more than the
+threshold, exiting with status 1 if there is any.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DASHBOARD_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'dashboard')
+
+from fixtures import (FIXTURE_DIR, LANDING_STATION, fixture_env,  # noqa: E402
+                      make_fixture)
+
+SEARCH_DISTANCES = [50, 150]
+HYDROGRAPH_STATIONS = [2, 10]
+
+
+def load_dashboard(fixture):
+    """
+    Import the dashboard modules configured for the fixture.  The
+    settings are read from the environment when config is imported, so
+    this has to come before any other dashboard import.
+    """
+    os.environ.update(fixture_env(fixture))
+    os.environ.update({
+        'WSC_SHARED_DIR': '',
+        'WSC_QUERY_PROCESSES': '0',
+        'WSC_PROFILE_RATE': '0',
+    })
+    sys.path.insert(0, DASHBOARD_DIR)
+    import get_station_data
+    import modules.wscModule
+    return get_station_data, modules.wscModule
+
+
+def time_runs(fn, runs):
+    fn()  # warm up the caches
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def summarize(times):
+    times = sorted(times)
+    return {'median': statistics.median(times),
+            'p95': times[min(len(times) - 1, int(0.95 * len(times)))],
+            'min': times[0],
+            'runs': len(times)}
+
+
+def run_suite(fixture, runs):
+    gsd, wsc = load_dashboard(fixture)
+    _, lat, lon = LANDING_STATION
+    nearest = list(gsd.STATION_INDEX.query_nearest(
+        lat, lon, max(HYDROGRAPH_STATIONS))['Station Number'])
+    results = {}
+
+    # per station, over the landing station's neighbours
+    times = []
+    with gsd.HYDAT_POOL.connection() as conn:
+        for station in nearest:
+            gsd.select_dly_flows_by_station_ID(conn, station)
+        for _ in range(runs):
+            for station in nearest:
+                t0 = time.perf_counter()
+                gsd.select_dly_flows_by_station_ID(conn, station)
+                times.append(time.perf_counter() - t0)
+    results['select_dly_flows_by_station_ID'] = summarize(times)
+
+    for radius in SEARCH_DISTANCES:
+        results['get_stations_by_distance[{}km]'.format(radius)] = summarize(
+            time_runs(lambda: gsd.get_stations_by_distance(lat, lon, radius),
+                      runs))
+
+    with gsd.HYDAT_POOL.connection() as conn:
+        frames = gsd.select_dly_flows_by_station_IDs(conn, nearest)
+    for n in HYDROGRAPH_STATIONS:
+        data = {e: frames[e] for e in nearest[:n]}
+        module = wsc.Module()
+        results['get_all_data[{}]'.format(n)] = summarize(
+            time_runs(lambda: module.get_all_data(data), runs))
+        results['make_plot_and_table[{}]'.format(n)] = summarize(
+            time_runs(lambda: wsc.Module().make_plot_and_table(
+                list(data), data), runs))
+
+    with open(os.path.join(fixture, 'fixture.json')) as f:
+        fixture_params = json.load(f)
+    meta = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'fixture': fixture_params,
+            'hydat_db': os.path.basename(gsd.HYDAT_POOL.db_file),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()}
+    return {'meta': meta, 'results': results}
+
+
+def print_results(results):
+    print('{:<40} {:>11} {:>11} {:>11}'.format(
+        'case', 'median [ms]', 'p95 [ms]', 'min [ms]'))
+    for case, r in results['results'].items():
+        print('{:<40} {:>11.2f} {:>11.2f} {:>11.2f}'.format(
+            case, r['median'] * 1000, r['p95'] * 1000, r['min'] * 1000))
+
+
+def compare(baseline, current, threshold):
+    """
+    Print the change of every case's median and return the regressions.
+    """
+    if baseline['meta']['fixture'] != current['meta']['fixture']:
+        print('Warning: the runs used different fixtures ({} and {})'.format(
+            baseline['meta']['fixture'], current['meta']['fixture']))
+    if baseline['meta'].get('hydat_db') != current['meta'].get('hydat_db'):
+        print('Warning: the runs queried different databases ({} and {})'.format(
+            baseline['meta'].get('hydat_db'), current['meta'].get('hydat_db')))
+    regressions = []
+    print('{:<40} {:>13} {:>13} {:>8}'.format(
+        'case', 'baseline [ms]', 'current [ms]', 'change'))
+    for case, r in current['results'].items():
+        if case not in baseline['results']:
+            print('{:<40} {:>13} {:>13.2f}'.format(case, '-', r['median'] * 1000))
+            continue
+        before = baseline['results'][case]['median']
+        change = r['median'] / before - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(case)
+        elif change < -threshold:
+            flag = '  faster'
+        print('{:<40} {:>13.2f} {:>13.2f} {:>+7.1%}{}'.format(
+            case, before * 1000, r['median'] * 1000, change, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--fixture', default=FIXTURE_DIR)
+    parser.add_argument('--runs', type=int, default=20)
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='run the suite')
+    run_parser.add_argument('--save', help='write the results to this file')
+    compare_parser = subparsers.add_parser(
+        'compare', help='compare results against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current', nargs='?')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error('choose a command: run or compare')
+
+    if args.command == 'compare' and args.current is not None:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        if not os.path.exists(os.path.join(args.fixture, 'fixture.json')):
+            print('Generating the fixture in {}'.format(args.fixture))
+            make_fixture(args.fixture)
+        current = run_suite(args.fixture, args.runs)
+
+    if args.command == 'run':
+        print_results(current)
+        if args.save:
+            os.makedirs(os.path.dirname(os.path.abspath(args.save)),
+                        exist_ok=True)
+            with open(args.save, 'w') as f:
+                json.dump(current, f, indent=2)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print('{} regression(s) over {:.0%}'.format(
+                len(regressions), args.threshold))
+            sys.exit(1)
@@ -15,7 +15,7 @@ echo "Creating firewall rules..."
 gcloud compute firewall-rules create wsc-explorer-lb7-fw --target-tags wsc-explorer-node --allow "tcp:${BACKEND_PORT}" --source-ranges 130.211.0.0/22,35.191.0.0/16
 
 echo "Creating health checks..."
-gcloud compute health-checks create http wsc-explorer-basic-check --port $BACKEND_PORT --healthy-threshold 1 --unhealthy-threshold 10 --check-interval 60 --timeout 60
+gcloud compute health-checks create http wsc-explorer-basic-check --port $BACKEND_PORT --request-path /healthz --healthy-threshold 1 --unhealthy-threshold 10 --check-interval 60 --timeout 60
 
 echo "Creating an instance group..."
 export INSTANCE_GROUP=$(gcloud container clusters describe wsc-explorer-cluster --format="value(instanceGroupUrls)" | awk -F/ '{print $NF}')
@@ -0,0 +1,329 @@
+"""
+Tiered cache for station series.
+
+The first tier is an in-process LRU holding the dataframes themselves,
+bounded by their memory footprint.  The optional second tier is shared
+by the bokeh processes of a pod, as files on a tmpfs.  Behind them,
+memcached is shared by every pod.  The last two store series in a
+compact binary form (raw NumPy arrays, zlib compressed) since JSON would
+cost more to decode than re-running the query.
+"""
+import io
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# returned by get() on a miss, since None is a valid cached value
+# (a station with no daily flow record)
+MISSING = object()
+
+# serialized form of None
+NO_DATA = b'\x00'
+
+
+def serialize_frame(df):
+    """
+    Pack a station dataframe (DATE index, DAILY_UR_* and FLAG_* columns)
+    into compressed bytes without pickling.
+    """
+    if df is None:
+        return NO_DATA
+    arrays = {
+        'index': df.index.values.astype('datetime64[ns]').astype(np.int64),
+        'columns': np.array(df.columns.values, dtype=str),
+    }
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values):
+            arrays['values_{}'.format(i)] = np.asarray(values)
+        else:
+            # flags, as a categorical; label 0 stands for no flag
+            values = pd.Categorical(values)
+            arrays['labels_{}'.format(i)] = np.array(
+                [''] + list(values.categories), dtype=str)
+            arrays['codes_{}'.format(i)] = (values.codes + 1).astype(np.uint8)
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return zlib.compress(buf.getvalue(), 1)
+
+
+def deserialize_frame(data):
+    if data == NO_DATA:
+        return None
+    arrays = np.load(io.BytesIO(zlib.decompress(data)), allow_pickle=False)
+    index = pd.DatetimeIndex(arrays['index'].astype('datetime64[ns]'),
+                             name='DATE')
+    out = pd.DataFrame(index=index)
+    for i, col in enumerate(arrays['columns']):
+        if 'codes_{}'.format(i) in arrays:
+            codes = arrays['codes_{}'.format(i)].astype(np.int16) - 1
+            out[col] = pd.Categorical.from_codes(
+                codes, categories=arrays['labels_{}'.format(i)][1:].tolist())
+        else:
+            out[col] = arrays['values_{}'.format(i)]
+    return out
+
+
+def frame_nbytes(df):
+    if df is None:
+        return 0
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class LRUCache:
+    """
+    Thread-safe LRU mapping bounded by the total size of its values.
+    """
+
+    def __init__(self, max_bytes, sizeof=frame_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, _ = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return MISSING
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {'items': len(self._items),
+                    'bytes': self.nbytes,
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+class SharedCache:
+    """
+    LRU of serialized series in a directory on a tmpfs, shared by all the
+    processes that mount it.  Entries are written to a temporary file and
+    renamed into place, so no process ever reads a partial entry; a hit
+    refreshes the entry's mtime, and the least recently used entries are
+    removed once the directory holds more than max_bytes.
+    """
+
+    def __init__(self, path, max_bytes):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        # the counters are bumped from the worker threads
+        self._lock = threading.Lock()
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def _file(self, key):
+        return os.path.join(self.path, key.replace(os.sep, '_'))
+
+    def get(self, key):
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._count('misses')
+            return MISSING
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted by another process meanwhile
+        self._count('hits')
+        return deserialize_frame(data)
+
+    def set(self, key, value):
+        fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(serialize_frame(value))
+            os.rename(tmp, self._file(key))
+        except OSError as e:
+            # most likely the tmpfs is full
+            logging.warning('Shared cache write failed: {}'.format(e))
+            self._count('errors')
+            os.unlink(tmp)
+            return
+        self.evict()
+
+    def entries(self):
+        """
+        (mtime, size, path) of every entry, least recently used first.
+        """
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.startswith('.tmp-'):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        nbytes = sum(size for (_, size, _) in entries)
+        evictions = 0
+        for _, size, path in entries:
+            if nbytes <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                evictions += 1
+            except FileNotFoundError:
+                pass  # another process got to it first
+            nbytes -= size
+        self._count('evictions', evictions)
+
+    def stats(self):
+        entries = self.entries()
+        with self._lock:
+            return {'items': len(entries),
+                    'bytes': sum(size for (_, size, _) in entries),
+                    'max_bytes': self.max_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'errors': self.errors}
+
+
+class TieredCache:
+    """
+    Local LRU in front of the shared tier, if any, in front of memcached.
+    `get_client` returns the current memcached client, or None when no
+    memcached node is reachable, in which case only the first tiers are
+    used.
+    """
+
+    def __init__(self, get_client, max_bytes, expire=3600, shared=None):
+        self.local = LRUCache(max_bytes)
+        self.shared = shared
+        self.get_client = get_client
+        self.expire = expire
+        self.remote_hits = 0
+        self.remote_misses = 0
+        self.remote_errors = 0
+        # the counters are bumped from the worker threads
+        self._lock = threading.Lock()
+
+    def _count(self, hits=0, misses=0, errors=0):
+        with self._lock:
+            self.remote_hits += hits
+            self.remote_misses += misses
+            self.remote_errors += errors
+
+    def get_many(self, keys):
+        """
+        Return a dict of the cached values found for `keys`, looking in
+        memcached only for the keys missing from the local tier.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+
+        if self.shared is not None:
+            for key in list(missing):
+                value = self.shared.get(key)
+                if value is not MISSING:
+                    self.local.set(key, value)
+                    found[key] = value
+                    missing.remove(key)
+
+        client = self.get_client() if missing else None
+        if client is None:
+            return found
+
+        try:
+            remote = client.get_many(missing)
+        except Exception as e:
+            logging.warning('memcached get_many failed: {}'.format(e))
+            self._count(errors=1)
+            remote = {}
+        hits = [key for key in missing if remote.get(key) is not None]
+        self._count(hits=len(hits), misses=len(missing) - len(hits))
+        for key in hits:
+            value = deserialize_frame(remote[key])
+            self.local.set(key, value)
+            if self.shared is not None:
+                self.shared.set(key, value)
+            found[key] = value
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key, MISSING)
+
+    def set_many(self, values, expire=None):
+        for key, value in values.items():
+            self.local.set(key, value)
+            if self.shared is not None:
+                self.shared.set(key, value)
+
+        client = self.get_client()
+        if client is None:
+            return
+        try:
+            client.set_many({key: serialize_frame(value)
+                             for key, value in values.items()},
+                            expire=self.expire if expire is None else expire)
+        except Exception as e:
+            logging.warning('memcached set_many failed: {}'.format(e))
+            self._count(errors=1)
+
+    def set(self, key, value, expire=None):
+        self.set_many({key: value}, expire)
+
+    def stats(self):
+        stats = {'local_' + k: v for k, v in self.local.stats().items()}
+        if self.shared is not None:
+            stats.update({'shared_' + k: v
+                          for k, v in self.shared.stats().items()})
+        with self._lock:
+            stats.update({'remote_hits': self.remote_hits,
+                          'remote_misses': self.remote_misses,
+                          'remote_errors': self.remote_errors})
+        return stats
@@ -0,0 +1,77 @@
+"""
+Deployment settings.  Everything here can be overridden from the
+environment (see kubernetes/bokeh.yaml) without rebuilding the image.
+"""
+import os
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_DIR = os.environ.get('WSC_DB_DIR',
+                        os.path.join(os.path.dirname(BASE_DIR), 'db'))
+
+STATIONS_CSV = os.environ.get('WSC_STATIONS_CSV',
+                              os.path.join(BASE_DIR, 'data', 'WSC_Stations_Master.csv'))
+CATALOG_DIR = os.environ.get('WSC_CATALOG_DIR',
+                             os.path.join(BASE_DIR, 'data', 'catalog'))
+
+HYDAT_DB = os.environ.get('WSC_HYDAT_DB',
+                          os.path.join(DB_DIR, 'Hydat.sqlite3'))
+FLOW_STORE_DIR = os.environ.get('WSC_FLOW_STORE_DIR',
+                                os.path.join(DB_DIR, 'flow_store'))
+# the used DLY_FLOWS columns in query order (see derived_hydat.py),
+# queried instead of HYDAT_DB when built from it
+DERIVED_HYDAT_DB = os.environ.get('WSC_DERIVED_HYDAT_DB',
+                                  os.path.join(DB_DIR, 'Hydat-derived.sqlite3'))
+
+# read-only HYDAT connections per bokeh worker process.  A pod running
+# `bokeh serve --num-procs=4` holds up to four times this many.
+HYDAT_POOL_SIZE = int(os.environ.get('WSC_HYDAT_POOL_SIZE', 8))
+# seconds a query waits for a free connection before giving up
+HYDAT_POOL_TIMEOUT = float(os.environ.get('WSC_HYDAT_POOL_TIMEOUT', 30))
+HYDAT_MMAP_SIZE = int(os.environ.get('WSC_HYDAT_MMAP_SIZE', 256 * 2**20))
+HYDAT_CACHE_KB = int(os.environ.get('WSC_HYDAT_CACHE_KB', 16 * 2**10))
+
+# size of the in-process tier of the station series cache, per process
+CACHE_MAX_BYTES = int(os.environ.get('WSC_CACHE_MAX_BYTES', 128 * 2**20))
+
+# send the hydrograph downsampled to the plot width (min/max per bucket),
+# refined to the visible window as the user pans and zooms.  Set to 0 to
+# send every daily value, e.g. to compare payloads.
+HYDROGRAPH_LOD = os.environ.get('WSC_HYDROGRAPH_LOD', '1') != '0'
+
+# threads per bokeh process running station queries and searches off the
+# IOLoop; up to HYDAT_POOL_SIZE of them can hold a HYDAT connection
+WORKER_THREADS = int(os.environ.get('WSC_WORKER_THREADS', 4))
+
+# quiet period [ms] before a burst of location/search changes runs one
+# station search
+DEBOUNCE_MS = int(os.environ.get('WSC_DEBOUNCE_MS', 300))
+
+# query the selected stations one by one and draw each line as soon as
+# its data arrives, rather than waiting for one batched query of all of
+# them.  Off by default: a query per station gives up the batched query
+# and the coalescing of identical requests across sessions.
+HYDROGRAPH_PROGRESSIVE = os.environ.get('WSC_HYDROGRAPH_PROGRESSIVE', '0') == '1'
+
+# processes per bokeh process that query and reshape HYDAT series when
+# there is no flow store, handing the arrays back through SHM_DIR.  0 runs
+# the queries on the worker threads instead.
+QUERY_PROCESSES = int(os.environ.get('WSC_QUERY_PROCESSES', 0))
+SHM_DIR = os.environ.get('WSC_SHM_DIR',
+                         '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+# pod-wide shared memory, a tmpfs every bokeh process of the pod can see
+# (see kubernetes/bokeh.yaml): the first process publishes the station
+# catalog there for the others to map, and it holds an LRU of station
+# series between the in-process cache and memcached.  Empty to disable.
+SHARED_DIR = os.environ.get('WSC_SHARED_DIR',
+                            os.path.join(SHM_DIR, 'wsc') if SHM_DIR else '')
+SHARED_CACHE_MAX_BYTES = int(os.environ.get('WSC_SHARED_CACHE_MAX_BYTES',
+                                            48 * 2**20))
+
+# opt-in profiling of the dashboard callbacks (see profiling.py): the
+# fraction of calls profiled, whether a session's URL can ask for every
+# call to be profiled with ?profile=1, and where the profiles are written
+PROFILE_RATE = float(os.environ.get('WSC_PROFILE_RATE', 0))
+PROFILE_QUERY = os.environ.get('WSC_PROFILE_QUERY', '0') != '0'
+PROFILE_DIR = os.environ.get('WSC_PROFILE_DIR',
+                             os.path.join(os.path.dirname(BASE_DIR), 'profiles'))
@@ -10,10 +10,10 @@
 # limitations under the License.
 
 
-import concurrent
 import logging
 import os
 import time
+from functools import partial
 
 import pandas as pd
 from bokeh.events import DoubleTap
@@ -33,6 +33,11 @@ import modules.mapModule
 from get_station_data import get_stations_by_distance
 
 from stations import IDS_AND_COORDS, IDS_TO_NAMES, NAMES_TO_IDS
+from config import HYDROGRAPH_PROGRESSIVE
+from debounce import Debounced
+from landing import get_landing_view
+from profiling import Profiled
+from workers import LatestTask
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -45,44 +50,55 @@ wsc_module = modules.wscModule.Module()
 # wsc_table_module = modules.WSC_Table.Module()
 modules = [map_module, wsc_module]
 
+# station searches and hydrograph queries run on worker threads; only the
+# result of the latest of each is applied to the document
+doc = curdoc()
+map_task = LatestTask(doc, 'station search')
+wsc_task = LatestTask(doc, 'hydrograph update')
+# opt-in profiling of a fraction of the calls doing the data work: the
+# queries on the worker threads and the merging and source building
+# applying their results, see profiling.py
+profiled = Profiled(doc)
+
 # [START fetch_data]
 
 
+@profiled('wsc_data_query')
 def wsc_data_query(stations):
     """
-    Fetch data from WSC for the given stations by running
-    # the database/web queries in parallel.
+    Fetch data from WSC for the given stations with a single
+    batched database query.  Runs on a worker thread, so it
+    mustn't touch the document.
+    :return: (dict of station number to dataframe, seconds taken)
     """
     t0 = time.time()
-    # Collect fetch methods for all dashboard modules
-    # fetch_method = {module.id: getattr(
-    #     module, 'fetch_data') for module in modules}
-
-    # Create a thread pool: one separate thread for each station to be queried
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(stations)) as executor:
-        # Prepare the thread tasks
-        tasks = {}
-        for station in stations:
-            task = executor.submit(
-                getattr(wsc_module, 'fetch_wsc_data'), station)
-            tasks[task] = station
-        # Run the tasks and collect results as they arrive
-        results = {}
-        for task in concurrent.futures.as_completed(tasks):
-            key = tasks[task]
-            results[key] = task.result()
-    # Return results once all tasks have been completed
+    results = getattr(wsc_module, 'fetch_wsc_data_many')(stations)
     t1 = time.time()
-    timer.text = '(Executed queries in %s seconds)' % round(t1 - t0, 2)
-
-    return getattr(wsc_module, 'get_all_data')(results)
+    return results, t1 - t0
 # [END fetch_data]
 
 
+def set_timer(seconds):
+    timer.text = '(Executed queries in %s seconds)' % round(seconds, 2)
+
+
 def update_map_and_tables(attrname, old, new):
     getattr(map_module, 'busy')()
-    # update the source for the map station points
-    getattr(map_module, 'find_nearest_wsc_stations')()
+    # search for stations off the IOLoop, then update the map source
+    map_task.run(profiled('station_search')(
+                     getattr(map_module, 'search_wsc_stations')),
+                 getattr(map_module, 'search_parameters')(),
+                 apply_station_search, errback=station_search_failed)
+
+
+def apply_station_search(stations_df):
+    getattr(map_module, 'update_found_wsc_stations')(stations_df)
+    getattr(map_module, 'unbusy')()
+
+
+def station_search_failed(error):
+    getattr(map_module, 'set_location_error_message')(
+        'Station search failed, please try again.')
     getattr(map_module, 'unbusy')()
 
 
@@ -93,33 +109,81 @@ def update_wsc_module(attrname, old, new):
     # avoid cluttering the UI by limiting simultaneous
     # queries to ten
     if len(new.indices) > 10:
-        getattr(map_module, 'unbusy')()
+        wsc_task.cancel()
+        getattr(wsc_module, 'unbusy')('')
         getattr(map_module, 'set_location_error_message')(
             'Select a maximum of 10 stations.')
     else:
         getattr(map_module, 'set_location_error_message')('')
-        # retrieve the flow series corresponding to the selected stations
-        flow_series = wsc_data_query(
-            getattr(map_module, 'get_selected_stations_by_id')())
+        stations = getattr(map_module, 'get_selected_stations_by_id')()
 
-        # if no stations are returned, don't update the graph but post a warning:
-        if len(flow_series) == 0:
+        # if no stations are selected, don't update the graph but post a warning:
+        if len(stations) == 0:
+            wsc_task.cancel()
+            getattr(wsc_module, 'unbusy')('')
             getattr(map_module, 'set_location_error_message')(
                 'Select one or more stations to compare')
+        elif HYDROGRAPH_PROGRESSIVE:
+            stream_wsc_data(stations)
         else:
-            # in order to add a series to a plot, we need to replace the child
-            # containing the hydrograph in the layout object
-            layout.children[2] = row(getattr(
-                wsc_module, 'make_plot_and_table')(flow_series))
+            # only the stations that aren't plotted yet are queried, on a
+            # worker thread; the hydrograph drops and adds lines in place
+            wsc_task.run(wsc_data_query,
+                         (getattr(wsc_module, 'new_stations')(stations),),
+                         partial(apply_wsc_data, stations),
+                         errback=wsc_query_failed)
+
+
+def stream_wsc_data(stations):
+    """
+    Progressive mode: drop the deselected lines straight away, then query
+    the new stations one per worker thread and draw each line as soon as
+    its data arrives, so the first lines appear as fast as the quickest
+    station rather than the slowest.
+    """
+    getattr(wsc_module, 'drop_stations')(stations)
+    new_stations = getattr(wsc_module, 'new_stations')(stations)
+    loaded = []
+    t0 = time.time()
+
+    @profiled('apply_wsc_station')
+    def station_done(station, flow_series):
+        loaded.append(station)
+        getattr(wsc_module, 'add_stations')([station], {station: flow_series})
+        getattr(wsc_module, 'busy')('Updating... {}/{} stations ({} seconds)'.format(
+            len(loaded), len(new_stations), round(time.time() - t0, 2)))
+
+    def all_done():
+        set_timer(time.time() - t0)
+        getattr(wsc_module, 'unbusy')(timer.text)
+
+    wsc_task.run_each(profiled('fetch_wsc_data')(
+                          getattr(wsc_module, 'fetch_wsc_data')),
+                      new_stations, station_done, done=all_done,
+                      errback=wsc_query_failed)
 
-            getattr(wsc_module, 'unbusy')(timer.text)
+
+@profiled('apply_wsc_data')
+def apply_wsc_data(stations, result):
+    flow_series, seconds = result
+    set_timer(seconds)
+    getattr(wsc_module, 'update_plot')(stations, flow_series)
+    getattr(wsc_module, 'unbusy')(timer.text)
+
+
+def wsc_query_failed(error):
+    getattr(map_module, 'set_location_error_message')(
+        'Station query failed, please try again.')
+    getattr(wsc_module, 'unbusy')('')
 
 
 #############
 # UI Start
-# set initial location
-initial_location = ['08KC001']
-current_lat, current_lng = IDS_AND_COORDS[initial_location[0]]
+# the initial location, its station search and the series of the initially
+# selected stations are the same for every session, and computed once per
+# process (see landing.py)
+t0 = time.time()
+landing_view = get_landing_view()
 timer = Div()
 blocks = {}
 
@@ -127,11 +191,12 @@ blocks = {}
 # Map Initialization
 #########
 # set the initial location source in the map module
-getattr(map_module, 'update_current_location')(current_lat, current_lng)
+getattr(map_module, 'update_current_location')(landing_view.lat,
+                                               landing_view.lng)
 # initialize the lat/lon input values with current location
 getattr(map_module, 'update_coordinate_inputs')()
 # set the data source for plotted station locations
-getattr(map_module, 'find_nearest_wsc_stations')()
+getattr(map_module, 'update_found_wsc_stations')(landing_view.found_stations)
 
 # instantiate the map and associated UI elements
 blocks['modules.mapModule'] = getattr(map_module, 'make_plot')()
@@ -139,14 +204,18 @@ blocks['modules.mapModule'] = getattr(map_module, 'make_plot')()
 ##########
 # Map module callbacks triggering wide updates.
 ##########
+# a burst of location and search distance changes (typing, double taps)
+# runs a single station search once it settles
+station_search = Debounced(doc, update_map_and_tables)
+
 # refresh nearest stations when search distance dropdown value changes
 getattr(map_module, 'search_distance_select').on_change(
-    'value', update_map_and_tables)
+    'value', station_search)
 
 # if the current location changes, trigger an update to the map function,
 # refresh station search, refresh wsc station table and msc station table
 getattr(map_module, 'current_location_source').on_change(
-    'data', update_map_and_tables)
+    'data', station_search)
 
 # have to have a separate callback to update the table source and the map source
 # based on the different selection sources
@@ -157,18 +226,18 @@ getattr(map_module, 'found_wsc_stations_source').on_change(
 # WSC Table and Hydrograph module initialization
 #########
 # intially select closest two stations as an example
-getattr(map_module, 'initialize_selected_wsc_stations')()
-
-# get indices for which stations are selected and retrieve
-# flow series for selected stations
-selected_stations = getattr(
-    map_module, 'get_selected_stations_by_id')()
+getattr(map_module, 'update_selected_wsc_stations')(landing_view.selected)
 
-flow_results = wsc_data_query(selected_stations)
+selected_stations = landing_view.selected_stations
+flow_results = landing_view.flow_results
+set_timer(time.time() - t0)
 
 # instantiate the wsc table and related UI elements
-blocks['modules.wscModule'] = getattr(
-    wsc_module, 'make_plot_and_table')(flow_results)
+blocks['modules.wscModule'] = profiled('make_plot_and_table')(getattr(
+    wsc_module, 'make_plot_and_table'))(selected_stations, flow_results)
+# the hydrograph's refinement to the visible range after a pan or zoom
+wsc_module.range_changed.callback = profiled('update_view')(
+    wsc_module.range_changed.callback)
 
 #########
 # Hydrograph Module Callbacks
@@ -192,5 +261,5 @@ layout = column(
         ),
 )
 
-curdoc().add_root(layout)
-curdoc().title = "WSC Explorer: A DKHydrotech Application"
+doc.add_root(layout)
+doc.title = "WSC Explorer: A DKHydrotech Application"
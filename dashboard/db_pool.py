@@ -0,0 +1,149 @@
+"""
+Pool of read-only connections to the HYDAT SQLite database.
+
+HYDAT is never written by the dashboard, so connections are opened in
+immutable read-only URI mode, which lets SQLite skip file locking and
+change detection.  Each connection is tuned once when it is opened and
+keeps its compiled statements between queries.  A thread holds one
+connection for as long as it is inside `connection()`; nested calls on
+the same thread reuse it instead of checking out a second one.
+
+The pool is per process.  When bokeh forks its worker processes the
+inherited connections are discarded and each worker opens its own.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+
+    def __init__(self, db_file, max_size=8, timeout=30, mmap_size=256 * 2**20,
+                 cache_kb=16 * 2**10, cached_statements=128):
+        self.db_file = db_file
+        self.max_size = max_size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.pragmas = [
+            ('query_only', 1),
+            ('mmap_size', mmap_size),
+            # negative cache_size is in KiB rather than pages
+            ('cache_size', -cache_kb),
+            ('temp_store', 'MEMORY'),
+        ]
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Condition()
+        self._local = threading.local()
+        self._idle = []
+        self._size = 0
+        self._acquired = 0
+        self._waited = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def _connect(self):
+        uri = 'file:{}?mode=ro&immutable=1'.format(
+            pathname2url(os.path.abspath(self.db_file)))
+        try:
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   cached_statements=self.cached_statements)
+        except sqlite3.Error as e:
+            logging.warning('Sqlite3 connection Error: {}'.format(e))
+            raise
+        try:
+            for name, value in self.pragmas:
+                conn.execute('PRAGMA {}={}'.format(name, value))
+        except sqlite3.Error as e:
+            logging.warning('Sqlite3 connection Error: {}'.format(e))
+            conn.close()
+            raise
+        return conn
+
+    def _acquire(self):
+        t0 = time.time()
+        waited = False
+        with self._lock:
+            while not self._idle and self._size >= self.max_size:
+                waited = True
+                remaining = self.timeout - (time.time() - t0)
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        'No HYDAT connection free after {}s'.format(self.timeout))
+                self._lock.wait(remaining)
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                # reserve the slot before connecting outside the lock
+                self._size += 1
+                conn = None
+            wait_time = time.time() - t0
+            self._acquired += 1
+            self._waited += waited
+            self._wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                    self._lock.notify()
+                raise
+        return conn
+
+    def _release(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self):
+        if os.getpid() != self._pid:
+            # forked: the parent's connections must not be shared
+            self._reset()
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pid': self._pid,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'acquired': self._acquired,
+                'waited': self._waited,
+                'wait_time_total': self._wait_time,
+                'wait_time_max': self._max_wait_time,
+            }
@@ -0,0 +1,53 @@
+"""
+Debouncing of bokeh on_change callbacks.
+
+Typing a coordinate, double-tapping around the map or flicking through
+the search distances fires a change per keystroke or click, and each
+change used to run a full station search and push a new station table.
+A Debounced callback waits for a quiet period instead and then runs the
+wrapped callback once for the whole burst.
+"""
+from config import DEBOUNCE_MS
+
+
+class Debounced:
+    """
+    on_change callback that coalesces a burst of changes into a single
+    trailing call of `callback`, made once no change has come for
+    `delay_ms`, with the old value from before the burst and the latest
+    new value.  One Debounced can be registered on several properties to
+    coalesce their changes together.
+    """
+
+    def __init__(self, doc, callback, delay_ms=DEBOUNCE_MS):
+        self.doc = doc
+        self.callback = callback
+        self.delay_ms = delay_ms
+        self.calls = 0
+        self.runs = 0
+        self._timeout = None
+        self._old = None
+        self._pending = None
+
+    def __call__(self, attrname, old, new):
+        self.calls += 1
+        if self._timeout is None:
+            self._old = old
+        else:
+            self.doc.remove_timeout_callback(self._timeout)
+        self._pending = (attrname, new)
+        self._timeout = self.doc.add_timeout_callback(self._run, self.delay_ms)
+
+    def cancel(self):
+        """
+        Drop the pending call, if any.
+        """
+        if self._timeout is not None:
+            self.doc.remove_timeout_callback(self._timeout)
+            self._timeout = None
+
+    def _run(self):
+        self._timeout = None
+        attrname, new = self._pending
+        self.runs += 1
+        self.callback(attrname, self._old, new)
@@ -0,0 +1,153 @@
+"""
+Derived copy of HYDAT's DLY_FLOWS table, laid out for the dashboard's
+queries.
+
+Every query reads one or a few stations' rows in date order.  The
+derived database keeps only the columns that are read (see
+reshape.DLY_FLOWS_COLUMNS) in a WITHOUT ROWID table keyed on
+(STATION_NUMBER, YEAR, MONTH), so each station's rows sit together, in
+order, in the table's own b-tree: a query is one range scan, with no
+index-to-row lookups and no sort.  The table is written in key order and
+ANALYZEd.
+
+get_station_data queries it instead of HYDAT whenever it exists and was
+built from the current HYDAT (same size and modification time).  Build
+it with:
+
+    python dashboard/derived_hydat.py [--db db/Hydat.sqlite3]
+        [--out db/Hydat-derived.sqlite3]
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from urllib.request import pathname2url
+
+from config import DERIVED_HYDAT_DB, HYDAT_DB
+from reshape import DLY_FLOWS_COLUMNS, FLAG_COLUMNS, FLOW_COLUMNS
+
+# bumped whenever the layout changes, so older builds are ignored
+FORMAT_VERSION = 1
+
+# a WITHOUT ROWID table works best with rows under 1/20 of a page, and a
+# DLY_FLOWS row is about 300 bytes
+PAGE_SIZE = 8192
+
+COLUMN_TYPES = dict(
+    [('YEAR', 'INTEGER NOT NULL'), ('MONTH', 'INTEGER NOT NULL'),
+     ('NO_DAYS', 'INTEGER')] +
+    [(column, 'REAL') for column in FLOW_COLUMNS] +
+    [(column, 'TEXT') for column in FLAG_COLUMNS])
+
+CREATE_DLY_FLOWS = (
+    'CREATE TABLE DLY_FLOWS (STATION_NUMBER TEXT NOT NULL, {}, '
+    'PRIMARY KEY (STATION_NUMBER, YEAR, MONTH)) WITHOUT ROWID').format(
+        ', '.join('{} {}'.format(column, COLUMN_TYPES[column])
+                  for column in DLY_FLOWS_COLUMNS))
+
+CREATE_META = ('CREATE TABLE DERIVED_META (KEY TEXT PRIMARY KEY, VALUE) '
+               'WITHOUT ROWID')
+
+
+def sqlite_uri(filename, **params):
+    uri = 'file:{}'.format(pathname2url(os.path.abspath(filename)))
+    if params:
+        uri += '?' + '&'.join('{}={}'.format(k, v) for k, v in params.items())
+    return uri
+
+
+def build_derived_hydat(db_file=HYDAT_DB, out=DERIVED_HYDAT_DB):
+    """
+    Copy the used DLY_FLOWS columns of db_file to a new database at
+    `out`.  It is written to a temporary file renamed into place at the
+    end, so a partial build is never opened.
+    :return: (number of stations, number of station-months)
+    """
+    out_dir = os.path.dirname(os.path.abspath(out))
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.tmp-', suffix='.sqlite3', dir=out_dir)
+    os.close(fd)
+    source = os.stat(db_file)
+    try:
+        conn = sqlite3.connect(sqlite_uri(tmp), uri=True, isolation_level=None)
+        try:
+            conn.execute('PRAGMA page_size={}'.format(PAGE_SIZE))
+            conn.execute('PRAGMA journal_mode=OFF')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('ATTACH DATABASE ? AS hydat',
+                         (sqlite_uri(db_file, mode='ro'),))
+            conn.execute('BEGIN')
+            conn.execute(CREATE_DLY_FLOWS)
+            conn.execute(
+                'INSERT INTO DLY_FLOWS SELECT STATION_NUMBER, {0} '
+                'FROM hydat.DLY_FLOWS ORDER BY STATION_NUMBER, YEAR, MONTH'.format(
+                    ', '.join(DLY_FLOWS_COLUMNS)))
+            conn.execute(CREATE_META)
+            conn.executemany('INSERT INTO DERIVED_META VALUES (?, ?)', [
+                ('format_version', FORMAT_VERSION),
+                ('source', os.path.abspath(db_file)),
+                ('source_size', source.st_size),
+                ('source_mtime_ns', source.st_mtime_ns),
+                ('built', time.strftime('%Y-%m-%dT%H:%M:%S'))])
+            conn.execute('COMMIT')
+            conn.execute('DETACH DATABASE hydat')
+            conn.execute('ANALYZE')
+            n_stations, n_rows = conn.execute(
+                'SELECT COUNT(DISTINCT STATION_NUMBER), COUNT(*) '
+                'FROM DLY_FLOWS').fetchone()
+        finally:
+            conn.close()
+        os.rename(tmp, out)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return n_stations, n_rows
+
+
+def read_meta(path):
+    conn = sqlite3.connect(sqlite_uri(path, mode='ro'), uri=True)
+    try:
+        return dict(conn.execute('SELECT KEY, VALUE FROM DERIVED_META'))
+    finally:
+        conn.close()
+
+
+def hydat_db(derived=DERIVED_HYDAT_DB, source=HYDAT_DB):
+    """
+    The database to query the daily flows from: the derived one if it has
+    been built from the current source, the source otherwise.
+    """
+    if not os.path.exists(derived):
+        return source
+    try:
+        meta = read_meta(derived)
+    except sqlite3.Error as e:
+        logging.warning('Could not read {}: {}'.format(derived, e))
+        return source
+    if meta.get('format_version') != FORMAT_VERSION:
+        logging.warning('{} has an old layout, querying {}'.format(
+            derived, source))
+        return source
+    if os.path.exists(source):
+        stat = os.stat(source)
+        if (stat.st_size, stat.st_mtime_ns) != (meta.get('source_size'),
+                                                meta.get('source_mtime_ns')):
+            logging.warning('{} was built from another {}, querying it '
+                            'instead'.format(derived, source))
+            return source
+    return derived
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the derived, query-ordered copy of DLY_FLOWS.')
+    parser.add_argument('--db', default=HYDAT_DB)
+    parser.add_argument('--out', default=DERIVED_HYDAT_DB)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    n_stations, n_rows = build_derived_hydat(args.db, args.out)
+    print('Wrote {} station-months for {} stations to {} in {}s'.format(
+        n_rows, n_stations, args.out, round(time.time() - t0, 1)))
@@ -0,0 +1,118 @@
+"""
+Peak-preserving downsampling of hydrographs for display.
+
+The time axis is cut into equal-width buckets, one per pixel or so, and
+each series keeps its minimum and its maximum in every bucket, in the
+order they occur, at the times they occur.  Flood peaks and low-flow
+minima therefore always survive, whatever the zoom level, and the line
+looks the same as the full series at that resolution.  The series are
+downsampled to the same number of points but each at its own times, so
+they stay in one ColumnDataSource with an x column per series.
+"""
+import json
+
+import numpy as np
+
+
+def bucket_bounds(x, n_buckets, start=None, end=None):
+    """
+    Cut the sorted array x into n_buckets intervals of equal width
+    between start and end (default: the extent of x).
+    :return: (starts, ends) row indices of the non-empty buckets
+    """
+    start = x[0] if start is None else start
+    end = x[-1] if end is None else end
+    edges = np.linspace(start, end, n_buckets + 1)
+    bounds = np.searchsorted(x, edges, side='left')
+    # the last edge is inclusive
+    bounds[-1] = np.searchsorted(x, end, side='right')
+    starts, ends = bounds[:-1], bounds[1:]
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+
+def _bucket_argext(values, starts, counts, largest):
+    """
+    Row index of the first smallest (or largest) non-NaN value in each
+    bucket, or of the bucket's first row if it only holds NaN.
+    """
+    ext = (np.fmax if largest else np.fmin).reduceat(values, starts)
+    rows = np.arange(len(values))
+    hit = values == np.repeat(ext, counts)
+    first = np.minimum.reduceat(np.where(hit, rows, len(values)), starts)
+    return np.where(first < len(values), first, starts)
+
+
+def minmax_downsample(x, ys, n_buckets, start=None, end=None):
+    """
+    Downsample series sharing the time axis x to two points per bucket.
+    :param x: sorted 1-D array of times (int64 or float)
+    :param ys: (len(x), k) float array, one column per series
+    :param n_buckets: number of buckets, e.g. the plot width in pixels
+    :param start: first time of the window to downsample (default x[0])
+    :param end: last time of the window (default x[-1])
+    :return: (n, k) array of the rows of x and ys each series plots: its
+        time, value (and flag) are all taken from the same row.
+    """
+    ys = np.asarray(ys).reshape(len(x), -1)
+    starts, ends = bucket_bounds(x, n_buckets, start, end)
+    if len(starts) == 0:
+        return np.empty((0, ys.shape[1]), dtype=int)
+    if ends[-1] - starts[0] <= 2 * len(starts):
+        rows = np.arange(starts[0], ends[-1])
+        return np.repeat(rows[:, np.newaxis], ys.shape[1], axis=1)
+
+    lo, hi = starts[0], ends[-1]
+    counts = ends - starts
+    idx = np.empty((2 * len(starts), ys.shape[1]), dtype=int)
+    for j in range(ys.shape[1]):
+        values = ys[lo:hi, j]
+        i_min = _bucket_argext(values, starts - lo, counts, False) + lo
+        i_max = _bucket_argext(values, starts - lo, counts, True) + lo
+        idx[:, j] = np.column_stack([np.minimum(i_min, i_max),
+                                     np.maximum(i_min, i_max)]).ravel()
+    return idx
+
+
+def view_rows(x, ys, n_buckets, start=None, end=None):
+    """
+    Rows to display for the window [start, end]: the window itself at
+    n_buckets resolution, and the rest of the record as a coarse overview
+    so the plot can be panned or zoomed out before the next update.
+    :return: rows of each series, as for minmax_downsample
+    """
+    x0, x1 = x[0], x[-1]
+    start = x0 if start is None else max(start, x0)
+    end = x1 if end is None else min(end, x1)
+    if start >= end:
+        start, end = x0, x1
+
+    parts = []
+    for a, b in [(x0, start), (start, end), (end, x1)]:
+        if b <= a:
+            continue
+        if (a, b) == (start, end):
+            n = n_buckets
+        else:
+            n = max(1, int(round(n_buckets * (b - a) / (x1 - x0))))
+        parts.append(minmax_downsample(x, ys, n, a, b))
+    if not parts:
+        return minmax_downsample(x, ys, n_buckets)
+    return np.concatenate(parts)
+
+
+def payload_nbytes(data):
+    """
+    Approximate size of ColumnDataSource columns on the websocket: arrays
+    of floats, datetimes and integers up to 32 bits are sent base64
+    encoded, anything else as JSON lists.
+    """
+    nbytes = 0
+    for values in data.values():
+        values = np.asarray(values)
+        if values.dtype.kind in 'fM' or (values.dtype.kind in 'iu' and
+                                         values.dtype.itemsize <= 4):
+            nbytes += values.nbytes * 4 // 3
+        else:
+            nbytes += len(json.dumps(values.tolist()))
+    return nbytes
@@ -0,0 +1,201 @@
+"""
+Columnar, memory-mapped store of HYDAT daily flows.
+
+The wide DLY_FLOWS table (one row per station-month, 31 FLOW / FLOW_SYMBOL
+column pairs) is melted once, offline, into three flat arrays sorted by
+station and date:
+
+    days.bin   int32    days since 1970-01-01
+    flows.bin  float32  daily discharge [m³/s]
+    flags.bin  uint8    index into meta['flag_labels'] (0 = no flag)
+
+`meta.json` holds the station ids, the offsets of each station's run of
+rows in the arrays, the flag labels and the size and modification time
+of the HYDAT file it was built from; a store built from another HYDAT
+than the current one is not used.  At runtime the arrays are opened with
+np.memmap so a station's series is a zero-copy slice.
+
+Build the store from the official database with:
+
+    python dashboard/flow_store.py [--db db/Hydat.sqlite3] [--out db/flow_store]
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from config import FLOW_STORE_DIR, HYDAT_DB
+
+
+ARRAYS = {
+    'days': np.int32,
+    'flows': np.float32,
+    'flags': np.uint8,
+}
+
+
+class FlowStore:
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.stations = meta['stations']
+        self.offsets = np.asarray(meta['offsets'], dtype=np.int64)
+        self.flag_labels = np.array(
+            [None] + meta['flag_labels'][1:], dtype=object)
+        self._index = {stn: i for i, stn in enumerate(self.stations)}
+        # the HYDAT file the store was built from, see get_flow_store
+        self.source_size = meta.get('source_size')
+        self.source_mtime_ns = meta.get('source_mtime_ns')
+
+        n_rows = int(self.offsets[-1])
+        for name, dtype in ARRAYS.items():
+            fname = os.path.join(path, name + '.bin')
+            if n_rows > 0:
+                arr = np.memmap(fname, dtype=dtype, mode='r', shape=(n_rows,))
+            else:
+                arr = np.empty(0, dtype=dtype)
+            setattr(self, name, arr)
+
+    def __contains__(self, station):
+        return station in self._index
+
+    def get_series(self, station):
+        """
+        Return the (days, flows, flags) slices for a station, or None
+        if the station has no daily flow record.  The slices are views
+        on the memory-mapped arrays, nothing is copied.
+        """
+        i = self._index.get(station)
+        if i is None:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.days[start:end], self.flows[start:end], self.flags[start:end]
+
+    def decode_flags(self, codes):
+        return self.flag_labels[codes]
+
+
+_flow_store = None
+_flow_store_opened = False
+_flow_store_lock = threading.Lock()
+
+
+def open_flow_store(path=FLOW_STORE_DIR, source=HYDAT_DB):
+    """
+    :return: the FlowStore at `path`, or None if it hasn't been built,
+        was built from another `source` than the current one or can't
+        be opened
+    """
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    try:
+        store = FlowStore(path)
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning('Could not open flow store {}: {}'.format(path, e))
+        return None
+    if os.path.exists(source):
+        stat = os.stat(source)
+        if (stat.st_size, stat.st_mtime_ns) != (store.source_size,
+                                                store.source_mtime_ns):
+            logging.warning('Flow store {} was built from another {}, '
+                            'querying it instead'.format(path, source))
+            return None
+    return store
+
+
+def get_flow_store(path=FLOW_STORE_DIR, source=HYDAT_DB):
+    """
+    Open the flow store once per process.  Returns None when the store
+    has not been built, is stale or is broken, so callers can fall back to
+    querying SQLite; that is remembered rather than retried on every call.
+    """
+    global _flow_store, _flow_store_opened
+    if not _flow_store_opened:
+        with _flow_store_lock:
+            if not _flow_store_opened:
+                _flow_store = open_flow_store(path, source)
+                _flow_store_opened = True
+    return _flow_store
+
+
+def build_flow_store(db_file, path=FLOW_STORE_DIR):
+    """
+    Melt every station in DLY_FLOWS into the columnar store at `path`.
+    The arrays are streamed to disk station by station, and meta.json is
+    written last so a partially built store is never opened.
+    """
+    # imported here so that reading the store doesn't pull in the
+    # station catalog
+    from get_station_data import read_dly_flows
+
+    os.makedirs(path, exist_ok=True)
+    meta_file = os.path.join(path, 'meta.json')
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+
+    source = os.stat(db_file)
+    conn = sqlite3.connect(db_file)
+    cur = conn.cursor()
+    cur.execute("SELECT DISTINCT STATION_NUMBER FROM DLY_FLOWS ORDER BY STATION_NUMBER")
+    all_stations = [row[0] for row in cur.fetchall()]
+
+    flag_labels = ['']
+    stations = []
+    offsets = [0]
+    files = {name: open(os.path.join(path, name + '.bin'), 'wb')
+             for name in ARRAYS}
+    try:
+        for station in all_stations:
+            dates, flows, flags = read_dly_flows(conn, station)
+            if len(dates) == 0:
+                continue
+
+            labels, inverse = np.unique(
+                np.where(flags == None, '', flags).astype(str),  # noqa: E711
+                return_inverse=True)
+            for label in labels:
+                if label not in flag_labels:
+                    flag_labels.append(label)
+            codes = np.array([flag_labels.index(e) for e in labels])[inverse]
+
+            files['days'].write(dates.astype(np.int64).astype(np.int32).tobytes())
+            files['flows'].write(flows.astype(np.float32).tobytes())
+            files['flags'].write(codes.astype(np.uint8).tobytes())
+
+            stations.append(station)
+            offsets.append(offsets[-1] + len(dates))
+    finally:
+        for f in files.values():
+            f.close()
+        conn.close()
+
+    with open(meta_file, 'w') as f:
+        json.dump({'source': os.path.abspath(db_file),
+                   'source_size': source.st_size,
+                   'source_mtime_ns': source.st_mtime_ns,
+                   'built': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'stations': stations,
+                   'offsets': offsets,
+                   'flag_labels': flag_labels}, f)
+
+    return len(stations), offsets[-1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the columnar daily flow store from HYDAT.')
+    parser.add_argument('--db', default=HYDAT_DB)
+    parser.add_argument('--out', default=FLOW_STORE_DIR)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    n_stations, n_rows = build_flow_store(args.db, args.out)
+    print('Wrote {} daily values for {} stations to {} in {}s'.format(
+        n_rows, n_stations, args.out, round(time.time() - t0, 1)))
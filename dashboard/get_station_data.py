@@ -1,174 +1,287 @@
 import numpy as np
 import pandas as pd
-import math
 import os
-import sys
+import threading
 import time
-import re
-from datetime import date
-import utm
 import logging
 
 import sqlite3
-import scipy.spatial
-
-from stations import IDS_AND_DAS, STATIONS_DF
+from concurrent.futures import ProcessPoolExecutor
+
+from config import (HYDAT_CACHE_KB, HYDAT_MMAP_SIZE, HYDAT_POOL_SIZE,
+                    HYDAT_POOL_TIMEOUT, QUERY_PROCESSES)
+from db_pool import ConnectionPool
+from derived_hydat import hydat_db
+from flow_store import get_flow_store
+from metrics import observe, timed
+from reshape import DLY_FLOWS_COLUMNS, block_to_long, rows_to_long, split_runs
+from shm import read_arrays, write_arrays
+from spatial_index import StationIndex
+from stations import IDS_AND_DAS, STATION_COLUMNS, STATION_XYZ
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data/')
-DB_DIR = os.path.join(os.path.dirname(BASE_DIR), 'db')
 
-day_labels = {}
-flag_labels = {}
-for i in range(1, 32):
-    day_labels['FLOW' + str(i)] = i
-    flag_labels['FLOW_SYMBOL' + str(i)] = i
+# the derived DLY_FLOWS copy when it has been built, else HYDAT itself
+HYDAT_POOL = ConnectionPool(hydat_db(),
+                            max_size=HYDAT_POOL_SIZE,
+                            timeout=HYDAT_POOL_TIMEOUT,
+                            mmap_size=HYDAT_MMAP_SIZE,
+                            cache_kb=HYDAT_CACHE_KB)
 
+# started by the on_server_loaded hook (or on first use) when
+# QUERY_PROCESSES > 0
+QUERY_POOL = None
+_query_pool_lock = threading.Lock()
 
-def create_connection(db_file):
-    """ create a database connection to the SQLite database
-        specified by the db_file
-    :param db_file: database file
-    :return: Connection object or None
-    """
-    try:
-        conn = sqlite3.connect(db_file)
-        return conn
-    except sqlite3.Error as e:
-        logging.warn('Sqlite3 connection Error: {}'.format(e))
-        print(e)
+# built once per process; searches only read from it
+STATION_INDEX = StationIndex(STATION_COLUMNS, STATION_XYZ,
+                             STATION_COLUMNS['Elevation'])
 
-    return None
+SELECT_DLY_FLOWS = "SELECT {} FROM DLY_FLOWS WHERE STATION_NUMBER=? ORDER BY YEAR, MONTH".format(
+    ', '.join(DLY_FLOWS_COLUMNS))
+SELECT_DLY_FLOWS_MANY = "SELECT STATION_NUMBER, {} FROM DLY_FLOWS WHERE STATION_NUMBER IN ({{}}) ORDER BY STATION_NUMBER, YEAR, MONTH".format(
+    ', '.join(DLY_FLOWS_COLUMNS))
 
+# stay well under SQLite's default limit of 999 bound parameters
+MAX_QUERY_STATIONS = 500
 
-def get_daily_UR(station):
-    time0 = time.time()
-    # create a database connection
-    cols = ['STATION_NUMBER', 'YEAR', 'MONTH', 'NO_DAYS']
+# HYDAT DATA_SYMBOLS: partial day, backwater, dry, estimated, revised
+FLAG_SYMBOLS = ['A', 'B', 'D', 'E', 'R']
 
-    cols += day_labels.keys()
 
-    columns = ['YEAR', 'MONTH', 'NO_DAYS']
-    conn = create_connection(os.path.join(DB_DIR, 'Hydat.sqlite3'))
+def get_daily_UR(station):
+    # read the pre-melted series from the columnar flow store when it
+    # has been built, otherwise reshape the wide DLY_FLOWS rows
+    store = get_flow_store()
+    if store is not None:
+        return select_dly_flows_from_store(store, station)
+
+    if QUERY_PROCESSES > 0:
+        return select_dly_flows_in_processes([station], get_query_pool())[station]
 
-    with conn:
+    with HYDAT_POOL.connection() as conn:
         return select_dly_flows_by_station_ID(conn, station)
 
-    conn.close()
 
+def get_daily_UR_many(stations):
+    """
+    Fetch the daily unit runoff of several stations at once.
+    :param stations: list of station numbers
+    :return: dict of station number to dataframe (None if no record)
+    """
+    stations = list(dict.fromkeys(stations))
+    store = get_flow_store()
+    if store is not None:
+        return {station: select_dly_flows_from_store(store, station)
+                for station in stations}
+
+    if QUERY_PROCESSES > 0:
+        return select_dly_flows_in_processes(stations, get_query_pool())
 
-def map_day_to_var_name(s):
-    if re.search('\d', s):
-        return s[re.search('\d', s).span()[0]:]
-    else:
-        print('substring not found')
+    with HYDAT_POOL.connection() as conn:
+        return select_dly_flows_by_station_IDs(conn, stations)
 
 
-def melt_(df):
-    id_vars = df.index.names
-    return df.reset_index().melt(id_vars=id_vars).set_index(id_vars)
+def get_query_pool():
+    global QUERY_POOL
+    if QUERY_POOL is None:
+        with _query_pool_lock:
+            if QUERY_POOL is None:
+                QUERY_POOL = ProcessPoolExecutor(max_workers=QUERY_PROCESSES)
+    return QUERY_POOL
 
 
-def select_dly_flows_by_station_ID(conn, station):
+def start_query_pool():
     """
-    Query tasks by priority
-    :param conn: the Connection object
-    :param station: station number (ID) according to WSC convention
-    :return: dataframe object of daily flows
+    Fork the query processes now, if there are to be any.  The pool forks
+    them on its first job, and a fork only copies the thread that made
+    it: forked once the worker threads are running, a child could inherit
+    a lock one of them held, never to be released.
     """
-    time0 = time.time()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM DLY_FLOWS WHERE STATION_NUMBER=?", (station,))
-
-    rows = cur.fetchall()
+    if QUERY_PROCESSES > 0:
+        get_query_pool().submit(os.getpid).result()
 
-    column_headers = [description[0] for description in cur.description]
-    id_var_headers = column_headers[:11]
 
-    df = pd.DataFrame(rows, columns=column_headers)
-    df.drop(['MONTHLY_MEAN', 'MONTHLY_TOTAL', 'FIRST_DAY_MIN',
-             'MIN', 'FIRST_DAY_MAX', 'MAX'], axis=1, inplace=True)
-
-    timex = time.time()
-    all_val_vars = [e for e in column_headers if 'FLOW' in e]
-    flag_val_vars = [e for e in all_val_vars if 'FLOW_SYMBOL' in e]
-    flow_val_vars = [e for e in all_val_vars if '_' not in e]
+def read_dly_flows_to_shm(station):
+    """
+    Process pool job: query and reshape a station's daily flows, and
+    hand the arrays back through shared memory rather than pickling them.
+    :return: (path, layout, flag categories), see shm.read_arrays
+    """
+    with HYDAT_POOL.connection() as conn:
+        dates, flows, flags = read_dly_flows(conn, station)
+    flags = flags_to_categorical(flags)
+    path, layout = write_arrays([
+        np.asarray(flows, dtype=np.float64),
+        np.asarray(dates, dtype='datetime64[D]').astype(np.int32),
+        (flags.codes + 1).astype(np.uint8)])
+    return path, layout, list(flags.categories)
 
-    df_flows = pd.melt(df,
-                       id_vars=id_var_headers,
-                       value_vars=flow_val_vars,
-                       value_name='DAILY_FLOW',
-                       var_name='DAY').sort_values(by=['YEAR', 'MONTH'])
 
-    df_flows['DAY'] = df_flows['DAY'].apply(
-        map_day_to_var_name)
+def select_dly_flows_in_processes(stations, executor):
+    """
+    Query and reshape each station in a process of the executor.
+    :param stations: list of station numbers
+    :param executor: ProcessPoolExecutor
+    :return: dict of station number to dataframe (None if no record)
+    """
+    futures = [(station, executor.submit(read_dly_flows_to_shm, station))
+               for station in stations]
+    results = {}
+    read = 0
+    try:
+        for station, future in futures:
+            path, layout, categories = future.result()
+            read += 1
+            flows, days, codes = read_arrays(path, layout)
+            if len(days) == 0:
+                results[station] = None
+                continue
+            flags = pd.Categorical.from_codes(codes.astype(np.int16) - 1,
+                                              categories=categories)
+            results[station] = make_daily_UR_frame(
+                station, days.astype('datetime64[D]'), flows, flags)
+    finally:
+        # if a job failed, the files of the ones after it are left to
+        # remove
+        for station, future in futures[read:]:
+            discard_shm_result(future)
+    return results
+
+
+def discard_shm_result(future):
+    """
+    Remove the shared memory file of a read_dly_flows_to_shm job whose
+    result won't be read, waiting for the job if it has started.
+    """
+    if future.cancel():
+        return
+    try:
+        path = future.result()[0]
+    except Exception:
+        return
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
 
-    df_flags = pd.melt(df,
-                       id_vars=id_var_headers,
-                       value_vars=flag_val_vars,
-                       value_name='FLAG',
-                       var_name='DAY').sort_values(by=['YEAR', 'MONTH'])
 
-    # print('time to melt = ', time.time() - timex)
-    df_flows['FLAG'] = df_flags['FLAG']
-    # filter out day row if it's not a day that exists in given month
-    df_flows = df_flows[df_flows['DAY'].astype(
-        int) <= df_flows['NO_DAYS'].astype(int)].dropna(subset=['DAILY_FLOW'])
+def select_dly_flows_from_store(store, station):
+    """
+    Read a station's daily flows from the memory-mapped flow store
+    :param store: FlowStore object
+    :param station: station number (ID) according to WSC convention
+    :return: dataframe object of daily flows
+    """
+    with timed('store_fetch', 1):
+        series = store.get_series(station)
+    if series is None:
+        return None
+    days, flows, flags = series
+    return make_daily_UR_frame(station,
+                               days.astype('datetime64[D]'),
+                               flows.astype(np.float64),
+                               store.decode_flags(flags))
 
-    dates = df_flows['YEAR'].astype(
-        str) + '-' + df_flows['MONTH'].astype(str) + '-' + df_flows['DAY'].astype(str)
-    df_flows['DATE'] = pd.to_datetime(dates, format='%Y-%m-%d')
 
-    out = pd.DataFrame()
-    out['DATE'] = df_flows['DATE']
+def make_daily_UR_frame(station, dates, flows, flags):
+    """
+    Convert a station's daily flows [m³/s] into a dataframe of unit
+    runoff [L/s/km², float32] and flags (categorical) indexed by date.
+    """
+    out = pd.DataFrame(index=pd.DatetimeIndex(
+        np.asarray(dates).astype('datetime64[ns]'), name='DATE'))
     if IDS_AND_DAS[station] > 0:
-        out['DAILY_UR_{}'.format(
-            station)] = df_flows['DAILY_FLOW'] / IDS_AND_DAS[station] * 1000
-    out['FLAG_{}'.format(station)] = df_flows['FLAG']
-    out.set_index('DATE', inplace=True)
+        out['DAILY_UR_{}'.format(station)] = (np.asarray(
+            flows, dtype=np.float64) / IDS_AND_DAS[station] * 1000).astype(np.float32)
+    out['FLAG_{}'.format(station)] = flags_to_categorical(flags)
     if len(out) > 0:
         return out
     else:
         return None
 
 
-def deg2rad(degree):
-    rad = degree * 2 * np.pi / 360
-    return rad
+def flags_to_categorical(flags):
+    """
+    Return flag symbols (None for no flag) as a Categorical over
+    FLAG_SYMBOLS, so that codes + 1 is the same uint8 flag code for
+    every station, 0 meaning no flag.
+    """
+    if not isinstance(flags, pd.Categorical):
+        flags = pd.Categorical(np.asarray(flags, dtype=object))
+    extra = [e for e in flags.categories if e not in FLAG_SYMBOLS]
+    return flags.set_categories(FLAG_SYMBOLS + extra)
 
 
-def get_xyz_distance(lat, lon, target):
+def read_dly_flows(conn, station):
     """
-    Converts lat/lon to x, y, z.
-    Does not account for elevation of target location.
-    Just assumes stations are at same elevation
+    Query the wide DLY_FLOWS rows for a station and reshape them
+    into one value per day
+    :param conn: the Connection object
+    :param station: station number (ID) according to WSC convention
+    :return: (dates, flows, flags) arrays in date order
     """
-    r = 6378137 + target.Elevation
-    x = r * np.cos(deg2rad(lat)) * np.cos(deg2rad(lon))
-    y = r * np.cos(deg2rad(lat)) * np.sin(deg2rad(lon))
-    z = r * np.sin(deg2rad(lat)) * (1 - 1 / 298.257223563)
+    with timed('sqlite_fetch', 1):
+        cur = conn.cursor()
+        cur.execute(SELECT_DLY_FLOWS, (station,))
+        rows = cur.fetchall()
+    with timed('reshape', 1):
+        dates, flows, flags, _ = rows_to_long(rows)
+    return dates, flows, flags
 
-    return scipy.spatial.distance.euclidean(target.xyz_coords, [x, y, z])
+
+def select_dly_flows_by_station_ID(conn, station):
+    """
+    Query tasks by priority
+    :param conn: the Connection object
+    :param station: station number (ID) according to WSC convention
+    :return: dataframe object of daily flows
+    """
+    return make_daily_UR_frame(station, *read_dly_flows(conn, station))
+
+
+def select_dly_flows_by_station_IDs(conn, stations):
+    """
+    Query the daily flows of several stations with one IN (...) query
+    per MAX_QUERY_STATIONS stations, reshape all the rows together and
+    split the result by station.
+    :param conn: the Connection object
+    :param stations: list of station numbers (IDs)
+    :return: dict of station number to dataframe (None if no record)
+    """
+    results = {station: None for station in stations}
+    for i in range(0, len(stations), MAX_QUERY_STATIONS):
+        chunk = stations[i:i + MAX_QUERY_STATIONS]
+        with timed('sqlite_fetch', len(chunk)):
+            cur = conn.cursor()
+            cur.execute(SELECT_DLY_FLOWS_MANY.format(
+                ', '.join('?' * len(chunk))), chunk)
+            rows = cur.fetchall()
+        if len(rows) == 0:
+            continue
+
+        with timed('reshape', len(chunk)):
+            block = np.array(rows, dtype=object)
+            dates, flows, flags, counts = block_to_long(block[:, 1:])
+        for station, start, end in split_runs(block[:, 0], counts):
+            results[station] = make_daily_UR_frame(
+                station, dates[start:end], flows[start:end], flags[start:end])
+    return results
 
 
 def get_stations_by_distance(lat, lon, radius):
     # input target location decimal degrees [lat, lon]
     # (search) radius in km
-    # Returns a dataframe of stations sorted by closest to the
+    # Returns a new dataframe of stations sorted by closest to the
     # current location
+    t0 = time.perf_counter()
+    found = STATION_INDEX.query_radius(lat, lon, radius)
+    observe('station_search', len(found), time.perf_counter() - t0)
+    return found
 
-    dist = [get_xyz_distance(lat, lon, station[1])
-            for station in STATIONS_DF.iterrows()]
-
-    # STATIONS_DF['distance_to_target'] = round(np.sqrt((STATIONS_DF['utm_E'] - target_loc[0])**2 +
-    #                                                   (STATIONS_DF['utm_N'] - target_loc[1])**2) / 1000, 1)
-
-    STATIONS_DF['distance_to_target'] = [round(e / 1000, 1) for e in dist]
-
-    # enter the distance from the target to search for stations
-    search_radius = radius
-
-    target_stns = STATIONS_DF[STATIONS_DF['distance_to_target']
-                              <= search_radius].sort_values('distance_to_target')
 
-    return target_stns
+def get_nearest_stations(lat, lon, k):
+    # Returns a new dataframe of the k stations closest
+    # to the target location
+    return STATION_INDEX.query_nearest(lat, lon, k)
@@ -0,0 +1,80 @@
+"""
+Health checks for the load balancer and the kubernetes probes, and the
+Prometheus metrics.
+
+They are plain Tornado handlers added to the bokeh server by serve.py,
+so a probe never creates a bokeh session, and the health checks do no
+I/O beyond a stat(): they only report the state the serving process
+already has.
+
+/healthz (liveness) answers as long as the process' IOLoop does.
+/readyz (readiness) answers 200 once the process has loaded the station
+catalog and computed its landing view (see landing.py), which takes the
+whole query path, and the HYDAT database is readable; 503 until then.
+Memcached is reported but not required, since the app runs without it.
+
+/metrics renders the stage histograms and stats of metrics.py.
+"""
+import json
+import os
+import sys
+
+from tornado.web import RequestHandler
+
+from config import HYDAT_DB
+from metrics import collect, render
+
+
+def readiness():
+    """
+    :return: (ready, dict of check name to result)
+    """
+    # modules are looked up rather than imported: importing them would
+    # load the catalog from inside a probe
+    stations = sys.modules.get('stations')
+    landing = sys.modules.get('landing')
+    utils = sys.modules.get('utils')
+    get_station_data = sys.modules.get('get_station_data')
+    # the database queried, which may be the derived copy of HYDAT
+    hydat = (get_station_data.HYDAT_POOL.db_file
+             if get_station_data is not None else HYDAT_DB)
+    checks = {
+        'catalog': stations is not None,
+        'landing_view': landing is not None and landing.ready(),
+        'hydat': os.access(hydat, os.R_OK),
+        'memcached_nodes': (utils.memcached_discovery.stats()['nodes']
+                            if utils is not None else 0),
+    }
+    ready = checks['catalog'] and checks['landing_view'] and checks['hydat']
+    return ready, checks
+
+
+class HealthHandler(RequestHandler):
+
+    def get(self):
+        self.set_header('Cache-Control', 'no-store')
+        self.write('ok')
+
+
+class ReadyHandler(RequestHandler):
+
+    def get(self):
+        ready, checks = readiness()
+        self.set_status(200 if ready else 503)
+        self.set_header('Content-Type', 'application/json')
+        self.set_header('Cache-Control', 'no-store')
+        self.write(json.dumps(dict(checks, ready=ready)))
+
+
+class MetricsHandler(RequestHandler):
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(render(collect()))
+
+
+EXTRA_PATTERNS = [
+    ('/healthz', HealthHandler),
+    ('/readyz', ReadyHandler),
+    ('/metrics', MetricsHandler),
+]
@@ -0,0 +1,78 @@
+"""
+The landing view: the location, station search and hydrograph series
+every session opens on.
+
+They are the same for every session, so they are computed once per
+process, by on_server_loaded (server_lifecycle.py) before the first
+session or else by the first session itself, and each new session starts
+from a copy instead of searching and querying again.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from get_station_data import get_stations_by_distance
+from modules.wscModule import HYDROGRAPH_CACHE_KEY
+from stations import IDS_AND_COORDS
+from utils import run_query_many
+
+INITIAL_STATION = '08KC001'
+# mapModule's default search distance [km]
+INITIAL_SEARCH_DISTANCE = 50
+# rows of the station search selected initially: the closest two stations
+INITIAL_SELECTION = [0, 1]
+
+LandingView = namedtuple('LandingView', [
+    'lat', 'lng', 'found_stations', 'selected', 'selected_stations',
+    'flow_results'])
+
+_landing_view = None
+_lock = threading.Lock()
+
+
+def compute_landing_view():
+    lat, lng = IDS_AND_COORDS[INITIAL_STATION]
+    found_stations = get_stations_by_distance(lat, lng, INITIAL_SEARCH_DISTANCE)
+    selected_stations = [found_stations['Station Number'].iloc[i]
+                         for i in INITIAL_SELECTION]
+    flow_results = run_query_many(
+        selected_stations,
+        cache_keys=[HYDROGRAPH_CACHE_KEY % e for e in selected_stations])
+    return LandingView(lat, lng, found_stations, INITIAL_SELECTION,
+                       selected_stations, flow_results)
+
+
+def prewarm():
+    """
+    Compute this process' landing view, if not done yet.
+    :return: seconds taken
+    """
+    global _landing_view
+    t0 = time.time()
+    with _lock:
+        if _landing_view is None:
+            _landing_view = compute_landing_view()
+            logging.info('Landing view computed in {:.2f} seconds'.format(
+                time.time() - t0))
+    return time.time() - t0
+
+
+def ready():
+    """
+    Whether this process' landing view has been computed.
+    """
+    return _landing_view is not None
+
+
+def get_landing_view():
+    """
+    A copy of the landing view for a new session.  The station series are
+    shared, as they are with the query cache: sessions never modify them.
+    """
+    prewarm()
+    view = _landing_view
+    return view._replace(found_stations=view.found_stations.copy(),
+                         selected=list(view.selected),
+                         selected_stations=list(view.selected_stations),
+                         flow_results=dict(view.flow_results))
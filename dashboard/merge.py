@@ -0,0 +1,199 @@
+"""
+Calendar-aligned merge of station series for the hydrograph.
+
+Instead of an outer-join concat, which builds the union of the stations'
+DatetimeIndexes and re-aligns every column onto it, each station's dates
+are turned into integer day offsets on one continuous daily calendar
+and all the series are scattered into preallocated (days x stations)
+arrays with a single fancy-index assignment per array.  Days no station
+has a value for stay NaN, which also breaks the lines over gaps in the
+record rather than joining across them.
+"""
+import numpy as np
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+DAY_MS = 86400000
+
+
+def to_days(index):
+    """
+    Days since EPOCH of a DatetimeIndex, as int64.
+    """
+    return (index.values.astype('datetime64[D]') - EPOCH).astype(np.int64)
+
+
+def flag_codes(flags):
+    """
+    uint8 codes of a categorical flag column, 0 meaning no flag
+    """
+    return (np.asarray(flags.cat.codes) + 1).astype(np.uint8)
+
+
+def ur_label(station):
+    return 'DAILY_UR_{}'.format(station)
+
+
+def flag_label(station):
+    return 'FLAG_{}'.format(station)
+
+
+def date_label(station):
+    return 'DATE_{}'.format(station)
+
+
+def scatter(frames, first_day, n_days):
+    """
+    Place station frames (as built by get_station_data) on the calendar
+    first_day .. first_day + n_days - 1.
+    :param frames: dict of station number to dataframe, none of them None
+    :return: (ur, flags): (n_days x stations) float32 unit runoff, NaN
+        where there is no value, and uint8 flag codes
+    """
+    ur = np.full((n_days, len(frames)), np.nan, dtype=np.float32)
+    flags = np.zeros((n_days, len(frames)), dtype=np.uint8)
+    if not frames:
+        return ur, flags
+
+    rows = [to_days(df.index) - first_day for df in frames.values()]
+    cols = np.repeat(np.arange(len(frames)), [len(e) for e in rows])
+    rows = np.concatenate(rows)
+
+    ur_values, flag_values = [], []
+    for station, df in frames.items():
+        if ur_label(station) in df:
+            ur_values.append(df[ur_label(station)].values)
+        else:
+            ur_values.append(np.full(len(df), np.nan, dtype=np.float32))
+        flag_values.append(flag_codes(df[flag_label(station)]))
+
+    ur[rows, cols] = np.concatenate(ur_values)
+    flags[rows, cols] = np.concatenate(flag_values)
+    return ur, flags
+
+
+class MergedSeries:
+    """
+    Unit runoff and flags of several stations on a shared daily
+    calendar.  Stations can be added, growing the calendar if their
+    records fall outside it, and dropped, without re-merging the others.
+    """
+
+    def __init__(self, frames):
+        """
+        :param frames: dict of station number to dataframe; stations
+            without a record (None) are left out
+        """
+        frames = {k: v for (k, v) in frames.items() if v is not None}
+        if frames:
+            self.first_day = min(to_days(df.index[:1])[0]
+                                 for df in frames.values())
+            last_day = max(to_days(df.index[-1:])[0]
+                           for df in frames.values())
+            n_days = int(last_day - self.first_day) + 1
+        else:
+            self.first_day, n_days = 0, 0
+
+        self.stations = list(frames)
+        self.has_ur = np.array([ur_label(k) in v for (k, v) in frames.items()],
+                               dtype=bool)
+        self.ur, self.flags = scatter(frames, self.first_day, n_days)
+        self.dates_ms = (self.first_day + np.arange(n_days, dtype=np.int64)) * DAY_MS
+
+    def __len__(self):
+        return len(self.dates_ms)
+
+    def __contains__(self, station):
+        return station in self.stations
+
+    @property
+    def nbytes(self):
+        return self.ur.nbytes + self.flags.nbytes + self.dates_ms.nbytes
+
+    def covers(self, frames):
+        """
+        Whether the records of all the frames fall within the calendar.
+        """
+        last_day = self.first_day + len(self) - 1
+        return all(to_days(df.index[:1])[0] >= self.first_day and
+                   to_days(df.index[-1:])[0] <= last_day
+                   for df in frames.values() if df is not None)
+
+    def extend(self, frames):
+        """
+        Grow the calendar to cover the records of the frames as well.  The
+        stations' values are moved onto the new calendar as they are.
+        """
+        frames = [df for df in frames.values() if df is not None]
+        if not frames:
+            return
+        first_days = [to_days(df.index[:1])[0] for df in frames]
+        last_days = [to_days(df.index[-1:])[0] for df in frames]
+        if len(self):
+            first_days.append(self.first_day)
+            last_days.append(self.first_day + len(self) - 1)
+        first_day, last_day = min(first_days), max(last_days)
+        n_days = int(last_day - first_day) + 1
+        if (first_day, n_days) == (self.first_day, len(self)):
+            return
+        offset = int(self.first_day - first_day)
+        ur = np.full((n_days, len(self.stations)), np.nan, dtype=np.float32)
+        flags = np.zeros((n_days, len(self.stations)), dtype=np.uint8)
+        ur[offset:offset + len(self)] = self.ur
+        flags[offset:offset + len(self)] = self.flags
+        self.first_day, self.ur, self.flags = first_day, ur, flags
+        self.dates_ms = (first_day + np.arange(n_days, dtype=np.int64)) * DAY_MS
+
+    def add(self, frames):
+        """
+        Add stations, first growing the calendar if it doesn't cover
+        their records.
+        """
+        frames = {k: v for (k, v) in frames.items()
+                  if v is not None and k not in self.stations}
+        self.extend(frames)
+        ur, flags = scatter(frames, self.first_day, len(self))
+        self.stations += list(frames)
+        self.has_ur = np.concatenate([
+            self.has_ur,
+            np.array([ur_label(k) in v for (k, v) in frames.items()], dtype=bool)])
+        self.ur = np.hstack([self.ur, ur])
+        self.flags = np.hstack([self.flags, flags])
+
+    def drop(self, stations):
+        keep = [i for (i, e) in enumerate(self.stations) if e not in stations]
+        self.stations = [self.stations[i] for i in keep]
+        self.has_ur = self.has_ur[keep]
+        self.ur = self.ur[:, keep]
+        self.flags = self.flags[:, keep]
+
+    def columns(self, stations=None, rows=None):
+        """
+        The hydrograph source columns of the given stations (default: all)
+        :param rows: optional (len(rows) x stations) array of the calendar
+            rows to take each station's values from, e.g. from
+            downsample.view_rows
+        :return: dict of DAILY_UR_* (stations with a drainage area only)
+            and FLAG_* columns, and with rows the DATE_* columns of the
+            times each station's values are at [float ms]
+        """
+        stations = self.stations if stations is None else stations
+        out = {}
+        for j, station in enumerate(stations):
+            i = self.stations.index(station)
+            if rows is None:
+                ur = np.ascontiguousarray(self.ur[:, i])
+                flags = np.ascontiguousarray(self.flags[:, i])
+            else:
+                ur, flags = self.ur[rows[:, j], i], self.flags[rows[:, j], i]
+                out[date_label(station)] = self.dates_ms[rows[:, j]].astype(
+                    np.float64)
+            if self.has_ur[i]:
+                out[ur_label(station)] = ur
+            out[flag_label(station)] = flags
+        return out
+
+    def ur_block(self, stations):
+        """
+        (days x stations) unit runoff of the given stations
+        """
+        return self.ur[:, [self.stations.index(e) for e in stations]]
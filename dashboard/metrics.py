@@ -0,0 +1,285 @@
+"""
+Latency histograms of the dashboard's hot path, in the Prometheus text
+format (served at /metrics by serve.py, see health.py).
+
+The stages are timed where they run, labelled by the number of stations
+involved:
+
+    station_search  spatial index query of a station search
+    store_fetch     reading series from the daily flow store
+    sqlite_fetch    DLY_FLOWS query and fetch
+    reshape         wide DLY_FLOWS rows to one value per day
+    merge           aligning the selected series on one calendar
+    source_build    building the hydrograph's ColumnDataSource columns
+    document_push   assigning them to the source, which serializes the
+                    patch sent to the browser
+
+A scrape reaches just one of the pod's bokeh processes, and never the
+query processes, so every process dumps its histograms and stats to
+SHARED_DIR/metrics every few seconds and /metrics adds the histograms of
+all of them up.  Without SHARED_DIR only the answering process is seen.
+"""
+import atexit
+import bisect
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from config import SHARED_DIR
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+METRICS_DIR = os.path.join(SHARED_DIR, 'metrics') if SHARED_DIR else None
+
+# seconds between dumps of a process' metrics to METRICS_DIR
+DUMP_INTERVAL = 5
+
+
+class Histogram:
+    """
+    Thread-safe histogram with one series per tuple of label values.
+    """
+
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.reset()
+
+    def reset(self):
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.get(
+                label_values, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[i] += 1
+            self._series[label_values] = (counts, total + value)
+
+    def snapshot(self):
+        """
+        :return: list of [label values, bucket counts, sum], JSON-able
+        """
+        with self._lock:
+            return [[list(k), list(counts), total]
+                    for k, (counts, total) in self._series.items()]
+
+
+def stations_label(n):
+    # hydrographs have at most 10 stations, a search can find hundreds
+    return str(n) if n <= 10 else '11+'
+
+
+STAGE_SECONDS = Histogram('wsc_stage_seconds',
+                          'Latency of the dashboard hot path stages',
+                          ('stage', 'stations'))
+
+
+def observe(stage, n_stations, seconds):
+    DUMPER.start()
+    STAGE_SECONDS.observe((stage, stations_label(n_stations)), seconds)
+
+
+@contextmanager
+def timed(stage, n_stations):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, n_stations, time.perf_counter() - t0)
+
+
+def process_stats():
+    """
+    The counters and gauges the process already keeps, as a flat dict of
+    (group, stat) to number.  Modules are looked up rather than imported,
+    so only what the process has loaded is reported.
+    """
+    sources = []
+    workers = sys.modules.get('workers')
+    if workers is not None:
+        sources.append(('executor', workers.EXECUTOR_STATS.stats))
+    utils = sys.modules.get('utils')
+    if utils is not None:
+        sources += [('query_flights', utils.query_flights.stats),
+                    ('cache', utils.results_cache.stats),
+                    ('memcached', utils.memcached_discovery.stats)]
+    get_station_data = sys.modules.get('get_station_data')
+    if get_station_data is not None:
+        sources.append(('hydat_pool', get_station_data.HYDAT_POOL.stats))
+    wsc_module = sys.modules.get('modules.wscModule')
+    if wsc_module is not None:
+        sources.append(('sessions', wsc_module.session_memory))
+
+    stats = {}
+    for group, get_stats in sources:
+        try:
+            values = get_stats()
+        except Exception as e:
+            # e.g. a session opening while iterating over them
+            logging.debug('Could not collect {} stats: {!r}'.format(group, e))
+            continue
+        for k, v in values.items():
+            if isinstance(v, (int, float)) and k != 'pid':
+                stats['{}\t{}'.format(group, k)] = v
+    return stats
+
+
+def snapshot():
+    return {'pid': os.getpid(),
+            'histogram': STAGE_SECONDS.snapshot(),
+            'stats': process_stats()}
+
+
+class MetricsDumper:
+    """
+    Writes the process' snapshot to METRICS_DIR every DUMP_INTERVAL from
+    a background thread, started on first use in each process.  A
+    process forked from one that was already recording (a query process)
+    starts its histogram afresh, the parent's counts being its own.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        if self.path is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                STAGE_SECONDS.reset()
+            self._pid = os.getpid()
+            os.makedirs(self.path, exist_ok=True)
+            thread = threading.Thread(target=self._run, name='metrics-dump')
+            thread.daemon = True
+            thread.start()
+            # a process shutting down takes its dump with it
+            atexit.register(self.remove)
+
+    def _run(self):
+        while self._pid == os.getpid():
+            try:
+                self.dump()
+            except Exception as e:
+                logging.warning('Metrics dump failed: {}'.format(e))
+            time.sleep(DUMP_INTERVAL)
+
+    def dump(self):
+        fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot(), f)
+        os.rename(tmp, self._dump_path())
+        if self._pid != os.getpid():
+            # removed while this dump was being written
+            self._remove_dump()
+
+    def remove(self):
+        """
+        Stop dumping and remove this process' dump.
+        """
+        self._pid = None
+        self._remove_dump()
+
+    def _remove_dump(self):
+        try:
+            os.remove(self._dump_path())
+        except OSError:
+            pass
+
+    def _dump_path(self):
+        return os.path.join(self.path, '{}.json'.format(os.getpid()))
+
+
+DUMPER = MetricsDumper(METRICS_DIR)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """
+    Snapshots of this process and of the others' last dumps.  The dumps
+    of processes that have exited without removing them are removed.
+    """
+    own = snapshot()
+    snapshots = [own]
+    if METRICS_DIR is not None and os.path.isdir(METRICS_DIR):
+        for name in os.listdir(METRICS_DIR):
+            if name.startswith('.tmp-') or name == '{}.json'.format(own['pid']):
+                continue
+            path = os.path.join(METRICS_DIR, name)
+            try:
+                with open(path) as f:
+                    other = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not pid_alive(other['pid']):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            snapshots.append(other)
+    return snapshots
+
+
+def format_labels(names, values):
+    return ','.join('{}="{}"'.format(k, v) for k, v in zip(names, values))
+
+
+def render(snapshots):
+    """
+    Prometheus text exposition of snapshots: the stage histograms summed
+    over processes and the stats of each process, labelled by pid.
+    """
+    h = STAGE_SECONDS
+    series = {}
+    for snap in snapshots:
+        for label_values, counts, total in snap['histogram']:
+            key = tuple(label_values)
+            old_counts, old_total = series.get(key, ([0] * len(counts), 0.0))
+            series[key] = ([a + b for a, b in zip(old_counts, counts)],
+                           old_total + total)
+
+    lines = ['# HELP {} {}'.format(h.name, h.help),
+             '# TYPE {} histogram'.format(h.name)]
+    for key in sorted(series):
+        counts, total = series[key]
+        labels = format_labels(h.labels, key)
+        cumulative = 0
+        for bound, count in zip(list(h.buckets) + ['+Inf'], counts):
+            cumulative += count
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                h.name, labels, bound, cumulative))
+        lines.append('{}_sum{{{}}} {}'.format(h.name, labels, total))
+        lines.append('{}_count{{{}}} {}'.format(h.name, labels, cumulative))
+
+    lines += ['# HELP wsc_stats Counters and gauges kept by each process',
+              '# TYPE wsc_stats untyped']
+    for snap in snapshots:
+        for key, value in sorted(snap['stats'].items()):
+            group, stat = key.split('\t')
+            lines.append('wsc_stats{{{}}} {}'.format(
+                format_labels(('group', 'stat', 'pid'),
+                              (group, stat, snap['pid'])), value))
+    return '\n'.join(lines) + '\n'
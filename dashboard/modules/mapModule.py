@@ -33,7 +33,7 @@ import os
 import json
 import logging
 import pandas as pd
-from stations import IDS_TO_NAMES, IDS_AND_COORDS, STATIONS_DF
+from stations import IDS_TO_NAMES, IDS_AND_COORDS
 from utils import convert_coords
 from get_station_data import get_stations_by_distance
 
@@ -59,7 +59,8 @@ class Module(BaseModule):
         self.lng_input = TextInput(title="Longitude (dec. degrees)",
                                    value='')
 
-        # Callbacks
+        # Callbacks; the station search they lead to is debounced by the
+        # dashboard's station_search
         self.lat_input.on_change('value', self.update_lat)
         self.lng_input.on_change('value', self.update_lng)
 
@@ -101,12 +102,20 @@ class Module(BaseModule):
         # Based on the current map location (red dot)
         # find all WSC stations within the specified
         # search distance (dropdown)
+        self.update_found_wsc_stations(
+            self.search_wsc_stations(*self.search_parameters()))
+
+    def search_parameters(self):
+        """
+        (lat, lng, search distance) of the station search, read from the
+        document so the search itself can run off the document's thread.
+        """
         lat = self.current_location_source.data['lat'][0]
         lng = self.current_location_source.data['lng'][0]
-        stations_df = get_stations_by_distance(
-            lat, lng, float(self.search_distance_select.value))
+        return lat, lng, float(self.search_distance_select.value)
 
-        self.update_found_wsc_stations(stations_df)
+    def search_wsc_stations(self, lat, lng, radius):
+        return get_stations_by_distance(lat, lng, radius)
 
         # [START make_plot]
 
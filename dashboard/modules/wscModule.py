@@ -9,10 +9,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from bokeh.models import ColumnDataSource, HoverTool, Paragraph
+from bokeh.models import (ColumnDataSource, HoverTool, Legend, LegendItem,
+                          Paragraph)
 from bokeh.plotting import figure
 from bokeh.palettes import all_palettes
 from bokeh.layouts import column
+from bokeh.io import curdoc
 from bokeh.models.widgets import (Div,
                                   PreText,
                                   TextInput,
@@ -23,13 +25,53 @@ from bokeh.models.widgets import (Div,
 
 from modules.base import BaseModule
 
-from utils import run_query
+from cache import frame_nbytes
+from config import HYDROGRAPH_LOD
+from debounce import Debounced
+from downsample import payload_nbytes, view_rows
+from metrics import timed
+from utils import run_query, run_query_many
 from stations import IDS_TO_NAMES
+import logging
+import time
+import weakref
+import numpy as np
 import pandas as pd
 from get_station_data import get_stations_by_distance
+from merge import MergedSeries, date_label, ur_label
 
 TITLE = 'Unit Area Daily Hydrograph'
 TOOLS = "pan,wheel_zoom,box_select,lasso_select,reset,box_zoom"
+PALETTE = all_palettes['Spectral'][11]
+DATE_TOOLTIP = ("Date", "@DATE{%F}")
+# with HYDROGRAPH_LOD each line has its own dates, so a row of the source
+# only holds the hovered line's point
+LOD_TOOLTIPS = [("Date", "$data_x{%F}"),
+                ("Unit runoff", "$data_y{0.00} [L/s/km²]")]
+# v2: float32 unit runoff and categorical flags
+HYDROGRAPH_CACHE_KEY = 'hydrograph-v2-%s'
+
+# hydrograph modules of this process' open sessions
+SESSIONS = weakref.WeakSet()
+
+
+def session_memory():
+    """
+    Memory held by the hydrographs of the open sessions in this process
+    [bytes].  The merged frames and source columns belong to each
+    session; the station series are shared with the query cache and
+    counted once.
+    """
+    modules = list(SESSIONS)
+    per_session = [m.memory_usage() for m in modules]
+    series = {}
+    for m in modules:
+        series.update((id(e), e) for e in m.series.values() if e is not None)
+    total = sum(e['data'] + e['source'] for e in per_session)
+    return {'sessions': len(modules),
+            'session_bytes': total,
+            'bytes_per_session': total // len(modules) if modules else 0,
+            'series_bytes': sum(frame_nbytes(e) for e in series.values())}
 
 
 class Module(BaseModule):
@@ -39,55 +81,238 @@ class Module(BaseModule):
         self.source = ColumnDataSource(data={})
         self.found_wsc_stations_source = ColumnDataSource(data=dict())
         self.plot = None
+        self.legend = None
+        self.hover_tool = None
         self.title = Div(text='')
+        # plotted stations, in selection order: station number to its
+        # dataframe (None if it has no record) and to its line renderer
+        self.series = {}
+        self.renderers = {}
+        # the merged full-resolution hydrograph (a MergedSeries) the
+        # source is a view of, and the visible x range [ms] it was last
+        # sent for
+        self.data = None
+        self.view = (None, None)
+        self.payload_stats = {'updates': 0, 'points': 0, 'bytes': 0,
+                              'build_time': 0}
+        SESSIONS.add(self)
 
     def fetch_wsc_data(self, station):
         return run_query(
             station,
-            cache_key=('hydrograph-%s' % station)
+            cache_key=(HYDROGRAPH_CACHE_KEY % station)
         )
 
-# [START make_plot]
-    def make_plot_and_table(self, dataframe):
-        palette = all_palettes['Spectral'][11]
+    def fetch_wsc_data_many(self, stations):
+        return run_query_many(
+            stations,
+            cache_keys=[HYDROGRAPH_CACHE_KEY % station for station in stations]
+        )
 
+# [START make_plot]
+    def make_plot_and_table(self, stations, data_dict):
+        """
+        Build the hydrograph once; later selections go through update_plot.
+        :param stations: selected station numbers
+        :param data_dict: dict of station number to dataframe
+        """
         self.plot = figure(name='hydrograph',
                            plot_width=1200, plot_height=300, tools=TOOLS,
                            toolbar_location='right', x_axis_type="datetime",
                            title='Figure 2: Hydrograph of Daily Unit Runoff [L/s/km²]')
 
-        UR_headings = [e for e in dataframe.columns.values if 'DAILY_UR' in e]
+        self.legend = Legend(items=[], click_policy='hide')
+        self.plot.add_layout(self.legend)
 
-        dataframe['tooltip_date'] = [x.strftime(
-            "%Y-%m-%d") for x in dataframe.index]
+        self.hover_tool = HoverTool(
+            tooltips=LOD_TOOLTIPS if HYDROGRAPH_LOD else [DATE_TOOLTIP],
+            formatters={'DATE': 'datetime', '$data_x': 'datetime'})
+        self.plot.add_tools(self.hover_tool)
 
-        dataframe.reset_index(inplace=True)
+        # a pan or zoom moves start and end together, and a drag moves
+        # them many times: one view update once the range settles
+        self.range_changed = Debounced(curdoc(), self.update_view)
+        self.plot.x_range.on_change('start', self.range_changed)
+        self.plot.x_range.on_change('end', self.range_changed)
 
-        self.source.data = self.source.from_df(dataframe)
+        self.update_plot(stations, data_dict)
 
-        tooltips = [("Date", "@tooltip_date")]
+        return column(self.title, self.plot)
 
-        for i, label in enumerate(UR_headings):
+# [END make_plot]
+    def new_stations(self, stations):
+        """
+        Stations in the selection that aren't plotted yet, i.e. the
+        only ones update_plot needs data for.
+        """
+        return [e for e in stations if e not in self.series]
 
-            tooltips.append(
-                ("{}".format(label), "@{} [L/s/km²]".format(label, label)))
+    def update_plot(self, stations, data_dict):
+        """
+        Diff the new selection against the plotted one: lines of
+        deselected stations are dropped and only the new stations' columns
+        are sent to the browser.
+        :param stations: selected station numbers
+        :param data_dict: dataframes of (at least) the new stations
+        """
+        self.drop_stations(stations)
+        self.add_stations(self.new_stations(stations), data_dict)
 
-            self.plot.line(
-                x='DATE', y=label, source=self.source, line_width=2,
-                line_alpha=0.6, line_color=palette[i], legend="{}".format(IDS_TO_NAMES[label[9:]]))
+    def drop_stations(self, stations):
+        """
+        Remove the lines of the stations no longer in the selection.
+        """
+        for station in [e for e in self.series if e not in stations]:
+            del self.series[station]
+            self.remove_line(station)
+            if self.data is not None:
+                self.data.drop([station])
 
-        hover_tool = HoverTool(tooltips=tooltips)
-        self.plot.add_tools(hover_tool)
-        self.plot.legend.click_policy = "hide"
+    def add_stations(self, added, data_dict):
+        """
+        Plot newly selected stations, e.g. one at a time as their queries
+        complete.
+        """
+        for station in added:
+            self.series[station] = data_dict.get(station)
 
-        return column(self.title, self.plot)
+        self.update_source(added)
+
+        for station in added:
+            self.add_line(station)
+        if not HYDROGRAPH_LOD:
+            self.hover_tool.tooltips = [DATE_TOOLTIP] + [
+                (label, "@{} [L/s/km²]".format(label))
+                for label in (ur_label(e) for e in self.renderers)]
+
+    def update_source(self, added):
+        new_data = {e: self.series[e] for e in added
+                    if self.series[e] is not None}
+        if not new_data:
+            return
+        t0 = time.time()
+
+        # the new series are merged into the plotted ones, and if they fall
+        # within the calendar already plotted only their columns are
+        # patched in; columns of deselected stations are left in the source
+        # until the next full update
+        if self.data is None or not self.data.stations:
+            with timed('merge', len(self.series)):
+                self.data = self.get_all_data(self.series)
+            data = self.view_data(self.data.stations, dates=True)
+            with timed('document_push', len(self.data.stations)):
+                self.source.data = data
+        elif self.data.covers(new_data):
+            with timed('merge', len(new_data)):
+                self.data.add(new_data)
+            data = self.view_data(list(new_data))
+            with timed('document_push', len(new_data)):
+                self.source.data.update(data)
+        else:
+            # the calendar grows, which moves every line's rows
+            with timed('merge', len(new_data)):
+                self.data.add(new_data)
+            data = self.view_data(self.data.stations, dates=True)
+            with timed('document_push', len(self.data.stations)):
+                self.source.data = data
+        self.record_payload(data, time.time() - t0)
+
+    def update_view(self, attrname, old, new):
+        """
+        Re-send the hydrograph refined to the visible x range, through
+        range_changed once it stops changing.
+        """
+        start, end = self.plot.x_range.start, self.plot.x_range.end
+        if not HYDROGRAPH_LOD or self.data is None or start is None or end is None:
+            return
+        if (start, end) == self.view:
+            return
+        t0 = time.time()
+        self.view = (start, end)
+        data = self.view_data(self.data.stations, dates=True)
+        with timed('document_push', len(self.data.stations)):
+            self.source.data = data
+        self.record_payload(data, time.time() - t0)
+
+    def view_data(self, stations, dates=False):
+        """
+        Source columns of the given stations for the current view: every
+        day, or with HYDROGRAPH_LOD the min/max of each station per pixel
+        over the visible window and a coarse overview elsewhere, each with
+        its own DATE_* column.
+        """
+        with timed('source_build', len(stations)):
+            return self._view_data(stations, dates)
+
+    def _view_data(self, stations, dates):
+        dates_ms = self.data.dates_ms
+        if HYDROGRAPH_LOD:
+            rows = view_rows(dates_ms, self.data.ur_block(stations),
+                             self.plot.plot_width, *self.view)
+            return self.data.columns(stations, rows)
+
+        data = self.data.columns(stations)
+        # dates go as float ms since the epoch, which bokeh sends in binary
+        # (int64 would be sent as a JSON list)
+        if dates:
+            data['DATE'] = dates_ms.astype(np.float64)
+        return data
+
+    def record_payload(self, data, build_time):
+        """
+        Keep track of how much data goes to the browser.
+        """
+        nbytes = payload_nbytes(data)
+        points = max(len(v) for v in data.values()) if data else 0
+
+        self.payload_stats['updates'] += 1
+        self.payload_stats['points'] = points
+        self.payload_stats['bytes'] = nbytes
+        self.payload_stats['build_time'] = build_time
+        logging.debug('hydrograph update: {} columns x {} points, {} bytes, '
+                      'built in {}s'.format(len(data), points, nbytes,
+                                            round(build_time, 3)))
+
+    def memory_usage(self):
+        """
+        Bytes held by this session's hydrograph: the merged frame, the
+        source columns and the station series it was merged from.
+        """
+        return {'data': self.data.nbytes if self.data is not None else 0,
+                'source': sum(np.asarray(e).nbytes
+                              for e in self.source.data.values()),
+                'series': sum(frame_nbytes(e) for e in self.series.values())}
+
+    def add_line(self, station):
+        label = ur_label(station)
+        if label not in self.source.data:
+            # no record, or no drainage area to compute unit runoff with
+            return
+        used = [r.glyph.line_color for r in self.renderers.values()]
+        color = [e for e in PALETTE if e not in used][0]
+
+        renderer = self.plot.line(
+            x=date_label(station) if HYDROGRAPH_LOD else 'DATE', y=label,
+            source=self.source, line_width=2,
+            line_alpha=0.6, line_color=color)
+        self.renderers[station] = renderer
+        self.legend.items.append(
+            LegendItem(label=IDS_TO_NAMES[station], renderers=[renderer]))
+
+    def remove_line(self, station):
+        renderer = self.renderers.pop(station, None)
+        if renderer is None:
+            return
+        self.plot.renderers = [
+            r for r in self.plot.renderers if r is not renderer]
+        self.legend.items = [
+            e for e in self.legend.items if renderer not in e.renderers]
 
-# [END make_plot]
     def get_all_data(self, data_dict):
-        return pd.concat([data_dict[e] for e in data_dict], axis=1, join='outer')
+        return MergedSeries(data_dict)
 
-    def busy(self):
-        self.title.text = '<p style="color:red;">Updating...</p>'
+    def busy(self, text='Updating...'):
+        self.title.text = '<p style="color:red;">{}</p>'.format(text)
         self.plot.background_fill_color = "#efefef"
 
     def unbusy(self, timer_text):
@@ -0,0 +1,270 @@
+"""
+Opt-in CPU and memory profiling of the dashboard callbacks.
+
+With WSC_PROFILE_RATE > 0, that fraction of the calls of the wrapped
+callbacks and worker thread jobs (see dashboard.py) is profiled; with
+WSC_PROFILE_QUERY=1, a session opened with ?profile=1 in its URL has
+every call profiled.  A profiled call runs under a sampling profiler,
+which records the calling thread's stack every few milliseconds from a
+background thread, and between two tracemalloc snapshots.  Each profile
+is written to WSC_PROFILE_DIR/<session id>/<stage>/<time>.json.
+
+tracemalloc traces the whole process, and only while profiled calls are
+running: the allocations of a profile include those of any other thread
+or session at the same time, and every thread pays for the tracing
+meanwhile.
+
+Calls that aren't profiled only pay for a random number; with profiling
+off the callbacks aren't wrapped at all.
+
+    python dashboard/profiling.py report [--dir DIR] [--stage STAGE]
+        [--session ID] [--top 20]
+
+aggregates the profiles into the hot functions (by own and by total
+samples) and the lines allocating the most memory.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from functools import wraps
+
+from config import PROFILE_DIR, PROFILE_QUERY, PROFILE_RATE
+
+# seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+# allocation sites kept per profile
+TOP_ALLOCATIONS = 50
+
+# profiled calls in progress, and whether the first of them started
+# tracemalloc (rather than e.g. PYTHONTRACEMALLOC)
+_tracing_calls = 0
+_tracing_started = False
+_tracing_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """
+    Counts the stacks of one thread, sampled every `interval` seconds
+    from a background thread, as ('function (file:line)', ...) tuples
+    from the outermost frame in.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(
+                    code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def folded(self):
+        """
+        The stacks in the folded format of flamegraph.pl.
+        """
+        return {';'.join(stack): count for stack, count in self.stacks.items()}
+
+
+def allocation_diff(before, after):
+    """
+    Allocation sites whose traced memory grew the most between two
+    tracemalloc snapshots.
+    """
+    stats = after.compare_to(before, 'lineno')
+    return [{'where': '{}:{}'.format(s.traceback[0].filename,
+                                     s.traceback[0].lineno),
+             'size_diff': s.size_diff,
+             'count_diff': s.count_diff}
+            for s in stats[:TOP_ALLOCATIONS] if s.size_diff > 0]
+
+
+def start_tracing():
+    global _tracing_calls, _tracing_started
+    with _tracing_lock:
+        if _tracing_calls == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_started = True
+        _tracing_calls += 1
+
+
+def stop_tracing():
+    """
+    Stop tracemalloc after the last profiled call in progress, if it was
+    started for them.
+    """
+    global _tracing_calls, _tracing_started
+    with _tracing_lock:
+        _tracing_calls -= 1
+        if _tracing_calls == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+def write_profile(session_id, stage, profile):
+    path = os.path.join(PROFILE_DIR, session_id, stage)
+    os.makedirs(path, exist_ok=True)
+    filename = os.path.join(path, '{:.6f}.json'.format(time.time()))
+    with open(filename, 'w') as f:
+        json.dump(profile, f)
+
+
+def profile_call(session_id, stage, fn, *args, **kwargs):
+    """
+    Call fn under the sampling profiler and between two tracemalloc
+    snapshots, and write the profile.
+    """
+    start_tracing()
+    before = tracemalloc.take_snapshot()
+    profiler = SamplingProfiler(threading.get_ident())
+    profiler.start()
+    t0 = time.time()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        wall_time = time.time() - t0
+        profiler.stop()
+        after = tracemalloc.take_snapshot()
+        stop_tracing()
+        profile = {'session': session_id,
+                   'stage': stage,
+                   'start': t0,
+                   'wall_time': wall_time,
+                   'interval': profiler.interval,
+                   'stacks': profiler.folded(),
+                   'allocations': allocation_diff(before, after)}
+        try:
+            write_profile(session_id, stage, profile)
+        except OSError as e:
+            logging.warning('Could not write profile: {}'.format(e))
+
+
+def session_profile_rate(doc):
+    """
+    Fraction of the calls of the document's session to profile.
+    """
+    context = doc.session_context
+    if PROFILE_QUERY and context is not None and context.request is not None:
+        if context.request.arguments.get('profile') == [b'1']:
+            return 1.0
+    return PROFILE_RATE
+
+
+class Profiled:
+    """
+    Wraps the callbacks of one session for profiling at `rate`.
+    """
+
+    def __init__(self, doc, rate=None):
+        context = doc.session_context
+        self.session_id = context.id if context is not None else 'no-session'
+        self.rate = session_profile_rate(doc) if rate is None else rate
+
+    def __call__(self, stage):
+        """
+        Decorator returning fn, or a wrapper with the same signature (as
+        bokeh checks it) profiling a fraction of its calls as `stage`.
+        """
+        def decorator(fn):
+            if self.rate <= 0:
+                return fn
+
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if random.random() >= self.rate:
+                    return fn(*args, **kwargs)
+                return profile_call(self.session_id, stage, fn,
+                                    *args, **kwargs)
+            return wrapper
+        return decorator
+
+
+def load_profiles(path, stage=None, session=None):
+    for root, _, files in os.walk(path):
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(root, name)) as f:
+                profile = json.load(f)
+            if stage is not None and profile['stage'] != stage:
+                continue
+            if session is not None and profile['session'] != session:
+                continue
+            yield profile
+
+
+def report(profiles, top=20):
+    wall_times = defaultdict(list)
+    own = Counter()
+    total = Counter()
+    allocated = Counter()
+    samples = 0
+    for profile in profiles:
+        wall_times[profile['stage']].append(profile['wall_time'])
+        for folded, count in profile['stacks'].items():
+            stack = folded.split(';')
+            samples += count
+            own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        for allocation in profile['allocations']:
+            allocated[allocation['where']] += allocation['size_diff']
+
+    lines = ['{:<28} {:>8} {:>10} {:>10}'.format(
+        'stage', 'profiles', 'mean [s]', 'max [s]')]
+    for stage, times in sorted(wall_times.items()):
+        lines.append('{:<28} {:>8} {:>10.3f} {:>10.3f}'.format(
+            stage, len(times), sum(times) / len(times), max(times)))
+    for title, counter in [('own samples', own), ('total samples', total)]:
+        lines += ['', 'Top {} functions by {} ({} samples)'.format(
+            top, title, samples)]
+        for function, count in counter.most_common(top):
+            lines.append('{:>7.1%}  {}'.format(count / samples, function))
+    lines += ['', 'Top {} allocation sites [KiB]'.format(top)]
+    for where, size in allocated.most_common(top):
+        lines.append('{:>10.1f}  {}'.format(size / 2**10, where))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    report_parser = subparsers.add_parser(
+        'report', help='aggregate the profiles into a hot function report')
+    report_parser.add_argument('--dir', default=PROFILE_DIR)
+    report_parser.add_argument('--stage')
+    report_parser.add_argument('--session')
+    report_parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command != 'report':
+        parser.error('unknown command')
+    profiles = list(load_profiles(args.dir, args.stage, args.session))
+    if not profiles:
+        sys.exit('No profiles in {}'.format(args.dir))
+    print(report(profiles, args.top))
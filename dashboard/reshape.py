@@ -0,0 +1,104 @@
+"""
+Vectorized wide-to-long reshape of HYDAT DLY_FLOWS rows.
+
+Each DLY_FLOWS row holds one station-month with the daily values spread
+over FLOW1..FLOW31 and FLOW_SYMBOL1..FLOW_SYMBOL31.  Rather than melting
+the flow and flag columns separately, the two (rows x 31) blocks are
+masked and flattened together in one pass, and the dates are built
+arithmetically from the year and month.
+"""
+import numpy as np
+
+FLOW_COLUMNS = ['FLOW{}'.format(i) for i in range(1, 32)]
+FLAG_COLUMNS = ['FLOW_SYMBOL{}'.format(i) for i in range(1, 32)]
+
+# column order expected by rows_to_long
+DLY_FLOWS_COLUMNS = ['YEAR', 'MONTH', 'NO_DAYS'] + FLOW_COLUMNS + FLAG_COLUMNS
+
+DAY_OFFSETS = np.arange(31)
+
+# DAY_MASK[n] is True for the first n days of a month, so indexing it
+# with NO_DAYS gives the valid-day mask of every row at once
+DAY_MASK = DAY_OFFSETS[np.newaxis, :] < np.arange(32)[:, np.newaxis]
+
+# month lengths used where NO_DAYS is missing, indexed [is_leap, month]
+MONTH_LENGTHS = np.array([
+    [0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+    [0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+])
+
+
+def month_starts(years, months):
+    """
+    Return the first day of each (year, month) as datetime64[D].
+    """
+    n_months = (np.asarray(years, dtype=np.int64) - 1970) * 12 + \
+        np.asarray(months, dtype=np.int64) - 1
+    return n_months.astype('datetime64[M]').astype('datetime64[D]')
+
+
+def month_lengths(years, months, no_days=None):
+    """
+    Return the number of days in each month, taking NO_DAYS from the
+    database where it is present.
+    """
+    years = np.asarray(years, dtype=np.int64)
+    is_leap = ((years % 4 == 0) & (years % 100 != 0)) | (years % 400 == 0)
+    lengths = MONTH_LENGTHS[is_leap.astype(int), np.asarray(months, dtype=int)]
+    if no_days is None:
+        return lengths
+    no_days = np.asarray(no_days, dtype=np.float64)
+    return np.where(np.isnan(no_days), lengths, no_days).astype(int)
+
+
+def wide_to_long(years, months, no_days, flows, flags):
+    """
+    Flatten (rows x 31) blocks of daily flows and flags into 1-D arrays,
+    dropping days past the end of the month and days without a flow.
+    :param years, months, no_days: 1-D arrays, one value per row
+    :param flows: (rows x 31) float array, NaN where there is no value
+    :param flags: (rows x 31) object array of FLOW_SYMBOL values
+    :return: (dates, flows, flags, counts) where dates is datetime64[D]
+             and counts is the number of daily values kept from each row
+    """
+    mask = DAY_MASK[month_lengths(years, months, no_days)] & ~np.isnan(flows)
+    dates = month_starts(years, months)[:, np.newaxis] + DAY_OFFSETS
+    return dates[mask], flows[mask], flags[mask], mask.sum(axis=1)
+
+
+def rows_to_long(rows):
+    """
+    Reshape rows fetched in DLY_FLOWS_COLUMNS order.  Rows are expected
+    in (YEAR, MONTH) order, and the daily values come back in date order.
+    """
+    if len(rows) == 0:
+        return (np.empty(0, dtype='datetime64[D]'), np.empty(0),
+                np.empty(0, dtype=object), np.empty(0, dtype=int))
+    return block_to_long(np.array(rows, dtype=object))
+
+
+def block_to_long(block):
+    """
+    Reshape a 2-D object array of rows in DLY_FLOWS_COLUMNS order.
+    """
+    return wide_to_long(block[:, 0].astype(np.int64),
+                        block[:, 1].astype(np.int64),
+                        block[:, 2].astype(np.float64),
+                        block[:, 3:34].astype(np.float64),
+                        block[:, 34:65])
+
+
+def split_runs(keys, counts):
+    """
+    Find the runs of equal keys in a sorted per-row key array and return
+    (key, start, end) slice bounds into the long arrays, where `counts`
+    is the number of daily values each row produced.
+    """
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return []
+    row_starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    value_offsets = np.r_[0, np.cumsum(counts)]
+    bounds = np.r_[value_offsets[row_starts], value_offsets[-1]]
+    return [(keys[row], bounds[i], bounds[i + 1])
+            for i, row in enumerate(row_starts)]
@@ -0,0 +1,58 @@
+"""
+Run the dashboard on a bokeh server with its lifecycle hooks.
+
+`bokeh serve` only loads server_lifecycle.py for directory apps, so this
+builds the server itself; it takes the same basic options:
+
+    python dashboard/serve.py [--port 5006] [--address 0.0.0.0]
+        [--num-procs 4] [--allow-websocket-origin HOST[:PORT] ...]
+
+The app is served at /dashboard, as with `bokeh serve dashboard/dashboard.py`,
+health checks at /healthz and /readyz and metrics at /metrics (see
+health.py).
+"""
+import argparse
+import logging
+import os
+
+from bokeh.application import Application
+from bokeh.application.handlers import ScriptHandler, ServerLifecycleHandler
+from bokeh.server.server import Server
+
+from health import EXTRA_PATTERNS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LifecycleHandler(ServerLifecycleHandler):
+    # server_lifecycle.py only defines the hooks, which run after the fork
+    safe_to_fork = True
+
+
+def make_application():
+    return Application(
+        ScriptHandler(filename=os.path.join(BASE_DIR, 'dashboard.py')),
+        LifecycleHandler(filename=os.path.join(BASE_DIR, 'server_lifecycle.py')))
+
+
+def make_server(port=5006, address=None, num_procs=1,
+                allow_websocket_origin=None):
+    return Server({'/dashboard': make_application()},
+                  port=port, address=address, num_procs=num_procs,
+                  allow_websocket_origin=allow_websocket_origin,
+                  redirect_root=False, extra_patterns=EXTRA_PATTERNS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=5006)
+    parser.add_argument('--address', default=None)
+    parser.add_argument('--num-procs', type=int, default=1)
+    parser.add_argument('--allow-websocket-origin', action='append')
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    server = make_server(args.port, args.address, args.num_procs,
+                         args.allow_websocket_origin)
+    server.run_until_shutdown()
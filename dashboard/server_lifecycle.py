@@ -0,0 +1,24 @@
+"""
+Bokeh server lifecycle hooks for the dashboard, loaded by serve.py.
+
+This module is loaded once, before the server forks its worker processes,
+so the app's modules are only imported from inside the hooks: importing
+them here would open the database and start threads in the parent.
+"""
+import logging
+
+
+def on_server_loaded(server_context):
+    # runs in every worker process, before it accepts connections
+    from get_station_data import start_query_pool
+    from landing import prewarm
+    try:
+        # before any other thread of this process is started
+        start_query_pool()
+    except Exception:
+        logging.exception('Could not start the query processes')
+    try:
+        prewarm()
+    except Exception:
+        # the first session will compute the landing view instead
+        logging.exception('Could not prewarm the landing view')
@@ -0,0 +1,54 @@
+"""
+Hand NumPy arrays between processes through shared memory.
+
+The arrays are written back to back into a file on a tmpfs (/dev/shm by
+default) and the receiving process memory maps that file, so nothing is
+pickled: only the file name and the layout of the arrays in it go over
+the process pool's pipe.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from config import SHM_DIR
+
+ALIGNMENT = 8
+
+
+def write_arrays(arrays, prefix='wsc-'):
+    """
+    Write arrays into a new shared memory file.
+    :return: (path, layout), layout being the (dtype, shape, offset) of
+        each array in the file
+    """
+    layout = []
+    offset = 0
+    for a in arrays:
+        layout.append((a.dtype.str, a.shape, offset))
+        offset += -(-a.nbytes // ALIGNMENT) * ALIGNMENT
+
+    fd, path = tempfile.mkstemp(prefix=prefix, dir=SHM_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        for a, (_, _, start) in zip(arrays, layout):
+            f.seek(start)
+            f.write(np.ascontiguousarray(a).tobytes())
+        f.truncate(offset)
+    return path, layout
+
+
+def read_arrays(path, layout, unlink=True):
+    """
+    Map a file written by write_arrays and return its arrays as read-only
+    views of the mapping.  With unlink, the file is removed straight away:
+    the memory lives on until the arrays are garbage collected.
+    """
+    try:
+        if os.path.getsize(path) == 0:
+            return [np.empty(shape, dtype=dtype) for (dtype, shape, _) in layout]
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+        return [np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+                for (dtype, shape, offset) in layout]
+    finally:
+        if unlink:
+            os.unlink(path)
@@ -0,0 +1,95 @@
+"""
+KD-tree index of the WSC station locations for radius and nearest
+neighbour searches around the target location.
+
+The index is built over the ECEF xyz coordinates of the stations on the
+reference ellipsoid, from stations.convert_coords, used as they are so
+that a catalog mapped from shared memory is not copied.  The station
+search has always measured the distance to the target as if the
+target were at the station's own elevation, which is the surface
+distance scaled by (R + elevation) / R; keeping that factor per station
+lets the tree return exactly the distances the search used to compute
+one station at a time.
+"""
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS = 6378137
+FLATTENING = 1 / 298.257223563
+
+
+def latlon_to_xyz(lat, lon, elevation=0):
+    """
+    Convert decimal degrees (scalars or arrays) to ECEF x, y, z [m].
+    """
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    r = EARTH_RADIUS + np.asarray(elevation, dtype=np.float64)
+    x = r * np.cos(lat) * np.cos(lon)
+    y = r * np.cos(lat) * np.sin(lon)
+    z = r * np.sin(lat) * (1 - FLATTENING)
+    return np.stack([x, y, z], axis=-1)
+
+
+class StationIndex:
+
+    def __init__(self, columns, xyz, elevation):
+        """
+        :param columns: station catalog as a dict of column name to
+            array (stations.catalog_columns), one row per point in xyz
+        :param xyz: (n x 3) array of station ECEF coordinates on the
+            ellipsoid [m]
+        :param elevation: station elevations [m], missing ones (NaN)
+            taken as sea level
+        """
+        self.columns = columns
+        elevation = np.asarray(elevation, dtype=np.float64)
+        elevation = np.where(np.isnan(elevation), 0, elevation)
+        self._scale = (EARTH_RADIUS + elevation) / EARTH_RADIUS
+        self._xyz = np.asarray(xyz)
+        # the tree keeps a reference to the array, not a copy
+        self._tree = cKDTree(self._xyz)
+        self._min_scale = min(self._scale.min(), 1.0)
+
+    def _distances_km(self, lat, lon, idx):
+        target = latlon_to_xyz(lat, lon)
+        d = np.sqrt(((self._xyz[idx] - target) ** 2).sum(axis=1))
+        return np.round(d * self._scale[idx] / 1000, 1)
+
+    def _result(self, idx, dist):
+        # stable sort so stations at equal distance keep catalog order
+        order = np.argsort(dist, kind='mergesort')
+        rows = idx[order]
+        data = {}
+        for col, values in self.columns.items():
+            values = values[rows]
+            if values.dtype.kind == 'U':
+                values = values.astype(object)
+                values[values == ''] = np.nan
+            data[col] = values
+        result = pd.DataFrame(data, index=rows, columns=list(self.columns))
+        result['distance_to_target'] = dist[order]
+        return result
+
+    def query_radius(self, lat, lon, radius):
+        """
+        Return a new dataframe of the stations within `radius` km of the
+        target, closest first, with a distance_to_target column [km].
+        """
+        # pad the search by the rounding of the reported distance
+        search = (radius + 0.05) * 1000 / self._min_scale
+        idx = np.array(sorted(self._tree.query_ball_point(
+            latlon_to_xyz(lat, lon), search)), dtype=int)
+        dist = self._distances_km(lat, lon, idx)
+        keep = dist <= radius
+        return self._result(idx[keep], dist[keep])
+
+    def query_nearest(self, lat, lon, k):
+        """
+        Return a new dataframe of the k stations closest to the target.
+        """
+        k = min(k, len(self._xyz))
+        _, idx = self._tree.query(latlon_to_xyz(lat, lon), k=k)
+        idx = np.atleast_1d(idx)
+        return self._result(idx, self._distances_km(lat, lon, idx))
@@ -8,11 +8,23 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import json
+import logging
 import os
+import shutil
+import tempfile
+import time
+from collections.abc import Mapping
 
 import pandas as pd
-import utm
 import numpy as np
+import utm
+
+from config import CATALOG_DIR, SHARED_DIR, STATIONS_CSV
+from spatial_index import latlon_to_xyz
+
+# bumped whenever the snapshot's layout changes, so older ones are ignored
+FORMAT_VERSION = 3
 
 
 def deg2rad(degree):
@@ -20,67 +32,251 @@ def deg2rad(degree):
     return(rad)
 
 
+def latlon_to_zone_number(lat, lon):
+    """
+    utm.latlon_to_zone_number over arrays, with the same exceptions for
+    southern Norway and Svalbard.
+    """
+    zones = ((lon + 180) // 6 + 1).astype(int)
+    zones[(56 <= lat) & (lat < 64) & (3 <= lon) & (lon < 12)] = 32
+    svalbard = (72 <= lat) & (lat <= 84) & (lon >= 0)
+    for zone, (west, east) in zip([31, 33, 35, 37],
+                                  [(0, 9), (9, 21), (21, 33), (33, 42)]):
+        zones[svalbard & (west <= lon) & (lon < east)] = zone
+    return zones
+
+
+def latlon_to_utm(lat, lon):
+    """
+    utm.from_latlon over arrays, returning (easting, northing) arrays.
+    from_latlon projects a whole array in the zone of its first point,
+    so it is called once per zone and hemisphere.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    zones = latlon_to_zone_number(lat, lon)
+    south = lat < 0
+    easting = np.empty_like(lat)
+    northing = np.empty_like(lat)
+    for zone, is_south in set(zip(zones.tolist(), south.tolist())):
+        rows = (zones == zone) & (south == is_south)
+        easting[rows], northing[rows], _, _ = utm.from_latlon(
+            lat[rows], lon[rows], force_zone_number=zone)
+    return easting, northing
+
+
 def convert_coords(data):
     """
     Takes in the dataframe of all WSC stations
-    and converts lat/lon/elevation to xyz for
-    more accurate distance measurements between 
-    stations.
+    and converts lat/lon to xyz on the ellipsoid
+    for more accurate distance measurements between
+    stations (StationIndex applies the elevations).
+    Returns the dataframe and the (n x 3) array of
+    xyz coordinates.
     """
-    data['Latitude'].dropna(inplace=True)
-    data['Longitude'].dropna(inplace=True)
-
     data['Latitude'] = data['Latitude'].astype(
         float)
     data['Longitude'] = data['Longitude'].astype(
         float)
 
-    data['dec_deg_latlon'] = data[[
-        'Latitude', 'Longitude']].values.tolist()
-
     # convert decimal degrees to utm and make new columns for UTM Northing and Easting
-    data['utm_latlon'] = [utm.from_latlon(
-        e[0], e[1]) for e in data['dec_deg_latlon']]
+    data['utm_E'], data['utm_N'] = latlon_to_utm(
+        data['Latitude'].values, data['Longitude'].values)
 
-    data['utm_E'] = [e[0] for e in data['utm_latlon']]
-    data['utm_N'] = [e[1] for e in data['utm_latlon']]
+    xyz = latlon_to_xyz(data['Latitude'].values, data['Longitude'].values)
 
-    xyz = pd.DataFrame()
-    xyz['r'] = 6378137 + data['Elevation']
+    return data, xyz
 
-    xyz['x'] = xyz['r'] * \
-        np.cos(data['Latitude'].apply(deg2rad)) * \
-        np.cos(data['Longitude'].apply(deg2rad))
-    xyz['y'] = xyz['r'] * \
-        np.cos(data['Latitude'].apply(deg2rad)) * \
-        np.sin(data['Longitude'].apply(deg2rad))
-    xyz['z'] = xyz['r'] * \
-        np.sin(data['Latitude'].apply(deg2rad)) * (1 - 1 / 298.257223563)
 
-    data['xyz_coords'] = xyz[['x', 'y', 'z']].values.tolist()
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, 'data/')
 
-    return data
 
+def read_stations_csv(filename=STATIONS_CSV):
+    stations_df = pd.read_csv(filename)
+    stations_df.dropna(axis=0, subset=['Gross Drainage Area (km2)'], inplace=True)
+    stations_df.reset_index(drop=True, inplace=True)
+    return convert_coords(stations_df)
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(BASE_DIR, 'data/')
 
-stations_df = pd.read_csv(DATA_DIR + 'WSC_Stations_Master.csv')
+def source_stat(filename):
+    """
+    :return: [size, mtime_ns] of the station CSV, which a snapshot
+        records to tell whether it was built from the current one
+    """
+    stat = os.stat(filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def catalog_columns(stations_df):
+    """
+    The catalog as a dict of column name to array: the numeric columns as
+    they are, the text columns as fixed-width unicode with '' for missing
+    values, so that every column can be saved and memory mapped as .npy.
+    """
+    columns = {}
+    for col in stations_df.columns:
+        values = stations_df[col]
+        if pd.api.types.is_numeric_dtype(values):
+            columns[col] = np.ascontiguousarray(values.values)
+        else:
+            columns[col] = np.array(values.fillna('').tolist(), dtype=str)
+    return columns
+
+
+def write_catalog_snapshot(path=CATALOG_DIR, filename=STATIONS_CSV):
+    """
+    Write the converted station catalog as a binary snapshot: one .npy
+    file per column (see catalog_columns) plus the xyz array, and the
+    column names in tables.json.
+    """
+    stations_df, xyz = read_stations_csv(filename)
+    os.makedirs(path, exist_ok=True)
+
+    columns = catalog_columns(stations_df)
+    source_size, source_mtime_ns = source_stat(filename)
+    tables = {'format_version': FORMAT_VERSION,
+              'source_size': source_size,
+              'source_mtime_ns': source_mtime_ns,
+              'columns': list(columns)}
+    for i, values in enumerate(columns.values()):
+        np.save(os.path.join(path, 'col{}.npy'.format(i)), values)
+    np.save(os.path.join(path, 'xyz.npy'), np.ascontiguousarray(xyz))
+
+    with open(os.path.join(path, 'tables.json'), 'w') as f:
+        json.dump(tables, f)
+    return len(stations_df)
+
+
+def load_catalog_snapshot(path=CATALOG_DIR, filename=STATIONS_CSV):
+    """
+    Load the snapshot with its arrays memory mapped.  Returns the dict of
+    column name to array and the xyz array, or None if there is no
+    snapshot or it was built from a different station CSV.
+    """
+    tables_file = os.path.join(path, 'tables.json')
+    if not os.path.exists(tables_file):
+        return None
+    with open(tables_file) as f:
+        tables = json.load(f)
+    if (tables.get('format_version') != FORMAT_VERSION or
+            [tables.get('source_size'), tables.get('source_mtime_ns')] !=
+            source_stat(filename)):
+        logging.warning('Station catalog snapshot is stale, rebuild it with '
+                        '`python dashboard/stations.py`')
+        return None
+
+    # plain ndarray views of the maps: indexing them gives ndarrays, and
+    # the columns are only ever read through them, never copied whole
+    columns = {col: np.load(os.path.join(path, 'col{}.npy'.format(i)),
+                            mmap_mode='r').view(np.ndarray)
+               for i, col in enumerate(tables['columns'])}
+    xyz = np.load(os.path.join(path, 'xyz.npy'), mmap_mode='r')
+    return columns, xyz
+
+
+def publish_catalog_snapshot(path, filename=STATIONS_CSV):
+    """
+    Put a snapshot at `path` in shared memory for the other processes to
+    map: a copy of the one on disk if it's up to date, else a new one.
+    The snapshot is assembled in a temporary directory and renamed into
+    place, so when several processes start together the first one wins
+    and the others discard theirs.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+    try:
+        if load_catalog_snapshot(CATALOG_DIR, filename) is not None:
+            for name in os.listdir(CATALOG_DIR):
+                shutil.copy(os.path.join(CATALOG_DIR, name), tmp)
+        else:
+            write_catalog_snapshot(tmp, filename)
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+
+
+def load_shared_catalog(filename=STATIONS_CSV):
+    """
+    Map the catalog snapshot in SHARED_DIR, publishing it first if this
+    is the first process of the pod to get here.  The directory is named
+    after the snapshot format and the station CSV's size and modification
+    time, so it can never be stale.
+    """
+    path = os.path.join(SHARED_DIR, 'catalog-v{}-{}-{}'.format(
+        FORMAT_VERSION, *source_stat(filename)))
+    catalog = load_catalog_snapshot(path, filename)
+    if catalog is None:
+        try:
+            publish_catalog_snapshot(path, filename)
+        except OSError as e:
+            logging.warning('Could not share the station catalog: {}'.format(e))
+            return None
+        catalog = load_catalog_snapshot(path, filename)
+    return catalog
+
+
+def load_catalog():
+    catalog = load_shared_catalog() if SHARED_DIR else None
+    if catalog is None:
+        catalog = load_catalog_snapshot()
+    if catalog is None:
+        stations_df, xyz = read_stations_csv()
+        catalog = catalog_columns(stations_df), xyz
+    return catalog
+
+
+class StationLookup(Mapping):
+    """
+    Read-only mapping of the values of a catalog column to value(row).
+    Keys are found by binary search in the column itself, so a mapped
+    catalog is not copied into a dict in every process.
+    """
+
+    def __init__(self, keys, value):
+        self._keys = keys
+        self._order = np.argsort(keys, kind='mergesort')
+        self._value = value
+
+    def _row(self, key):
+        if not isinstance(key, str):
+            raise KeyError(key)
+        i = np.searchsorted(self._keys, key, sorter=self._order)
+        if i < len(self._order) and self._keys[self._order[i]] == key:
+            return self._order[i]
+        raise KeyError(key)
+
+    def __getitem__(self, key):
+        return self._value(self._row(key))
+
+    def __iter__(self):
+        return iter(self._keys.tolist())
+
+    def __len__(self):
+        return len(self._keys)
+
 
-stations_df.dropna(axis=0, subset=['Gross Drainage Area (km2)'], inplace=True)
+STATION_COLUMNS, STATION_XYZ = load_catalog()
 
-STATIONS_DF = convert_coords(stations_df)
+_numbers = STATION_COLUMNS['Station Number']
+_names = STATION_COLUMNS['Station Name']
+_areas = STATION_COLUMNS['Gross Drainage Area (km2)']
+_lats = STATION_COLUMNS['Latitude']
+_lons = STATION_COLUMNS['Longitude']
 
-STATIONS = [tuple(x)
-            for x in STATIONS_DF[['Station Number', 'Station Name']].values]
-COORDS = [tuple(x)
-          for x in STATIONS_DF[['Station Number', 'Latitude', 'Longitude']].values]
+IDS_TO_NAMES = StationLookup(
+    _numbers, lambda i: '{}: {}'.format(_numbers[i], _names[i]))
+NAMES_TO_IDS = StationLookup(_names, lambda i: str(_numbers[i]))
+IDS_AND_DAS = StationLookup(_numbers, lambda i: float(_areas[i]))
+IDS_AND_COORDS = StationLookup(
+    _numbers, lambda i: (float(_lats[i]), float(_lons[i])))
 
-# da_subset = stations_df[['Station Number', 'Gross Drainage Area (km2)']]
-DRAINAGE_AREAS = [tuple(x) for x in STATIONS_DF[[
-    'Station Number', 'Gross Drainage Area (km2)']].values]
 
-IDS_TO_NAMES = {k: '{}: {}'.format(k, v) for (k, v) in STATIONS}
-NAMES_TO_IDS = {v: k for (k, v) in STATIONS}
-IDS_AND_DAS = {k: v for (k, v) in DRAINAGE_AREAS}
-IDS_AND_COORDS = {k: (lat, lon) for (k, lat, lon) in COORDS}
+if __name__ == '__main__':
+    t0 = time.time()
+    n_stations = write_catalog_snapshot()
+    print('Wrote catalog snapshot of {} stations to {} in {}s'.format(
+        n_stations, CATALOG_DIR, round(time.time() - t0, 2)))
@@ -13,32 +13,95 @@
 import json
 import os
 import socket
-from datetime import datetime
+import threading
+import time
 import logging
+from functools import partial
 
 import pandas as pd
 from pymemcache.client.hash import HashClient
 from pyproj import Proj, transform
 
-from get_station_data import get_daily_UR, get_stations_by_distance
+from cache import MISSING, SharedCache, TieredCache
+from config import CACHE_MAX_BYTES, SHARED_CACHE_MAX_BYTES, SHARED_DIR
+from workers import SingleFlight
+from get_station_data import get_daily_UR, get_daily_UR_many, get_stations_by_distance
 
 
 class MemcachedDiscovery:
+    """
+    Keeps a HashClient pointed at the current set of Memcached pods.
+
+    DNS is polled from a background thread, so get_client never waits on
+    a lookup.  When pods appear or disappear a new HashClient is built for
+    the new membership and swapped in, so request threads only ever see
+    a complete client.  It reuses the pooled client of every node that
+    stayed, so their warm connections survive scaling events, and with
+    rendezvous hashing only the keys owned by the nodes that changed
+    move.  The replaced client is left to the threads still using it; the
+    connections to removed nodes close when it is collected.
+    """
 
     def __init__(self, host='memcached.default.svc.cluster.local', port=11211, resync_interval=10):
         self._client = None
-        self._t0 = None
-        self._ips = []
+        self._ips = set()
+        # ip: pooled client of that node, shared by the successive clients
+        self._node_clients = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
         self.resync_interval = resync_interval
         self.host = host
         self.port = port
+        self.resyncs = 0
+        self.membership_changes = 0
+        self.last_resync_latency = 0.0
+        self.max_resync_latency = 0.0
+
+    def start(self):
+        """
+        Start the refresher thread, once per process: threads don't
+        survive the fork of the bokeh worker processes.
+        """
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._refresh,
+                                            name='memcached-discovery')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _refresh(self):
+        while True:
+            try:
+                self._resync()
+            except Exception as e:
+                logging.warning('Memcached discovery failed: {}'.format(e))
+            time.sleep(self.resync_interval)
+
+    def _build_client(self, ips):
+        """
+        A HashClient over ips, with the pooled clients of the nodes already
+        known and new ones for the others.
+        """
+        client = HashClient([], use_pooling=True)
+        for ip in sorted(ips):
+            node_client = self._node_clients.get(ip)
+            if node_client is None:
+                client.add_server(ip, self.port)
+            else:
+                key = '{}:{}'.format(ip, self.port)
+                client.clients[key] = node_client
+                client.hasher.add_node(key)
+        return client
 
     def _resync(self):
         """
-        Check if the list of available nodes has changed. If any change is
-        detected, a new HashClient pointing to all currently available
-        nodes is returned, otherwise the current client is returned.
+        Check if the list of available nodes has changed and, if so, swap
+        in a client for the new list.
         """
+        t0 = time.time()
         # Collect the all Memcached pods' IP addresses
         try:
             _, _, ips = socket.gethostbyname_ex(self.host)
@@ -46,47 +109,92 @@ class MemcachedDiscovery:
             # The host could not be found. This mean that either the service is
             # down or that no pods are running
             ips = []
-        if set(ips) != set(self._ips):
-            # A different list of ips has been detected, so we generate
-            # a new client
+        latency = time.time() - t0
+
+        ips = set(ips)
+        with self._lock:
+            self.resyncs += 1
+            self.last_resync_latency = latency
+            self.max_resync_latency = max(self.max_resync_latency, latency)
+
+            added = ips - self._ips
+            removed = self._ips - ips
+            if not added and not removed:
+                return
+            self.membership_changes += len(added) + len(removed)
             self._ips = ips
-            if self._ips:
-                servers = [(ip, self.port) for ip in self._ips]
-                self._client = HashClient(servers, use_pooling=True)
-            else:
+
+            if not ips:
                 self._client = None
+                self._node_clients = {}
+                return
+            client = self._build_client(ips)
+            self._node_clients = {
+                ip: client.clients['{}:{}'.format(ip, self.port)]
+                for ip in ips}
+            self._client = client
 
     def get_client(self):
-        # Check if we are due for a resync of Memcached nodes
-        now = datetime.now()
-        due_for_resync = self._t0 is None or (
-            now - self._t0).total_seconds() > self.resync_interval
-        if due_for_resync:
-            # Request a resync
-            self._resync()
-            # Reset the timer until the next resync
-            self._t0 = now
+        # the lock is only taken to start the thread, once per process
+        if self._pid != os.getpid():
+            self.start()
         return self._client
 
+    def stats(self):
+        with self._lock:
+            return {'nodes': len(self._ips),
+                    'resyncs': self.resyncs,
+                    'membership_changes': self.membership_changes,
+                    'last_resync_latency': self.last_resync_latency,
+                    'max_resync_latency': self.max_resync_latency}
+
 
 def _run(query):
     return get_daily_UR(query)
 
 
+def _run_and_cache(query, cache_key, expire):
+    df = _run(query)
+    results_cache.set(cache_key, df, expire=expire)
+    return df
+
+
+def _run_many_and_cache(queries_by_key, expire, cache_keys):
+    fetched = get_daily_UR_many([queries_by_key[key] for key in cache_keys])
+    values = {key: fetched[queries_by_key[key]] for key in cache_keys}
+    results_cache.set_many(values, expire=expire)
+    return values
+
+
 def run_query(query, cache_key, expire=3600, dialect='legacy'):
-    return _run(query)
-    # memcached_client = memcached_discovery.get_client()
-    # if memcached_client is None:
-    #    return _run(query)
-    # else:
-    #    json = memcached_client.get(cache_key)
-    #    logging.warning('what is memcached_client cache key json? = ', json)
-    #    if json is not None:
-    #        df = pd.read_json(json, orient='records')
-    #    else:
-    #        df = _run(query)
-    #        memcached_client.set(cache_key, df.to_json(orient='records'), expire=expire)
-    #    return df
+    df = results_cache.get(cache_key)
+    if df is MISSING:
+        # sessions missing the same key at the same time share one query
+        df = query_flights.do(cache_key, _run_and_cache,
+                              query, cache_key, expire)
+    return df
+
+
+def run_query_many(queries, cache_keys, expire=3600):
+    """
+    Batched run_query: only the queries missing from the cache are run,
+    together in one call to get_daily_UR_many, less any already being run
+    for another session, whose results are waited for instead.
+    """
+    keys = dict(zip(queries, cache_keys))
+    cached = results_cache.get_many(cache_keys)
+    missing = [query for query in queries if keys[query] not in cached]
+
+    results = {query: cached[keys[query]]
+               for query in queries if keys[query] in cached}
+    if missing:
+        queries_by_key = {keys[query]: query for query in missing}
+        fetched = query_flights.do_many(
+            list(queries_by_key),
+            partial(_run_many_and_cache, queries_by_key, expire))
+        results.update((queries_by_key[key], value)
+                       for key, value in fetched.items())
+    return results
 
 
 def convert_coords(x1, y1):
@@ -97,3 +205,8 @@ def convert_coords(x1, y1):
 
 
 memcached_discovery = MemcachedDiscovery()
+results_cache = TieredCache(
+    memcached_discovery.get_client, max_bytes=CACHE_MAX_BYTES,
+    shared=(SharedCache(os.path.join(SHARED_DIR, 'series'),
+                        SHARED_CACHE_MAX_BYTES) if SHARED_DIR else None))
+query_flights = SingleFlight()
@@ -0,0 +1,237 @@
+"""
+Background work for the bokeh callbacks.
+
+Session callbacks run on the Tornado IOLoop holding the document lock, so
+a slow query in one session would stall every other session of the
+process.  Instead the data work is submitted to a process-wide thread
+pool and its result applied back to the document from a next tick
+callback, the only safe way to touch a document from another thread.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+
+from config import WORKER_THREADS
+
+EXECUTOR = ThreadPoolExecutor(max_workers=WORKER_THREADS)
+
+
+class ExecutorStats:
+    """
+    Queue depth and queueing time of the jobs submitted to EXECUTOR.
+    """
+
+    def __init__(self):
+        self.submitted = 0
+        self.queued = 0
+        self.wait_time_total = 0
+        self.wait_time_max = 0
+        self._lock = threading.Lock()
+
+    def job_submitted(self):
+        with self._lock:
+            self.submitted += 1
+            self.queued += 1
+
+    def job_started(self, wait_time):
+        with self._lock:
+            self.queued -= 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def job_cancelled(self, future):
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'threads': WORKER_THREADS,
+                    'submitted': self.submitted,
+                    'queue_depth': self.queued,
+                    'wait_time_total': self.wait_time_total,
+                    'wait_time_max': self.wait_time_max}
+
+
+EXECUTOR_STATS = ExecutorStats()
+
+
+def _timed(submitted, fn, *args):
+    EXECUTOR_STATS.job_started(time.time() - submitted)
+    return fn(*args)
+
+
+def submit(fn, *args):
+    """
+    Run fn(*args) on the process-wide worker pool.
+    """
+    EXECUTOR_STATS.job_submitted()
+    future = EXECUTOR.submit(_timed, time.time(), fn, *args)
+    future.add_done_callback(EXECUTOR_STATS.job_cancelled)
+    return future
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: while a call for a key
+    is in flight, other callers (from any session of the process) wait
+    for its result instead of running the same query again.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.wait_time_total = 0
+        self.wait_time_max = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args):
+        """
+        Return fn(*args), or the result of the call already in flight
+        for key.
+        """
+        return self.do_many([key], lambda keys: {key: fn(*args)})[key]
+
+    def do_many(self, keys, fn):
+        """
+        fn(keys) for the keys not already in flight, in one call.
+        :param fn: takes a list of keys and returns a dict of key to result
+        :return: dict of key to result for all the keys
+        """
+        with self._lock:
+            self.calls += len(keys)
+            waiting = {k: self._in_flight[k] for k in keys
+                       if k in self._in_flight}
+            leading = {k: Future() for k in keys if k not in waiting}
+            self._in_flight.update(leading)
+            self.coalesced += len(waiting)
+
+        results = {}
+        if leading:
+            error = None
+            try:
+                results = fn(list(leading))
+                for k, future in leading.items():
+                    future.set_result(results[k])
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                # other callers block on these futures: whatever fn did,
+                # none of them may be left unresolved
+                for future in leading.values():
+                    if not future.done():
+                        future.set_exception(error)
+                with self._lock:
+                    for k in leading:
+                        del self._in_flight[k]
+
+        if waiting:
+            t0 = time.time()
+            for k, future in waiting.items():
+                results[k] = future.result()
+            wait_time = time.time() - t0
+            with self._lock:
+                self.wait_time_total += wait_time
+                self.wait_time_max = max(self.wait_time_max, wait_time)
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls,
+                    'coalesced': self.coalesced,
+                    'in_flight': len(self._in_flight),
+                    'wait_time_total': self.wait_time_total,
+                    'wait_time_max': self.wait_time_max}
+
+
+class LatestTask:
+    """
+    One kind of background update of a document, e.g. refreshing the
+    hydrograph.  Every run supersedes the previous ones: a result is only
+    applied if no newer run was started in the meantime, so a slow query
+    for an earlier selection never overwrites a newer one.
+    """
+
+    def __init__(self, doc, name):
+        self.doc = doc
+        self.name = name
+        self.generation = 0
+        self._futures = []
+
+    def run(self, fn, args, callback, errback=None):
+        """
+        Call fn(*args) on a worker thread, then callback(result) on the
+        document's thread, unless run() was called again in between.
+        :param errback: called with the exception, on the document's
+            thread, if fn raises
+        """
+        self.cancel()
+        future = submit(fn, *args)
+        self._futures = [future]
+        future.add_done_callback(partial(self._schedule, self.generation,
+                                         callback, errback))
+        return future
+
+    def run_each(self, fn, items, callback, done=None, errback=None):
+        """
+        Call fn(item) for every item on the worker threads, and
+        callback(item, result) on the document's thread as each one
+        completes, in completion order; then done() once all are applied.
+        A failure calls errback(error) and drops the remaining results.
+        """
+        self.cancel()
+        remaining = [len(items)]
+
+        def item_done(item, result):
+            callback(item, result)
+            remaining[0] -= 1
+            if remaining[0] == 0 and done is not None:
+                done()
+
+        def item_failed(error):
+            self.cancel()
+            if errback is not None:
+                errback(error)
+
+        self._futures = []
+        for item in items:
+            future = submit(fn, item)
+            self._futures.append(future)
+            future.add_done_callback(partial(
+                self._schedule, self.generation, partial(item_done, item),
+                item_failed))
+        if not items and done is not None:
+            done()
+        return self._futures
+
+    def cancel(self):
+        """
+        Drop the results of any run still in progress.
+        """
+        self.generation += 1
+        # superseded work that hasn't started yet is not worth starting
+        for future in self._futures:
+            future.cancel()
+        self._futures = []
+
+    def _schedule(self, generation, callback, errback, future):
+        # called on the worker thread
+        self.doc.add_next_tick_callback(partial(
+            self._apply, generation, callback, errback, future))
+
+    def _apply(self, generation, callback, errback, future):
+        if generation != self.generation or future.cancelled():
+            logging.debug('{}: dropped the result of a superseded run'.format(
+                self.name))
+            return
+        error = future.exception()
+        if error is None:
+            callback(future.result())
+            return
+        logging.error('{} failed: {!r}'.format(self.name, error))
+        if errback is not None:
+            errback(error)
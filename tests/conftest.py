@@ -0,0 +1,10 @@
+import os
+import sys
+
+# the dashboard modules import each other flat, from the dashboard
+# directory, and read their settings from the environment on import
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'dashboard'))
+os.environ['WSC_SHARED_DIR'] = ''
+os.environ['WSC_QUERY_PROCESSES'] = '0'
+os.environ['WSC_PROFILE_RATE'] = '0'
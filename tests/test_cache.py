@@ -0,0 +1,204 @@
+"""
+The station series cache tiers, against an in-memory stand-in for the
+pymemcache client.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from cache import (MISSING, LRUCache, SharedCache, TieredCache,
+                   deserialize_frame, frame_nbytes, serialize_frame)
+
+
+class FakeMemcached:
+    """
+    The part of pymemcache's HashClient the cache uses, backed by a dict.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.get_calls = []
+        self.set_calls = []
+
+    def get_many(self, keys):
+        self.get_calls.append(list(keys))
+        return {k: self.data[k] for k in keys if k in self.data}
+
+    def set_many(self, values, expire=0):
+        self.set_calls.append((dict(values), expire))
+        self.data.update(values)
+        return []
+
+
+class BrokenMemcached:
+
+    def get_many(self, keys):
+        raise ConnectionRefusedError('no memcached')
+
+    def set_many(self, values, expire=0):
+        raise ConnectionRefusedError('no memcached')
+
+
+def station_frame(station, n=100, start='2000-01-01'):
+    # as get_station_data.make_daily_UR_frame builds it
+    index = pd.DatetimeIndex((np.datetime64(start, 'D') + np.arange(n)).astype(
+        'datetime64[ns]'), name='DATE')
+    return pd.DataFrame({
+        'DAILY_UR_{}'.format(station): np.linspace(1, 2, n).astype(np.float32),
+        'FLAG_{}'.format(station): pd.Categorical(
+            (['E', None, 'B', None] * n)[:n], categories=['A', 'B', 'E'])},
+        index=index)
+
+
+def assert_frames_equal(a, b):
+    pd.testing.assert_frame_equal(a, b, check_categorical=False,
+                                  check_freq=False)
+
+
+def test_serialize_round_trip():
+    df = station_frame('01AA001')
+    assert_frames_equal(deserialize_frame(serialize_frame(df)), df)
+    assert deserialize_frame(serialize_frame(None)) is None
+
+
+def test_lru_hit_miss_and_recency():
+    cache = LRUCache(max_bytes=100, sizeof=len)
+    assert cache.get('a') is MISSING
+    cache.set('a', b'x' * 40)
+    cache.set('b', b'y' * 40)
+    assert cache.get('a') == b'x' * 40
+    # 'b' is now the least recently used
+    cache.set('c', b'z' * 40)
+    assert cache.get('b') is MISSING
+    assert cache.get('a') is not MISSING
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 2, 1)
+    assert stats['bytes'] == 80
+
+
+def test_lru_evicts_by_bytes_not_count():
+    frames = {i: station_frame('01AA00{}'.format(i), n=1000) for i in range(3)}
+    size = frame_nbytes(frames[0])
+    cache = LRUCache(max_bytes=int(2.5 * size))
+    for i, df in frames.items():
+        cache.set(i, df)
+    assert len(cache) == 2
+    assert cache.get(0) is MISSING
+    assert cache.nbytes <= cache.max_bytes
+
+
+def test_lru_skips_values_larger_than_the_cache():
+    cache = LRUCache(max_bytes=10, sizeof=len)
+    cache.set('big', b'x' * 11)
+    assert cache.get('big') is MISSING
+    assert cache.nbytes == 0
+
+
+def test_local_hits_dont_reach_memcached():
+    client = FakeMemcached()
+    cache = TieredCache(lambda: client, max_bytes=2**20)
+    df = station_frame('01AA001')
+    cache.set('01AA001', df)
+    assert list(client.data) == ['01AA001']
+    assert_frames_equal(cache.get('01AA001'), df)
+    assert client.get_calls == []
+
+
+def test_remote_hits_fill_the_local_tier():
+    client = FakeMemcached()
+    df = station_frame('01AA001')
+    TieredCache(lambda: client, max_bytes=2**20).set_many(
+        {'01AA001': df, '01AA002': None}, expire=60)
+    assert client.set_calls[0][1] == 60
+
+    # another process: empty local tier, same memcached
+    cache = TieredCache(lambda: client, max_bytes=2**20)
+    found = cache.get_many(['01AA001', '01AA002', '01AA003'])
+    assert_frames_equal(found['01AA001'], df)
+    # None, a station without records, is a cached value too
+    assert '01AA002' in found and found['01AA002'] is None
+    assert '01AA003' not in found
+    assert client.get_calls == [['01AA001', '01AA002', '01AA003']]
+
+    # now local: only the real miss goes to memcached
+    cache.get_many(['01AA001', '01AA002', '01AA003'])
+    assert client.get_calls[-1] == ['01AA003']
+    stats = cache.stats()
+    assert stats['remote_hits'] == 2
+    assert stats['remote_misses'] == 2
+    assert stats['local_hits'] == 2
+
+
+def test_no_memcached_client():
+    cache = TieredCache(lambda: None, max_bytes=2**20)
+    assert cache.get('01AA001') is MISSING
+    df = station_frame('01AA001')
+    cache.set('01AA001', df)
+    assert_frames_equal(cache.get('01AA001'), df)
+    assert cache.stats()['remote_errors'] == 0
+
+
+def test_memcached_errors_are_counted_not_raised():
+    cache = TieredCache(lambda: BrokenMemcached(), max_bytes=2**20)
+    df = station_frame('01AA001')
+    cache.set('01AA001', df)
+    assert_frames_equal(cache.get('01AA001'), df)
+    assert cache.get('01AA002') is MISSING
+    stats = cache.stats()
+    assert stats['remote_errors'] == 2
+    assert stats['remote_misses'] == 1
+
+
+def test_shared_tier_between_processes(tmp_path):
+    client = FakeMemcached()
+    df = station_frame('01AA001')
+    first = TieredCache(lambda: client, max_bytes=2**20,
+                        shared=SharedCache(str(tmp_path), 2**20))
+    first.set('01AA001', df)
+
+    second = TieredCache(lambda: client, max_bytes=2**20,
+                         shared=SharedCache(str(tmp_path), 2**20))
+    assert_frames_equal(second.get('01AA001'), df)
+    assert client.get_calls == []
+    assert second.stats()['shared_hits'] == 1
+
+
+def test_shared_tier_evicts_least_recently_used(tmp_path):
+    df = station_frame('01AA001')
+    shared = SharedCache(str(tmp_path), max_bytes=2 * len(serialize_frame(df)))
+    shared.set('a', df)
+    shared.set('b', df)
+    past = time.time() - 60
+    os.utime(str(tmp_path / 'a'), (past, past))
+    os.utime(str(tmp_path / 'b'), (past + 1, past + 1))
+    # a hit makes 'a' the most recently used
+    assert shared.get('a') is not MISSING
+    shared.set('c', df)
+    assert shared.get('b') is MISSING
+    assert shared.get('a') is not MISSING
+    assert shared.stats()['evictions'] == 1
+
+
+def test_counters_under_concurrent_use():
+    client = FakeMemcached()
+    # one day: cheap to decode, so the threads overlap in the counting
+    client.data['hit'] = serialize_frame(station_frame('01AA001', n=1))
+    caches = [TieredCache(lambda: client, max_bytes=0) for _ in range(2)]
+
+    def lookups(cache):
+        for _ in range(100):
+            cache.get_many(['hit', 'miss'])
+
+    threads = [threading.Thread(target=lookups, args=(caches[i % 2],))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for cache in caches:
+        stats = cache.stats()
+        # max_bytes=0: nothing stays local, every lookup goes remote
+        assert stats['remote_hits'] == stats['remote_misses'] == 400
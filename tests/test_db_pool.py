@@ -0,0 +1,37 @@
+"""
+Connections of the HYDAT connection pool.
+"""
+import sqlite3
+
+import pytest
+
+import db_pool
+from db_pool import ConnectionPool
+
+
+def test_connection_failing_a_pragma_is_closed(tmp_path, monkeypatch):
+    db_file = str(tmp_path / 'Hydat.sqlite3')
+    sqlite3.connect(db_file).close()
+    opened = []
+
+    class Connection(sqlite3.Connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.closed = False
+            opened.append(self)
+
+        def close(self):
+            self.closed = True
+            super().close()
+
+    connect = sqlite3.connect
+    monkeypatch.setattr(db_pool.sqlite3, 'connect', lambda *args, **kwargs:
+                        connect(*args, factory=Connection, **kwargs))
+
+    pool = ConnectionPool(db_file)
+    pool.pragmas.append(('no_such', 'syntax error'))
+    with pytest.raises(sqlite3.Error):
+        with pool.connection():
+            pass
+    assert [conn.closed for conn in opened] == [True]
+    assert pool.stats()['size'] == 0
@@ -0,0 +1,57 @@
+"""
+The min/max level-of-detail rows of the hydrograph.
+"""
+import numpy as np
+
+from downsample import bucket_bounds, minmax_downsample, view_rows
+
+DAY_MS = 86400000
+
+
+def hydrograph(n_days=3650, n_series=3, seed=0):
+    rng = np.random.RandomState(seed)
+    x = np.arange(n_days, dtype=np.int64) * DAY_MS
+    ys = rng.gamma(2, 10, (n_days, n_series)).astype(np.float32)
+    ys[100:130, 1] = np.nan
+    return x, ys
+
+
+def test_points_are_at_their_own_times():
+    x, ys = hydrograph()
+    rows = minmax_downsample(x, ys, 200)
+    assert rows.shape == (400, ys.shape[1])
+    for j in range(ys.shape[1]):
+        # x and y of a series come from the same rows, in time order
+        assert (np.diff(rows[:, j]) >= 0).all()
+        # so every extreme is drawn where it happened
+        assert np.nanargmax(ys[:, j]) in rows[:, j]
+        assert np.nanargmin(ys[:, j]) in rows[:, j]
+    # the series peak on different days, so their rows differ
+    assert not (rows[:, 0] == rows[:, 1]).all()
+
+
+def test_bucket_extremes_are_kept():
+    x, ys = hydrograph()
+    rows = minmax_downsample(x, ys, 10)[:, 0]
+    for start, end in zip(*bucket_bounds(x, 10)):
+        kept = rows[(rows >= start) & (rows < end)]
+        assert len(kept) == 2
+        assert ys[kept, 0].max() == ys[start:end, 0].max()
+        assert ys[kept, 0].min() == ys[start:end, 0].min()
+
+
+def test_short_windows_keep_every_row():
+    x, ys = hydrograph(n_days=50)
+    rows = minmax_downsample(x, ys, 100)
+    assert (rows == np.arange(50)[:, np.newaxis]).all()
+
+
+def test_view_rows_refines_the_window():
+    x, ys = hydrograph()
+    start, end = x[1000], x[1365]
+    rows = view_rows(x, ys, 200, start, end)
+    assert rows.shape[1] == ys.shape[1]
+    in_window = rows[(x[rows[:, 0]] >= start) & (x[rows[:, 0]] <= end), 0]
+    # 366 days over 200 buckets: every day
+    assert len(np.unique(in_window)) == 366
+    assert (np.diff(rows, axis=0) >= 0).all()
@@ -0,0 +1,72 @@
+"""
+Merging station series onto one calendar, all at once or as they arrive.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from merge import MergedSeries
+
+
+def station_frame(station, start, n, ur=True):
+    # as get_station_data.make_daily_UR_frame builds it
+    index = pd.DatetimeIndex((np.datetime64(start, 'D') + np.arange(n)).astype(
+        'datetime64[ns]'), name='DATE')
+    columns = {}
+    if ur:
+        columns['DAILY_UR_{}'.format(station)] = np.linspace(
+            1, 2, n).astype(np.float32)
+    columns['FLAG_{}'.format(station)] = pd.Categorical(
+        (['E', None, 'B'] * n)[:n], categories=['A', 'B', 'E'])
+    return pd.DataFrame(columns, index=index)
+
+
+FRAMES = {
+    '01AA001': station_frame('01AA001', '1990-01-01', 400),
+    # before and after the first
+    '01AA002': station_frame('01AA002', '1985-06-01', 200),
+    '01AA003': station_frame('01AA003', '1995-03-01', 100, ur=False),
+    # within the others
+    '01AA004': station_frame('01AA004', '1990-02-01', 30),
+    '01AA005': None,
+}
+
+
+def assert_same_merge(a, b):
+    assert a.stations == b.stations
+    assert a.first_day == b.first_day
+    np.testing.assert_array_equal(a.dates_ms, b.dates_ms)
+    np.testing.assert_array_equal(a.has_ur, b.has_ur)
+    np.testing.assert_array_equal(a.ur, b.ur)
+    np.testing.assert_array_equal(a.flags, b.flags)
+
+
+def test_adding_as_they_arrive_matches_one_merge():
+    for order in itertools.permutations(FRAMES):
+        merged = MergedSeries({order[0]: FRAMES[order[0]]})
+        for station in order[1:]:
+            merged.add({station: FRAMES[station]})
+        expected = MergedSeries({k: FRAMES[k] for k in order})
+        assert_same_merge(merged, expected)
+
+
+def test_calendar_only_grows_when_needed():
+    merged = MergedSeries({'01AA001': FRAMES['01AA001']})
+    ur = merged.ur
+    assert merged.covers({'01AA004': FRAMES['01AA004']})
+    merged.extend({'01AA004': FRAMES['01AA004']})
+    assert merged.ur is ur
+    assert not merged.covers({'01AA002': FRAMES['01AA002']})
+    merged.add({'01AA002': FRAMES['01AA002']})
+    assert merged.covers({k: FRAMES[k] for k in merged.stations})
+    assert merged.dates_ms[0] == pd.Timestamp('1985-06-01').value // 10**6
+
+
+def test_drop_keeps_the_others():
+    merged = MergedSeries(FRAMES)
+    merged.drop(['01AA002'])
+    expected = MergedSeries(FRAMES)
+    keep = [expected.stations.index(e) for e in merged.stations]
+    np.testing.assert_array_equal(merged.ur, expected.ur[:, keep])
+    np.testing.assert_array_equal(merged.flags, expected.flags[:, keep])
@@ -0,0 +1,50 @@
+"""
+Metrics dumps of the pod's processes, as /metrics collects them.
+"""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    return tmp_path
+
+
+def exited_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def write_dump(path, pid):
+    snap = dict(metrics.snapshot(), pid=pid)
+    with open(str(path / '{}.json'.format(pid)), 'w') as f:
+        json.dump(snap, f)
+
+
+def test_collect_removes_the_dumps_of_exited_processes(metrics_dir):
+    parent, dead = os.getppid(), exited_pid()
+    write_dump(metrics_dir, parent)
+    write_dump(metrics_dir, dead)
+    pids = [snap['pid'] for snap in metrics.collect()]
+    assert pids == [os.getpid(), parent]
+    assert sorted(os.listdir(str(metrics_dir))) == ['{}.json'.format(parent)]
+
+
+def test_dumper_removes_its_dump(metrics_dir):
+    dumper = metrics.MetricsDumper(str(metrics_dir))
+    dumper._pid = os.getpid()
+    dumper.dump()
+    assert os.listdir(str(metrics_dir)) == ['{}.json'.format(os.getpid())]
+    dumper.remove()
+    assert os.listdir(str(metrics_dir)) == []
+    # a dump that was being written when the process was shutting down
+    dumper.dump()
+    assert os.listdir(str(metrics_dir)) == []
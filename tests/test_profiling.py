@@ -0,0 +1,64 @@
+"""
+Profiles of calls on worker threads, and the tracemalloc lifetime.
+"""
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import profiling
+
+
+def busy_query(seconds, started=None, release=None):
+    if started is not None:
+        started.set()
+        release.wait(5)
+    t0 = time.time()
+    rows = []
+    while time.time() - t0 < seconds:
+        rows.append(bytearray(1024))
+    return len(rows)
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def test_worker_thread_calls_are_profiled(profile_dir):
+    with ThreadPoolExecutor(1) as executor:
+        assert executor.submit(profiling.profile_call, 'session', 'query',
+                               busy_query, 0.1).result() > 0
+    profiles = list(profiling.load_profiles(str(profile_dir)))
+    assert len(profiles) == 1
+    # the worker thread's own stack, not the submitting thread's
+    assert any('busy_query' in stack for stack in profiles[0]['stacks'])
+    assert profiles[0]['allocations']
+    assert not tracemalloc.is_tracing()
+
+
+def test_tracemalloc_runs_until_the_last_profiled_call(profile_dir):
+    started, release = threading.Event(), threading.Event()
+    with ThreadPoolExecutor(2) as executor:
+        slow = executor.submit(profiling.profile_call, 'session', 'slow',
+                               busy_query, 0.05, started, release)
+        assert started.wait(5)
+        profiling.profile_call('session', 'fast', busy_query, 0.01)
+        # the slow call is still running: its tracing must go on
+        assert tracemalloc.is_tracing()
+        release.set()
+        slow.result()
+    assert not tracemalloc.is_tracing()
+    assert len(list(profiling.load_profiles(str(profile_dir)))) == 2
+
+
+def test_tracing_started_elsewhere_is_left_on(profile_dir):
+    tracemalloc.start()
+    try:
+        profiling.profile_call('session', 'query', busy_query, 0.01)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,61 @@
+"""
+Station queries in the query processes, handed back through shared
+memory files.
+"""
+import os
+import sqlite3
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+import get_station_data as gsd
+import shm
+
+
+class Executor:
+    """
+    Stands in for the process pool: each station's job has already
+    failed, finished or not started yet.
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+
+    def submit(self, fn, station):
+        future = Future()
+        outcome = self.outcomes[station]
+        if isinstance(outcome, Exception):
+            future.set_exception(outcome)
+        elif outcome == 'done':
+            days = np.arange(10, dtype=np.int32) + 10000
+            future.set_result(shm.write_arrays([
+                np.ones(10), days, np.zeros(10, dtype=np.uint8)]) + (['E'],))
+        return future
+
+
+@pytest.fixture
+def shm_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(shm, 'SHM_DIR', str(tmp_path))
+    monkeypatch.setattr(gsd, 'IDS_AND_DAS', {
+        '01AA001': 10.0, '01AA002': 10.0, '01AA003': 10.0, '01AA004': 10.0})
+    return tmp_path
+
+
+def test_arrays_come_back_and_files_are_removed(shm_dir):
+    results = gsd.select_dly_flows_in_processes(
+        ['01AA001', '01AA002'], Executor({'01AA001': 'done', '01AA002': 'done'}))
+    assert len(results['01AA001']) == 10
+    assert results['01AA001']['DAILY_UR_01AA001'].iloc[0] == 100
+    assert os.listdir(str(shm_dir)) == []
+
+
+def test_a_failed_job_leaves_no_files(shm_dir):
+    executor = Executor({'01AA001': 'done',
+                         '01AA002': sqlite3.OperationalError('locked'),
+                         '01AA003': 'done',
+                         '01AA004': 'pending'})
+    with pytest.raises(sqlite3.OperationalError):
+        gsd.select_dly_flows_in_processes(
+            ['01AA001', '01AA002', '01AA003', '01AA004'], executor)
+    assert os.listdir(str(shm_dir)) == []
@@ -0,0 +1,168 @@
+"""
+Parity of the vectorized DLY_FLOWS reshape with the melt-based one it
+replaced.
+"""
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import get_station_data as gsd
+
+DLY_FLOWS_SCHEMA = (
+    'CREATE TABLE DLY_FLOWS (STATION_NUMBER TEXT, YEAR INTEGER, '
+    'MONTH INTEGER, FULL_MONTH INTEGER, NO_DAYS INTEGER, MONTHLY_MEAN REAL, '
+    'MONTHLY_TOTAL REAL, FIRST_DAY_MIN INTEGER, MIN REAL, '
+    'FIRST_DAY_MAX INTEGER, MAX REAL, {}, '
+    'PRIMARY KEY (STATION_NUMBER, YEAR, MONTH))').format(', '.join(
+        'FLOW{0} REAL, FLOW_SYMBOL{0} TEXT'.format(day) for day in range(1, 32)))
+
+DRAINAGE_AREAS = {'01AA001': 250.0, '01AA002': 0.0}
+
+
+def month_row(station, year, month, no_days, flows, symbols=None):
+    """
+    A DLY_FLOWS row; days past len(flows) hold junk, which NO_DAYS must
+    cut off.
+    """
+    symbols = symbols or {}
+    row = [station, year, month, 1, no_days, 1.0, 1.0, 1, 0.0, 1, 9.0]
+    for day in range(1, 32):
+        flow = flows[day - 1] if day <= len(flows) else 999.0
+        row += [flow, symbols.get(day, 'Z' if day > len(flows) else None)]
+    return row
+
+
+ROWS = [
+    # inserted out of order
+    month_row('01AA001', 2001, 3, 31, [1.5 + d for d in range(31)], {3: 'E'}),
+    # leap February: days 30 and 31 hold junk
+    month_row('01AA001', 2000, 2, 29, [2.0 + d for d in range(29)],
+              {1: 'B', 29: 'A'}),
+    # missing days, one of them flagged
+    month_row('01AA001', 2000, 1, 31,
+              [np.nan if d in (4, 10, 30) else 0.25 * d for d in range(31)],
+              {5: 'D', 6: 'R'}),
+    # a 30 day month reported short: NO_DAYS truncates it
+    month_row('01AA001', 2000, 4, 28, [3.0] * 30),
+    month_row('01AA002', 1999, 12, 31, [7.0] * 31, {31: 'E'}),
+]
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setattr(gsd, 'IDS_AND_DAS', DRAINAGE_AREAS)
+    conn = sqlite3.connect(str(tmp_path / 'Hydat.sqlite3'))
+    conn.execute(DLY_FLOWS_SCHEMA)
+    conn.executemany('INSERT INTO DLY_FLOWS VALUES ({})'.format(
+        ', '.join('?' * 73)), ROWS)
+    yield conn
+    conn.close()
+
+
+def melt_dly_flows(conn, station):
+    """
+    The original select_dly_flows_by_station_ID.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM DLY_FLOWS WHERE STATION_NUMBER=?", (station,))
+    rows = cur.fetchall()
+    column_headers = [description[0] for description in cur.description]
+    id_var_headers = column_headers[:11]
+
+    df = pd.DataFrame(rows, columns=column_headers)
+    df.drop(['MONTHLY_MEAN', 'MONTHLY_TOTAL', 'FIRST_DAY_MIN',
+             'MIN', 'FIRST_DAY_MAX', 'MAX'], axis=1, inplace=True)
+    # pandas of the time melted the dropped id columns as NaN, newer
+    # versions refuse them; they don't reach the output either way
+    id_var_headers = [e for e in id_var_headers if e in df.columns]
+
+    all_val_vars = [e for e in column_headers if 'FLOW' in e]
+    flag_val_vars = [e for e in all_val_vars if 'FLOW_SYMBOL' in e]
+    flow_val_vars = [e for e in all_val_vars if '_' not in e]
+
+    df_flows = pd.melt(df, id_vars=id_var_headers, value_vars=flow_val_vars,
+                       value_name='DAILY_FLOW',
+                       var_name='DAY').sort_values(by=['YEAR', 'MONTH'])
+    df_flows['DAY'] = df_flows['DAY'].apply(
+        lambda s: s[re.search(r'\d', s).span()[0]:])
+    df_flags = pd.melt(df, id_vars=id_var_headers, value_vars=flag_val_vars,
+                       value_name='FLAG',
+                       var_name='DAY').sort_values(by=['YEAR', 'MONTH'])
+    df_flows['FLAG'] = df_flags['FLAG']
+    df_flows = df_flows[df_flows['DAY'].astype(int) <= df_flows['NO_DAYS'].astype(
+        int)].dropna(subset=['DAILY_FLOW'])
+
+    dates = df_flows['YEAR'].astype(str) + '-' + df_flows['MONTH'].astype(
+        str) + '-' + df_flows['DAY'].astype(str)
+    df_flows['DATE'] = pd.to_datetime(dates, format='%Y-%m-%d')
+
+    out = pd.DataFrame()
+    out['DATE'] = df_flows['DATE']
+    if DRAINAGE_AREAS[station] > 0:
+        out['DAILY_UR_{}'.format(station)] = (
+            df_flows['DAILY_FLOW'] / DRAINAGE_AREAS[station] * 1000)
+    out['FLAG_{}'.format(station)] = df_flows['FLAG']
+    out.set_index('DATE', inplace=True)
+    return out if len(out) > 0 else None
+
+
+def flag_values(series):
+    return [None if pd.isna(e) else e for e in series.astype(object)]
+
+
+def assert_same_frame(new, old, station):
+    # the melt left the days of a month in no particular order
+    old = old.sort_index(kind='stable')
+    assert list(new.columns) == list(old.columns)
+    assert new.index.name == 'DATE'
+    assert new.index.is_monotonic_increasing
+    pd.testing.assert_index_equal(new.index, old.index, exact=False,
+                                  check_names=True)
+    ur = 'DAILY_UR_{}'.format(station)
+    if ur in old:
+        # unit runoff is float32 now
+        np.testing.assert_allclose(new[ur].values, old[ur].values, rtol=1e-6)
+    flag = 'FLAG_{}'.format(station)
+    assert flag_values(new[flag]) == flag_values(old[flag])
+
+
+@pytest.mark.parametrize('station', sorted(DRAINAGE_AREAS))
+def test_single_station_matches_melt(conn, station):
+    new = gsd.select_dly_flows_by_station_ID(conn, station)
+    assert_same_frame(new, melt_dly_flows(conn, station), station)
+
+
+def test_batched_stations_match_melt(conn):
+    frames = gsd.select_dly_flows_by_station_IDs(conn, sorted(DRAINAGE_AREAS))
+    for station in DRAINAGE_AREAS:
+        assert_same_frame(frames[station], melt_dly_flows(conn, station),
+                          station)
+
+
+def test_days_past_no_days_and_missing_flows_are_dropped(conn):
+    frame = gsd.select_dly_flows_by_station_ID(conn, '01AA001')
+    dates = frame.index
+    assert pd.Timestamp('2000-02-29') in dates
+    assert not ((dates.year == 2000) & (dates.month == 4) &
+                (dates.day > 28)).any()
+    # NaN flows on 5, 11 and 31 January
+    for day in (5, 11, 31):
+        assert pd.Timestamp(2000, 1, day) not in dates
+    assert len(frame) == 29 + 28 + 28 + 31
+    # flags of kept days survive, junk symbols past NO_DAYS don't
+    assert frame.loc['2000-01-06', 'FLAG_01AA001'] == 'R'
+    assert 'Z' not in flag_values(frame['FLAG_01AA001'])
+
+
+def test_zero_drainage_area_has_flags_only(conn):
+    frame = gsd.select_dly_flows_by_station_ID(conn, '01AA002')
+    assert list(frame.columns) == ['FLAG_01AA002']
+    assert len(frame) == 31
+
+
+def test_unknown_station_is_none(conn, monkeypatch):
+    monkeypatch.setitem(DRAINAGE_AREAS, '01AA003', 10.0)
+    assert gsd.select_dly_flows_by_station_ID(conn, '01AA003') is None
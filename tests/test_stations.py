@@ -0,0 +1,101 @@
+"""
+The station catalog snapshot, the lookups over its columns and the
+station searches on them.
+"""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+import utm
+
+import stations
+from spatial_index import StationIndex
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    return stations.read_stations_csv()
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    stations.write_catalog_snapshot(str(tmp_path))
+    return stations.load_catalog_snapshot(str(tmp_path))
+
+
+def test_snapshot_columns_are_mapped(catalog, snapshot):
+    stations_df, xyz = catalog
+    columns, snapshot_xyz = snapshot
+    assert list(columns) == list(stations_df.columns)
+    for values in columns.values():
+        assert isinstance(values.base, np.memmap)
+    assert columns['Station Name'].dtype.kind == 'U'
+    np.testing.assert_array_equal(snapshot_xyz, xyz)
+
+
+def test_snapshot_search_matches_csv(catalog, snapshot):
+    stations_df, xyz = catalog
+    columns, snapshot_xyz = snapshot
+    index = StationIndex(columns, snapshot_xyz, columns['Elevation'])
+    result = index.query_radius(49.25, -123.1, 50)
+    assert len(result) > 1
+    expected = stations_df.iloc[result.index]
+    pd.testing.assert_frame_equal(
+        result.drop(columns='distance_to_target'), expected,
+        check_dtype=False)
+    assert result['distance_to_target'].is_monotonic_increasing
+
+
+def test_stale_snapshot_is_not_loaded(tmp_path):
+    filename = str(tmp_path / 'stations.csv')
+    shutil.copy(stations.STATIONS_CSV, filename)
+    path = str(tmp_path / 'catalog')
+    stations.write_catalog_snapshot(path, filename)
+    assert stations.load_catalog_snapshot(path, filename) is not None
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert stations.load_catalog_snapshot(path, filename) is None
+
+
+def test_lookups(catalog):
+    stations_df, _ = catalog
+    row = stations_df.iloc[100]
+    number = row['Station Number']
+    assert stations.IDS_TO_NAMES[number] == '{}: {}'.format(
+        number, row['Station Name'])
+    assert stations.NAMES_TO_IDS[row['Station Name']] == number
+    assert stations.IDS_AND_DAS[number] == row['Gross Drainage Area (km2)']
+    assert stations.IDS_AND_COORDS[number] == (row['Latitude'],
+                                               row['Longitude'])
+    assert len(stations.IDS_TO_NAMES) == len(stations_df)
+    assert list(stations.IDS_TO_NAMES)[:3] == \
+        stations_df['Station Number'].tolist()[:3]
+
+
+def test_lookup_missing_keys():
+    for key in ['00XX000', '', None, 1]:
+        assert key not in stations.IDS_AND_DAS
+        with pytest.raises(KeyError):
+            stations.IDS_AND_DAS[key]
+    assert stations.IDS_AND_DAS.get('00XX000') is None
+
+
+def test_zone_numbers_match_utm():
+    # the Norway and Svalbard exceptions and the zone edges around them
+    lat = np.array([49.25, -33.9, 60, 60, 56, 64, 78, 78, 78, 78, 78, 84, 71.9])
+    lon = np.array([-123.1, 18.4, 5, 2.9, 3, 3, 8.9, 9, 20, 33, 41.9, 0, 8])
+    expected = [utm.latlon_to_zone_number(*e) for e in zip(lat, lon)]
+    assert stations.latlon_to_zone_number(lat, lon).tolist() == expected
+
+
+def test_search_with_a_missing_elevation(snapshot):
+    columns, xyz = snapshot
+    elevation = np.array(columns['Elevation'])
+    elevation[::2] = np.nan
+    result = StationIndex(columns, xyz, elevation).query_radius(
+        49.25, -123.1, 50)
+    assert len(result) > 1
+    assert not result['distance_to_target'].isnull().any()
+    assert (result['distance_to_target'] <= 50).all()
@@ -0,0 +1,70 @@
+"""
+Memcached membership changes applied by MemcachedDiscovery.
+"""
+import socket
+
+import pytest
+
+import utils
+from utils import MemcachedDiscovery
+
+
+@pytest.fixture
+def dns(monkeypatch):
+    """
+    The IPs the memcached service resolves to, as a list to edit.
+    """
+    ips = []
+
+    def gethostbyname_ex(host):
+        if not ips:
+            raise socket.gaierror('no pods')
+        return host, [], list(ips)
+
+    monkeypatch.setattr(utils.socket, 'gethostbyname_ex', gethostbyname_ex)
+    return ips
+
+
+def test_unchanged_nodes_keep_their_pool(dns):
+    discovery = MemcachedDiscovery(port=11211)
+    dns.extend(['10.0.0.1', '10.0.0.2'])
+    discovery._resync()
+    first = discovery._client
+    node = first.clients['10.0.0.1:11211']
+    # a pooled connection, as a request thread leaves it
+    connection = node.client_pool.get()
+    node.client_pool.release(connection)
+
+    dns[:] = ['10.0.0.1', '10.0.0.3']
+    discovery._resync()
+    second = discovery._client
+    assert second is not first
+    assert sorted(second.clients) == ['10.0.0.1:11211', '10.0.0.3:11211']
+    assert second.clients['10.0.0.1:11211'] is node
+    assert list(node.client_pool.free) == [connection]
+    # the hasher only knows the current nodes
+    nodes = {second.hasher.get_node('key-{}'.format(i)) for i in range(200)}
+    assert nodes == {'10.0.0.1:11211', '10.0.0.3:11211'}
+    assert discovery.stats()['membership_changes'] == 4
+
+
+def test_no_change_keeps_the_client(dns):
+    discovery = MemcachedDiscovery(port=11211)
+    dns.append('10.0.0.1')
+    discovery._resync()
+    client = discovery._client
+    discovery._resync()
+    assert discovery._client is client
+    assert discovery.stats()['resyncs'] == 2
+
+
+def test_no_nodes_no_client(dns):
+    discovery = MemcachedDiscovery(port=11211)
+    dns.append('10.0.0.1')
+    discovery._resync()
+    del dns[:]
+    discovery._resync()
+    assert discovery._client is None
+    dns.append('10.0.0.1')
+    discovery._resync()
+    assert sorted(discovery._client.clients) == ['10.0.0.1:11211']
@@ -0,0 +1,101 @@
+"""
+Coalescing of concurrent station queries by SingleFlight.
+"""
+import sys
+import threading
+import time
+
+import pytest
+
+from workers import SingleFlight
+
+
+def in_flight_call(flight, keys, fn):
+    """
+    Start flight.do_many(keys, fn) on a thread that stays in fn until
+    released.
+    :return: (thread, release event, dict the outcome is stored in)
+    """
+    entered, release = threading.Event(), threading.Event()
+    outcome = {}
+
+    def blocked(keys):
+        entered.set()
+        release.wait(5)
+        return fn(keys)
+
+    def run():
+        try:
+            outcome['result'] = flight.do_many(keys, blocked)
+        except BaseException as e:
+            outcome['error'] = e
+
+    # daemons, so a caller left waiting fails the test, not the run
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert entered.wait(5)
+    return thread, release, outcome
+
+
+def wait_coalesced(flight, timeout=5):
+    """
+    Wait for a call to join the one in flight.
+    """
+    deadline = time.time() + timeout
+    while flight.stats()['coalesced'] < 1:
+        assert time.time() < deadline, 'no call was coalesced'
+        time.sleep(0.001)
+
+
+def waiter(flight, keys, fn):
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = flight.do_many(keys, fn)
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, outcome
+
+
+def test_concurrent_calls_share_the_query():
+    flight = SingleFlight()
+    queried = []
+
+    def query(keys):
+        queried.append(sorted(keys))
+        return {k: k.lower() for k in keys}
+
+    leader, release, led = in_flight_call(flight, ['A', 'B'], query)
+    thread, waited = waiter(flight, ['B', 'C'], query)
+    wait_coalesced(flight)
+    release.set()
+    leader.join(5)
+    thread.join(5)
+    assert led['result'] == {'A': 'a', 'B': 'b'}
+    assert waited['result'] == {'B': 'b', 'C': 'c'}
+    assert sorted(queried) == [['A', 'B'], ['C']]
+    assert flight.stats()['in_flight'] == 0
+
+
+@pytest.mark.parametrize('fn, error', [
+    (lambda keys: 1 / 0, ZeroDivisionError),
+    # a result missing one of the keys
+    (lambda keys: {}, KeyError),
+    (lambda keys: sys.exit(), SystemExit),
+])
+def test_waiters_get_the_leaders_error(fn, error):
+    flight = SingleFlight()
+    leader, release, led = in_flight_call(flight, ['A'], fn)
+    thread, waited = waiter(flight, ['A'], fn)
+    wait_coalesced(flight)
+    release.set()
+    leader.join(5)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert isinstance(led['error'], error)
+    assert isinstance(waited['error'], error)
+    assert flight.stats()['in_flight'] == 0